@@ -6,7 +6,8 @@ from django.utils import timezone
 from django.utils.safestring import mark_safe
 
 from vsdk.nums.models.custom_elements import NumberPresentation
-from vsdk.service_development.models import CallSession, Language, VoiceService
+from vsdk.service_development.models import (CallSession, Language, VoiceService,
+                                             get_element_or_404)
 from vsdk.service_development.views import choice_generate_context
 
 
@@ -14,8 +15,8 @@ def generate_number(request: HttpRequest, element_id: int, session_id: int) -> H
     """
     Generate a random number using the current language.
     """
-    element = get_object_or_404(NumberPresentation, pk=element_id)
     session = get_object_or_404(CallSession, pk=session_id)
+    element = get_element_or_404(NumberPresentation, element_id, session)
     session.record_step(element)
 
     number = randint(1, 9999)
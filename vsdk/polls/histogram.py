@@ -0,0 +1,171 @@
+import threading
+from collections import ChainMap, Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.timezone import utc
+
+from vsdk.polls.models import Poll, Vote, VoteOption
+
+BUCKETS = ('minute', 'hour', 'day')
+
+Point = Tuple[datetime, Dict[int, int]]
+
+
+def bucket_start(time: datetime, bucket: str) -> datetime:
+    """
+    Get the start of the (UTC) minute, hour or day containing time.
+    """
+    time = time.astimezone(utc).replace(second=0, microsecond=0)
+    if bucket in ('hour', 'day'):
+        time = time.replace(minute=0)
+    if bucket == 'day':
+        time = time.replace(hour=0)
+    return time
+
+
+class VoteHistogram:
+    """
+    The cumulative vote counts of the options of a poll at the end of every time bucket
+    (minute, hour or day) in which votes were cast, taking only the last vote of every
+    caller into account.
+
+    Histograms are computed in a single pass over the votes, ordered by time. Buckets
+    that ended more than POLLS_HISTOGRAM_SETTLE_TIME seconds ago are finished, and
+    kept in memory, so later requests only go through the votes since then. Finished
+    buckets are recomputed when votes are added to or removed from them afterwards in
+    this process (see votes_changed).
+    """
+    _histograms: Dict[Tuple[int, str], 'VoteHistogram'] = {}
+    _histograms_lock = threading.Lock()
+
+    def __init__(self, poll: Poll, bucket: str):
+        self.poll = poll
+        self.bucket = bucket
+        # The finished buckets, and the state of the counts at the end of them
+        self.points: List[Point] = []
+        self.finished_until: Optional[datetime] = None
+        self.caller_options: Dict[str, int] = {}
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_poll(cls, poll: Poll, bucket: str) -> 'VoteHistogram':
+        """
+        Get the histogram of a poll with the given bucket size, with its finished buckets
+        taken from memory.
+        """
+        key = (poll.id, bucket)
+        with cls._histograms_lock:
+            histogram = cls._histograms.get(key)
+            if histogram is None:
+                histogram = cls._histograms[key] = cls(poll, bucket)
+        return histogram
+
+    @classmethod
+    def invalidate(cls, poll_id: Optional[int] = None) -> None:
+        """
+        Drop the finished buckets of the histograms of a poll (or of all polls).
+        """
+        with cls._histograms_lock:
+            for key in list(cls._histograms):
+                if poll_id is None or key[0] == poll_id:
+                    del cls._histograms[key]
+
+    @classmethod
+    def votes_changed(cls, vote_option_ids: Iterable[int], since: datetime) -> None:
+        """
+        Drop the histograms whose finished buckets can contain votes of the vote options
+        cast since `since`, when the current transaction is committed.
+        """
+        vote_option_ids = set(vote_option_ids)
+        transaction.on_commit(lambda: cls._drop_finished(vote_option_ids, since))
+
+    @classmethod
+    def _drop_finished(cls, vote_option_ids: Iterable[int], since: datetime) -> None:
+        # Histograms that are being counted can finish buckets up to the settle time ago
+        settled_until = timezone.now() - timedelta(seconds=settings.POLLS_HISTOGRAM_SETTLE_TIME)
+        with cls._histograms_lock:
+            keys = [key for key, histogram in cls._histograms.items()
+                    if histogram.finished_until is not None and since < histogram.finished_until
+                    or histogram._lock.locked() and since < settled_until]
+        if not keys:
+            return
+        # Only looked up for votes in finished buckets, which are rare
+        poll_ids = set(VoteOption.objects.filter(pk__in=vote_option_ids).values_list('poll_id', flat=True))
+        with cls._histograms_lock:
+            for key in keys:
+                if key[0] in poll_ids:
+                    cls._histograms.pop(key, None)
+
+    def series(self) -> Tuple[List[Point], List[Point]]:
+        """
+        Get the finished and unfinished points of the histogram.
+
+        Every point is the start of a bucket, and the vote counts per option value at the
+        end of it.
+        """
+        with self._lock:
+            # A bucket boundary, so every bucket is either finished or unfinished
+            settled_until = bucket_start(
+                timezone.now() - timedelta(seconds=settings.POLLS_HISTOGRAM_SETTLE_TIME),
+                self.bucket)
+
+            votes = Vote.objects.filter(vote_option__poll=self.poll)
+            if self.finished_until is not None:
+                votes = votes.filter(created__gte=self.finished_until)
+            votes = votes.order_by('created', 'id').values_list(
+                'caller_id', 'vote_option__value', 'created')
+
+            caller_options = self.caller_options
+            counts = self.counts
+            points = self.points
+            unfinished_points = []
+            finished = True
+            current_bucket = None
+
+            for caller_id, option, created in votes.iterator():
+                vote_bucket = bucket_start(created, self.bucket)
+                if vote_bucket != current_bucket:
+                    if current_bucket is not None:
+                        points.append((current_bucket, dict(counts)))
+                    if finished and vote_bucket >= settled_until:
+                        # Votes in unfinished buckets are counted on top of the finished
+                        # state, without changing it
+                        finished = False
+                        caller_options = ChainMap({}, self.caller_options)
+                        counts = self.counts.copy()
+                        points = unfinished_points
+                    current_bucket = vote_bucket
+
+                previous_option = caller_options.get(caller_id)
+                if previous_option != option:
+                    if previous_option is not None:
+                        counts[previous_option] -= 1
+                    counts[option] += 1
+                    caller_options[caller_id] = option
+
+            if current_bucket is not None:
+                points.append((current_bucket, dict(counts)))
+            self.finished_until = settled_until
+
+            return list(self.points), unfinished_points
+
+
+@receiver(post_save, sender=Vote)
+def invalidate_histograms_on_vote_save(sender, instance: Vote, created: bool, **kwargs):
+    if created:
+        VoteHistogram.votes_changed([instance.vote_option_id], instance.created)
+    else:
+        # The vote option and time the vote had before are not known
+        transaction.on_commit(VoteHistogram.invalidate)
+
+
+@receiver(post_delete, sender=Vote)
+def invalidate_histograms_on_vote_delete(sender, instance: Vote, **kwargs):
+    VoteHistogram.votes_changed([instance.vote_option_id], instance.created)
@@ -0,0 +1,255 @@
+import logging
+import queue
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Optional, Set
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, QuerySet
+
+from vsdk.polls.models import Poll, Vote
+
+logger = logging.getLogger(__name__)
+
+
+def vote_to_json(vote_id: int, caller_id: str, option: int, created) -> dict:
+    """
+    Get the JSON representation of a vote, as used by votes_json and the live stream.
+    """
+    return {
+        'id': vote_id,
+        'nr': caller_id,
+        'option': option,
+        'time': int(created.timestamp())
+    }
+
+
+def votes_since(votes: QuerySet, since_id: int) -> QuerySet:
+    """
+    Filter votes to the votes after the cursor since_id: the votes with a higher id, and
+    the votes cast at most POLLS_VOTES_CURSOR_OVERLAP seconds before the vote since_id.
+
+    Ids are assigned when a vote is inserted, but it only becomes visible when it is
+    committed, so a vote with a lower id than the cursor can appear after the cursor was
+    read. Such votes are included by the overlap, and clients should de-duplicate by id.
+    """
+    since = Vote.objects.filter(pk=since_id).values_list('created', flat=True).first() \
+        if since_id > 0 else None
+    if since is None:
+        return votes.filter(id__gt=since_id)
+    overlap = timedelta(seconds=settings.POLLS_VOTES_CURSOR_OVERLAP)
+    return votes.filter(Q(id__gt=since_id) | Q(created__gt=since - overlap))
+
+
+def poll_update(poll: Poll, since_id: int, until_id: Optional[int] = None) -> dict:
+    """
+    Get the votes of a poll after the cursor since_id (see votes_since), up to and including
+    until_id, together with the current vote counts of the poll.
+
+    `cursor` is the id of the last included vote, or since_id if there are none.
+    """
+    votes = votes_since(Vote.objects.filter(vote_option__poll=poll), since_id)
+    if until_id is not None:
+        votes = votes.filter(id__lte=until_id)
+    votes = [vote_to_json(*vote) for vote in votes.order_by('id').values_list(
+        'id', 'caller_id', 'vote_option__value', 'created').iterator()]
+    return {
+        'cursor': max([since_id] + [vote['id'] for vote in votes]),
+        'votes': votes,
+        'tally': [{'option': result.vote_value, 'count': result.vote_count}
+                  for result in poll.count_votes()],
+    }
+
+
+class PollSnapshot:
+    """
+    The recent votes and the vote counts of a poll, shared by all clients that poll
+    for new votes in this process (when POLLS_LIVE_STREAMING is not set).
+
+    The snapshot is refreshed at most every POLLS_LIVE_POLL_INTERVAL seconds, with the
+    votes after its own cursor, so the database load doesn't depend on the number of
+    clients. It keeps the votes cast within the overlap and the last 10 intervals
+    before the newest vote; clients with an older cursor catch up from the database.
+    """
+    _snapshots: Dict[int, 'PollSnapshot'] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, poll: Poll):
+        self.poll = poll
+        self.cursor = None
+        self.tally = []
+        self.refreshed_at = None
+        # The kept votes by id, and the times of the votes that can be used as a cursor
+        self._votes: Dict[int, dict] = {}
+        self._times: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, poll: Poll) -> 'PollSnapshot':
+        with cls._lock:
+            snapshot = cls._snapshots.get(poll.id)
+            if snapshot is None:
+                snapshot = cls._snapshots[poll.id] = cls(poll)
+            return snapshot
+
+    @classmethod
+    def invalidate(cls) -> None:
+        with cls._lock:
+            cls._snapshots.clear()
+
+    def update(self, since_id: int) -> dict:
+        """
+        Get the votes after the cursor since_id (see votes_since) and the current vote
+        counts, like poll_update, from the snapshot if it still has the votes after since_id.
+        """
+        with self._lock:
+            if self.refreshed_at is None or \
+                    time.monotonic() - self.refreshed_at >= settings.POLLS_LIVE_POLL_INTERVAL:
+                self._refresh()
+            since_time = self._times.get(since_id)
+            if since_time is not None:
+                overlap = settings.POLLS_VOTES_CURSOR_OVERLAP
+                votes = [vote for vote_id, vote in sorted(self._votes.items())
+                         if vote_id > since_id or vote['time'] > since_time - overlap]
+                return {
+                    'cursor': max([since_id] + [vote['id'] for vote in votes]),
+                    'votes': votes,
+                    'tally': self.tally,
+                }
+        return poll_update(self.poll, since_id)
+
+    def _refresh(self) -> None:
+        if self.cursor is None:
+            last_vote = Vote.objects.filter(vote_option__poll=self.poll).order_by('-id').first()
+            self.cursor = last_vote.id if last_vote else 0
+            self._times[self.cursor] = int(last_vote.created.timestamp()) if last_vote else 0
+        update = poll_update(self.poll, self.cursor)
+        self.cursor, self.tally = update['cursor'], update['tally']
+        self._votes.update((vote['id'], vote) for vote in update['votes'])
+        self._times.update((vote['id'], vote['time']) for vote in update['votes'])
+        self.refreshed_at = time.monotonic()
+
+        if self._times:
+            kept_since = max(self._times.values()) - settings.POLLS_VOTES_CURSOR_OVERLAP - \
+                10 * settings.POLLS_LIVE_POLL_INTERVAL
+            self._votes = {vote_id: vote for vote_id, vote in self._votes.items() if vote['time'] >= kept_since}
+            self._times = {vote_id: vote_time for vote_id, vote_time in self._times.items()
+                           if vote_time >= kept_since}
+
+
+class Subscription:
+    """
+    A queue of updates of a poll for a single client.
+
+    A subscription is closed when the client doesn't keep up with the updates,
+    in that case the client should reconnect and catch up from its last cursor.
+    """
+
+    def __init__(self, poll_id: int, cursor: int):
+        self.poll_id = poll_id
+        self.cursor = cursor
+        self.closed = False
+        self._updates = queue.Queue(maxsize=100)
+
+    def put(self, update: dict) -> None:
+        try:
+            self._updates.put_nowait(update)
+        except queue.Full:
+            self.closed = True
+
+    def get(self, timeout: float) -> Optional[dict]:
+        """
+        Get the next update, or None if there was none within timeout seconds.
+        """
+        try:
+            return self._updates.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class PollBroadcaster:
+    """
+    Fans out the new votes of a poll to all subscribed clients in this process.
+
+    There is a single broadcaster per poll, with a thread that checks the database
+    for new votes every POLLS_LIVE_INTERVAL seconds, as long as there are subscribers.
+    So the database load doesn't depend on the number of clients.
+    """
+    _broadcasters: Dict[int, 'PollBroadcaster'] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, poll: Poll, cursor: int):
+        self.poll = poll
+        self.cursor = cursor
+        self.subscriptions: Set[Subscription] = set()
+        # The ids and times of the votes that were sent within the overlap of the cursor
+        self._sent: Dict[int, int] = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f'poll-broadcaster-{poll.id}')
+
+    @classmethod
+    def subscribe(cls, poll: Poll) -> Subscription:
+        """
+        Subscribe to the new votes of a poll. The cursor of the returned subscription
+        is the id of the last vote that will not be sent to it.
+        """
+        with cls._lock:
+            broadcaster = cls._broadcasters.get(poll.id)
+            if broadcaster is None:
+                last_vote = Vote.objects.filter(vote_option__poll=poll).order_by('-id').first()
+                broadcaster = cls(poll, last_vote.id if last_vote else 0)
+                cls._broadcasters[poll.id] = broadcaster
+                broadcaster._thread.start()
+            subscription = Subscription(poll.id, broadcaster.cursor)
+            broadcaster.subscriptions.add(subscription)
+        return subscription
+
+    @classmethod
+    def unsubscribe(cls, subscription: Subscription) -> None:
+        """
+        Stop sending updates to a subscription. The broadcaster of the poll is stopped
+        when its last subscription is removed.
+        """
+        with cls._lock:
+            broadcaster = cls._broadcasters.get(subscription.poll_id)
+            if broadcaster is None:
+                return
+            broadcaster.subscriptions.discard(subscription)
+            if not broadcaster.subscriptions:
+                del cls._broadcasters[subscription.poll_id]
+                broadcaster._stopped.set()
+
+    def broadcast(self) -> Optional[dict]:
+        """
+        Send the votes since the last broadcast to all subscriptions.
+
+        Returns the sent update, or None if there were no new votes.
+        """
+        update = poll_update(self.poll, self.cursor)
+        update['votes'] = [vote for vote in update['votes'] if vote['id'] not in self._sent]
+        if not update['votes']:
+            return None
+        self._sent.update((vote['id'], vote['time']) for vote in update['votes'])
+        sent_since = max(self._sent.values()) - settings.POLLS_VOTES_CURSOR_OVERLAP - 1
+        self._sent = {vote_id: time for vote_id, time in self._sent.items() if time >= sent_since}
+        with self._lock:
+            self.cursor = update['cursor']
+            for subscription in self.subscriptions:
+                subscription.put(update)
+        return update
+
+    def _run(self) -> None:
+        try:
+            while not self._stopped.wait(settings.POLLS_LIVE_INTERVAL):
+                try:
+                    self.broadcast()
+                except Exception:
+                    logger.exception('Could not broadcast the votes of poll %d', self.poll.id)
+                    # Start with a new connection next time
+                    connection.close()
+        finally:
+            # The broadcaster thread has its own database connection
+            connection.close()
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from vsdk.polls.models import Poll
+
+
+class Command(BaseCommand):
+    help = 'Recompute the current votes and vote counts of polls from their votes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('poll_ids', nargs='*', type=int,
+                            help='The polls to rebuild (all polls if omitted)')
+
+    def handle(self, *args, **options):
+        polls = Poll.objects.order_by('id')
+        if options['poll_ids']:
+            polls = polls.filter(pk__in=options['poll_ids'])
+            missing = set(options['poll_ids']) - set(polls.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f'Poll(s) not found: {", ".join(map(str, sorted(missing)))}')
+
+        for poll in polls:
+            poll.rebuild_vote_tally()
+            self.stdout.write(f'Rebuilt the vote tally of poll {poll.id}')
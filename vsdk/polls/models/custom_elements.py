@@ -2,7 +2,7 @@ from django.db import models
 from django.utils.translation import ugettext_lazy as _, ugettext
 
 from vsdk.service_development.models import (MessagePresentation, VoiceLabel, Choice,
-                                             VoiceServiceElement)
+                                             VoiceServiceElement, resolve_subclass)
 
 
 class PollDurationPresentation(MessagePresentation):
@@ -43,10 +43,7 @@ class PollDurationPresentation(MessagePresentation):
         instead of the VoiceServiceElement superclass object (which does
         not have specific fields and methods).
         """
-        if self._no_active_poll_redirect:
-            return VoiceServiceElement.objects.get_subclass(id=self._no_active_poll_redirect.id)
-        else:
-            return None
+        return resolve_subclass(self._no_active_poll_redirect)
 
     def validator(self):
         errors = super().validator()
@@ -93,10 +90,7 @@ class PollResultsPresentation(MessagePresentation):
         instead of the VoiceServiceElement superclass object (which does
         not have specific fields and methods).
         """
-        if self._no_active_poll_redirect:
-            return VoiceServiceElement.objects.get_subclass(id=self._no_active_poll_redirect.id)
-        else:
-            return None
+        return resolve_subclass(self._no_active_poll_redirect)
 
     def validator(self):
         errors = super().validator()
@@ -1,9 +1,18 @@
-from typing import NamedTuple, Iterable
+import random
+import threading
+import time
+from collections import Counter
+from typing import NamedTuple, Iterable, Optional, Tuple, Dict, List
 
+from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models, connection
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Sum
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils import timezone
 
+from vsdk.service_development.batching import BulkCreateBuffer
 from vsdk.service_development.models import VoiceService
 
 
@@ -25,40 +34,41 @@ class Poll(models.Model):
         """
         Count the valid votes for this poll.
 
-        This means taking only the last votes for each user. The keys of the returned
-        dict are the voting options for poll, and the values are the counts for those
-        options.
-        """
-
-        # The inner query takes only the last vote for each voter, and the outer one
-        # joins it with possible voting options.
-        query = """
-            select vo.value as vote_value, count(votes.id) as vote_count
-            from polls_voteoption as vo
-                left outer join (
-                    select v1.*
-                    from polls_vote v1
-                        left outer join polls_vote v2
-                            on v1.caller_id = v2.caller_id and v1.created < v2.created
-                    where v2.caller_id is null
-                ) as votes on votes.vote_option_id = vo.id
-            where vo.poll_id = %s 
-            group by vo.value
-            order by vo.value asc;
-        """
-
-        with connection.cursor() as cursor:
-            cursor.execute(query, [self.id])
-            rows = cursor.fetchall()
-
-            column_names = [col[0] for col in cursor.description]
-            results = [dict(zip(column_names, row)) for row in rows]
-
-            for result in results:
-                yield VoteResult(
-                    vote_value=result['vote_value'],
-                    vote_count=result['vote_count']
-                )
+        This means taking only the last votes for each user. The results are ordered by
+        the values of the voting options for the poll.
+
+        The counts are maintained when votes are saved (see CurrentVote), so this only
+        reads the vote options.
+        """
+        results = self.vote_options.values('value').annotate(
+            total=Sum('vote_count')).order_by('value')
+
+        for result in results:
+            yield VoteResult(
+                vote_value=result['value'],
+                vote_count=result['total']
+            )
+
+    @transaction.atomic
+    def rebuild_vote_tally(self) -> None:
+        """
+        Recompute the current votes and the vote counts of this poll from all its votes.
+        """
+        CurrentVote.objects.filter(poll=self).delete()
+        votes = Vote.objects.filter(vote_option__poll=self).order_by(
+            'caller_id', 'created', 'id').values_list('caller_id', 'vote_option_id', 'created')
+
+        current_votes: Dict[str, CurrentVote] = {}
+        for caller_id, vote_option_id, created in votes.iterator():
+            # Ordered by creation, so the last vote of every caller wins
+            current_votes[caller_id] = CurrentVote(poll=self, caller_id=caller_id,
+                                                   vote_option_id=vote_option_id, created=created)
+        CurrentVote.objects.bulk_create(current_votes.values(), batch_size=500)
+
+        vote_counts = Counter(vote.vote_option_id for vote in current_votes.values())
+        self.vote_options.update(vote_count=0)
+        for vote_option_id, vote_count in vote_counts.items():
+            VoteOption.objects.filter(pk=vote_option_id).update(vote_count=vote_count)
 
     @property
     def active(self) -> bool:
@@ -85,7 +95,15 @@ class Vote(models.Model):
     """
     caller_id = models.CharField(max_length=100)
     vote_option = models.ForeignKey('VoteOption', on_delete=models.PROTECT, null=False)
-    created = models.DateTimeField(blank=False, auto_now_add=True)
+    # Not auto_now_add, so buffered votes keep the time of the bip instead of the time they are saved
+    created = models.DateTimeField(blank=False, default=timezone.now, editable=False)
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                CurrentVote.register_votes([self])
 
 
 class VoteOption(models.Model):
@@ -97,3 +115,186 @@ class VoteOption(models.Model):
     poll = models.ForeignKey(Poll, on_delete=models.CASCADE, null=False,
                              related_name='vote_options')
     value = models.IntegerField(validators=[MinValueValidator(0), MaxValueValidator(9)])
+    # The number of callers whose last vote in the poll is for this option (see CurrentVote)
+    vote_count = models.PositiveIntegerField(default=0, editable=False)
+
+
+class CurrentVote(models.Model):
+    """
+    The last vote of a caller in a poll.
+
+    Current votes and the vote counts of the vote options are updated in the same
+    transaction as the votes are saved, so counting the votes of a poll doesn't have
+    to go through all votes. Votes that are changed or deleted later are not taken into
+    account, until the tally is rebuilt (see Poll.rebuild_vote_tally).
+    """
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='current_votes')
+    caller_id = models.CharField(max_length=100)
+    vote_option = models.ForeignKey(VoteOption, on_delete=models.CASCADE)
+    created = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('poll', 'caller_id')
+
+    @classmethod
+    def register_votes(cls, votes: List[Vote]) -> None:
+        """
+        Update the current votes and vote counts with newly saved votes.
+        """
+        # Another transaction can insert the first vote of the same caller in the meantime,
+        # in that case we try again, and update that vote instead.
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    cls._register_votes(votes)
+                return
+            except IntegrityError:
+                if attempt:
+                    raise
+
+    @classmethod
+    def _register_votes(cls, votes: List[Vote]) -> None:
+        poll_ids = dict(VoteOption.objects.filter(
+            pk__in={vote.vote_option_id for vote in votes}).values_list('id', 'poll_id'))
+
+        # The last vote of every caller in every poll, in this batch
+        latest_votes: Dict[Tuple[int, str], Vote] = {}
+        for vote in votes:
+            key = (poll_ids[vote.vote_option_id], vote.caller_id)
+            if key not in latest_votes or vote.created >= latest_votes[key].created:
+                latest_votes[key] = vote
+
+        existing: Dict[Tuple[int, str], CurrentVote] = {}
+        for poll_id in {poll_id for poll_id, caller_id in latest_votes}:
+            caller_ids = [caller_id for key_poll_id, caller_id in latest_votes
+                          if key_poll_id == poll_id]
+            for current_vote in cls.objects.select_for_update().filter(
+                    poll_id=poll_id, caller_id__in=caller_ids):
+                existing[(poll_id, current_vote.caller_id)] = current_vote
+
+        vote_count_changes = Counter()
+        new_current_votes = []
+        for (poll_id, caller_id), vote in latest_votes.items():
+            current_vote = existing.get((poll_id, caller_id))
+            if current_vote is None:
+                new_current_votes.append(cls(poll_id=poll_id, caller_id=caller_id,
+                                             vote_option_id=vote.vote_option_id,
+                                             created=vote.created))
+            elif vote.created >= current_vote.created:
+                vote_count_changes[current_vote.vote_option_id] -= 1
+                cls.objects.filter(pk=current_vote.pk).update(
+                    vote_option_id=vote.vote_option_id, created=vote.created)
+            else:
+                continue
+            vote_count_changes[vote.vote_option_id] += 1
+
+        cls.objects.bulk_create(new_current_votes)
+        for vote_option_id, change in vote_count_changes.items():
+            if change:
+                VoteOption.objects.filter(pk=vote_option_id).update(
+                    vote_count=F('vote_count') + change)
+
+
+class BipRoutes:
+    """
+    An in-memory mapping from voice services to the vote options bips are assigned to.
+
+    Routes are dropped when a voice service, poll or vote option is saved or deleted
+    in this process, and reloaded after POLLS_BIP_ROUTES_TIMEOUT seconds to pick up
+    changes made by other processes.
+    """
+
+    def __init__(self):
+        self._routes: Dict[int, Tuple[float, bool, Tuple[int, ...]]] = {}
+        self._lock = threading.Lock()
+
+    def get_vote_option_ids(self, voice_service_id: int) -> Optional[Tuple[int, ...]]:
+        """
+        Get the ids of the vote options of the poll of an active voice service.
+
+        Returns None if the voice service does not exist or is not active.
+        """
+        route = self._routes.get(voice_service_id)
+        if route is None or time.monotonic() - route[0] > settings.POLLS_BIP_ROUTES_TIMEOUT:
+            route = self._load(voice_service_id)
+        loaded_at, active, vote_option_ids = route
+        return vote_option_ids if active else None
+
+    def random_vote_option_id(self, voice_service_id: int) -> Optional[int]:
+        """
+        Pick a random vote option of the poll of an active voice service.
+
+        Returns None if there is no such vote option.
+        """
+        vote_option_ids = self.get_vote_option_ids(voice_service_id)
+        return random.choice(vote_option_ids) if vote_option_ids else None
+
+    def invalidate(self, voice_service_id: Optional[int] = None) -> None:
+        """
+        Drop the route of a voice service (or of all voice services).
+        """
+        with self._lock:
+            if voice_service_id is None:
+                self._routes.clear()
+            else:
+                self._routes.pop(voice_service_id, None)
+
+    def _load(self, voice_service_id: int) -> Tuple[float, bool, Tuple[int, ...]]:
+        active = VoiceService.objects.filter(pk=voice_service_id, active=True).exists()
+        vote_option_ids = tuple(VoteOption.objects.filter(
+            poll__voice_service_id=voice_service_id).order_by('id').values_list('id', flat=True))
+        route = (time.monotonic(), active, vote_option_ids)
+        with self._lock:
+            self._routes[voice_service_id] = route
+        return route
+
+
+bip_routes = BipRoutes()
+
+
+@receiver(post_save, sender=VoiceService)
+@receiver(post_delete, sender=VoiceService)
+def invalidate_bip_routes_on_voice_service_change(sender, instance: VoiceService, **kwargs):
+    bip_routes.invalidate(instance.id)
+
+
+@receiver(post_save, sender=Poll)
+@receiver(post_delete, sender=Poll)
+@receiver(post_save, sender=VoteOption)
+@receiver(post_delete, sender=VoteOption)
+def invalidate_bip_routes_on_poll_change(sender, instance, **kwargs):
+    # A poll can be moved between voice services, so we don't know which routes it was part of
+    bip_routes.invalidate()
+
+
+class VoteBuffer(BulkCreateBuffer):
+    """
+    Buffers votes in memory, and saves them in batches, updating the vote tallies
+    of each batch in the same transaction.
+    """
+
+    def __init__(self, max_size: int = 500, max_age: float = 1.0):
+        super().__init__(Vote, max_size, max_age)
+
+    def after_bulk_create(self, instances: List[Vote]) -> None:
+        CurrentVote.register_votes(instances)
+        # bulk_create() does not send signals, and buffered votes keep the time of the bip
+        from vsdk.polls.histogram import VoteHistogram
+        VoteHistogram.votes_changed({vote.vote_option_id for vote in instances},
+                                    min(vote.created for vote in instances))
+
+
+_vote_buffer = None
+_vote_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer() -> VoteBuffer:
+    """
+    Get the VoteBuffer of this process.
+    """
+    global _vote_buffer
+    with _vote_buffer_lock:
+        if _vote_buffer is None:
+            _vote_buffer = VoteBuffer(settings.POLLS_BIP_BUFFER_SIZE,
+                                      settings.POLLS_BIP_BUFFER_MAX_AGE)
+        return _vote_buffer
@@ -1,9 +1,18 @@
+import json
+import os
 from datetime import timedelta
+from unittest import mock
 
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from vsdk.polls.models import Poll, VoteOption, Vote, VoteResult, CreatePoll, EndPoll
+from vsdk.polls.histogram import VoteHistogram
+from vsdk.polls.live import PollBroadcaster, PollSnapshot
+from vsdk.polls.models import (Poll, VoteOption, Vote, VoteResult, CreatePoll, EndPoll,
+                               CurrentVote, get_vote_buffer)
 from vsdk.service_development.models import VoiceService, CallSession
 
 
@@ -39,6 +48,260 @@ class PollTests(TestCase):
         vote_count = Vote.objects.filter(caller_id=self.caller_id1).count()
         self.assertEquals(vote_count, 2)
 
+    def test_bip_vote_options_cached(self):
+        """
+        After the first bip, the voice service and its vote options are not queried anymore.
+        """
+        self.client.get(f'/polls/bip/{self.poll.voice_service_id}?callerid={self.caller_id1}')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f'/polls/bip/{self.poll.voice_service_id}?callerid={self.caller_id2}')
+        self.assertEqual(response.status_code, 204)
+        for query in queries:
+            self.assertNotIn('service_development_voiceservice', query['sql'])
+            self.assertNotIn('RANDOM', query['sql'])
+        self.assertIn(Vote.objects.get(caller_id=self.caller_id2).vote_option,
+                      [self.vote_option1, self.vote_option2])
+
+    def test_bip_inactive_voice_service(self):
+        self.client.get(f'/polls/bip/{self.poll.voice_service_id}?callerid={self.caller_id1}')
+        self.poll.voice_service.active = False
+        self.poll.voice_service.save()
+
+        response = self.client.get(
+            f'/polls/bip/{self.poll.voice_service_id}?callerid={self.caller_id1}')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(POLLS_BIP_BUFFERING=True)
+    def test_bip_buffered(self):
+        vote_buffer = get_vote_buffer()
+        for caller_id in [self.caller_id1, self.caller_id2]:
+            response = self.client.get(
+                f'/polls/bip/{self.poll.voice_service_id}?callerid={caller_id}')
+            self.assertEqual(response.status_code, 204)
+
+        self.assertEqual(Vote.objects.count(), 0)
+        self.assertEqual(self.client.get('/polls/bip-stats').json()['queue_depth'], 2)
+
+        self.assertEqual(vote_buffer.flush(), 2)
+        self.assertEqual(Vote.objects.count(), 2)
+        stats = self.client.get('/polls/bip-stats').json()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertIsNotNone(stats['last_flush_duration'])
+
+    def test_vote_buffer_drops_bad_votes(self):
+        vote_buffer = get_vote_buffer()
+        vote_buffer.add(Vote(caller_id=self.caller_id1, vote_option=self.vote_option1))
+        vote_buffer.add(Vote(caller_id=self.caller_id2, vote_option_id=None))
+        vote_buffer.add(Vote(caller_id=self.caller_id2, vote_option=self.vote_option2))
+
+        with self.assertLogs('vsdk.service_development.batching', 'ERROR'):
+            self.assertEqual(vote_buffer.flush(), 2)
+        self.assertEqual(vote_buffer.depth, 0)
+        self.assertEqual(sorted(Vote.objects.values_list('caller_id', flat=True)),
+                         sorted([self.caller_id1, self.caller_id2]))
+        self.assertEqual(list(self.poll.count_votes()), [
+            VoteResult(vote_value=1, vote_count=1),
+            VoteResult(vote_value=2, vote_count=1),
+        ])
+
+    def test_vote_buffer_retries_after_error(self):
+        vote_buffer = get_vote_buffer()
+        for caller_id in [self.caller_id1, self.caller_id2, self.caller_id1]:
+            vote_buffer.add(Vote(caller_id=caller_id, vote_option=self.vote_option1))
+
+        # The database goes away while the batch is saved one by one
+        with mock.patch.object(Vote.objects, 'bulk_create',
+                               side_effect=[IntegrityError(), OperationalError()]), \
+                self.assertLogs('vsdk.service_development.batching', 'ERROR'):
+            self.assertEqual(vote_buffer.flush(), 0)
+        self.assertEqual(vote_buffer.depth, 3)
+        self.assertIsNotNone(vote_buffer._timer)
+
+        self.assertEqual(vote_buffer.flush(), 3)
+        self.assertEqual(Vote.objects.count(), 3)
+
+    @override_settings(POLLS_VOTES_CURSOR_OVERLAP=0)
+    def test_votes_json_since_cursor(self):
+        vote1 = Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option1)
+        vote2 = Vote.objects.create(caller_id=self.caller_id2, vote_option=self.vote_option2)
+
+        data = json.loads(b''.join(self.client.get(f'/polls/votes-json/{self.poll.id}')))
+        self.assertEqual(data['options'], [1, 2])
+        self.assertEqual([vote['id'] for vote in data['votes']], [vote1.id, vote2.id])
+        self.assertEqual(data['votes'][0], {'id': vote1.id, 'nr': self.caller_id1, 'option': 1,
+                                            'time': int(vote1.created.timestamp())})
+        self.assertEqual(data['cursor'], vote2.id)
+
+        vote3 = Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option2)
+        response = self.client.get(f'/polls/votes-json/{self.poll.id}',
+                                   {'since_id': data['cursor']})
+        data = json.loads(b''.join(response))
+        self.assertEqual([vote['id'] for vote in data['votes']], [vote3.id])
+        self.assertEqual(data['cursor'], vote3.id)
+
+        response = self.client.get(f'/polls/votes-json/{self.poll.id}',
+                                   {'since_id': data['cursor']})
+        data = json.loads(b''.join(response))
+        self.assertEqual(data['votes'], [])
+        self.assertEqual(data['cursor'], vote3.id)
+
+    @override_settings(POLLS_VOTES_CURSOR_OVERLAP=10)
+    def test_votes_json_late_vote(self):
+        early_vote = Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option1,
+                                         created=timezone.now() - timedelta(minutes=1))
+        late_vote = Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option1)
+        vote = Vote.objects.create(caller_id=self.caller_id2, vote_option=self.vote_option2)
+        # The vote with the lower id is committed after the cursor was read
+        late_vote_id = late_vote.id
+        late_vote.delete()
+        data = json.loads(b''.join(self.client.get(f'/polls/votes-json/{self.poll.id}')))
+        self.assertEqual([vote['id'] for vote in data['votes']], [early_vote.id, vote.id])
+        late_vote.id = late_vote_id
+        late_vote.save(force_insert=True)
+
+        response = self.client.get(f'/polls/votes-json/{self.poll.id}', {'since_id': data['cursor']})
+        data = json.loads(b''.join(response))
+        # The votes within the overlap are sent again
+        self.assertEqual([vote['id'] for vote in data['votes']], [late_vote.id, vote.id])
+        self.assertEqual(data['cursor'], vote.id)
+
+    def test_votes_json_since_time(self):
+        Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option1,
+                            created=timezone.now() - timedelta(days=1))
+        vote = Vote.objects.create(caller_id=self.caller_id2, vote_option=self.vote_option2)
+
+        response = self.client.get(f'/polls/votes-json/{self.poll.id}',
+                                   {'since_time': int(vote.created.timestamp())})
+        data = json.loads(b''.join(response))
+        self.assertEqual([vote['id'] for vote in data['votes']], [vote.id])
+
+        response = self.client.get(f'/polls/votes-json/{self.poll.id}', {'since_id': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(POLLS_LIVE_STREAMING=False, POLLS_LIVE_POLL_INTERVAL=5, POLLS_VOTES_CURSOR_OVERLAP=0)
+    def test_votes_stream_polling(self):
+        PollSnapshot.invalidate()
+        vote1 = Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option1)
+        vote2 = Vote.objects.create(caller_id=self.caller_id2, vote_option=self.vote_option2)
+
+        response = self.client.get(f'/polls/votes-stream/{self.poll.id}', HTTP_LAST_EVENT_ID=str(vote1.id))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        retry, event_id, data = response.content.decode().splitlines()[:3]
+        self.assertEqual(retry, 'retry: 5000')
+        self.assertEqual(event_id, f'id: {vote2.id}')
+        self.assertEqual([vote['id'] for vote in json.loads(data[len('data: '):])['votes']], [vote2.id])
+        self.assertNotIn(self.poll.id, PollBroadcaster._broadcasters)
+
+        # All polling clients share a snapshot of the poll, refreshed once per interval
+        def poll_votes(since_id):
+            response = self.client.get(f'/polls/votes-stream/{self.poll.id}', {'since_id': since_id})
+            return json.loads(response.content.decode().splitlines()[2][len('data: '):])
+
+        vote3 = Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option2)
+        self.assertEqual(poll_votes(vote2.id)['votes'], [])
+        PollSnapshot.get(self.poll).refreshed_at = None
+        with CaptureQueriesContext(connection) as queries:
+            update = poll_votes(vote2.id)
+        self.assertEqual(len(queries), 4)
+        self.assertEqual([vote['id'] for vote in update['votes']], [vote3.id])
+        self.assertEqual(update['cursor'], vote3.id)
+        # The last vote of every caller counts
+        self.assertEqual(update['tally'], [{'option': 1, 'count': 0}, {'option': 2, 'count': 2}])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(poll_votes(vote2.id), update)
+            self.assertEqual(poll_votes(vote3.id)['votes'], [])
+        # Only the poll itself is queried
+        self.assertEqual(len(queries), 2)
+
+    @override_settings(POLLS_LIVE_STREAMING=True, POLLS_LIVE_INTERVAL=3600, POLLS_LIVE_KEEP_ALIVE_INTERVAL=0.01,
+                       POLLS_VOTES_CURSOR_OVERLAP=10)
+    def test_votes_stream(self):
+        vote1 = Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option1)
+        vote2 = Vote.objects.create(caller_id=self.caller_id2, vote_option=self.vote_option2)
+
+        response = self.client.get(f'/polls/votes-stream/{self.poll.id}', {'since_id': vote1.id})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = iter(response)
+        event_id, data = next(events).decode().splitlines()[:2]
+        self.assertEqual(event_id, f'id: {vote2.id}')
+        update = json.loads(data[len('data: '):])
+        self.assertEqual([vote['id'] for vote in update['votes']], [vote1.id, vote2.id])
+        self.assertEqual(update['tally'], [{'option': 1, 'count': 1}, {'option': 2, 'count': 1}])
+        self.assertEqual(next(events), b': keep-alive\n\n')
+
+        # All clients of the poll share a single broadcaster
+        broadcaster = PollBroadcaster._broadcasters[self.poll.id]
+        vote3 = Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option2)
+        with CaptureQueriesContext(connection) as queries:
+            broadcaster.broadcast()
+        self.assertEqual(len(queries), 3)
+        update = json.loads(next(events).decode().splitlines()[1][len('data: '):])
+        # Votes within the overlap of the cursor are sent once
+        self.assertEqual([vote['id'] for vote in update['votes']], [vote1.id, vote2.id, vote3.id])
+        self.assertIsNone(broadcaster.broadcast())
+        self.assertEqual(update['tally'], [{'option': 1, 'count': 0}, {'option': 2, 'count': 2}])
+
+        response.close()
+        self.assertNotIn(self.poll.id, PollBroadcaster._broadcasters)
+
+    def test_votes_histogram(self):
+        VoteHistogram.invalidate()
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+        Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option1,
+                            created=hour + timedelta(minutes=1))
+        Vote.objects.create(caller_id=self.caller_id2, vote_option=self.vote_option1,
+                            created=hour + timedelta(minutes=2))
+        Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option2,
+                            created=hour + timedelta(hours=2, minutes=1))
+        Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option2,
+                            created=hour + timedelta(hours=2, minutes=2))
+
+        data = self.client.get(f'/polls/votes-histogram/{self.poll.id}').json()
+        first, last = int(hour.timestamp()), int((hour + timedelta(hours=2)).timestamp())
+        self.assertEqual(data['bucket'], 'hour')
+        self.assertEqual(data['cursor'], Vote.objects.latest('id').id)
+        self.assertEqual(data['series'], [
+            {'option': 1, 'data': [[first, 2], [last, 1]]},
+            {'option': 2, 'data': [[first, 0], [last, 1]]},
+        ])
+
+        data = self.client.get(f'/polls/votes-histogram/{self.poll.id}', {'bucket': 'minute'}).json()
+        self.assertEqual(len(data['series'][0]['data']), 4)
+
+        response = self.client.get(f'/polls/votes-histogram/{self.poll.id}', {'bucket': 'week'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_votes_histogram_finished_buckets_cached(self):
+        VoteHistogram.invalidate()
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+        Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option1, created=hour)
+        histogram = VoteHistogram.for_poll(self.poll, 'hour')
+        self.assertEqual(histogram.series(), ([(hour, {1: 1})], []))
+
+        vote = Vote.objects.create(caller_id=self.caller_id2, vote_option=self.vote_option2)
+        histogram = VoteHistogram.for_poll(self.poll, 'hour')
+        finished_points, unfinished_points = histogram.series()
+        self.assertEqual(finished_points, [(hour, {1: 1})])
+        self.assertEqual(unfinished_points, [(vote.created.replace(minute=0, second=0, microsecond=0),
+                                              {1: 1, 2: 1})])
+        with self.assertNumQueries(0):
+            self.assertIs(VoteHistogram.for_poll(self.poll, 'hour'), histogram)
+
+        # A vote added to a finished bucket afterwards, with a buffer and without
+        with mock.patch('django.db.transaction.on_commit', side_effect=lambda func: func()):
+            vote_buffer = get_vote_buffer()
+            vote_buffer.add(Vote(caller_id=self.caller_id1, vote_option=self.vote_option1,
+                                 created=hour + timedelta(minutes=1)))
+            vote_buffer.flush()
+            self.assertIsNot(VoteHistogram.for_poll(self.poll, 'hour'), histogram)
+            self.assertEqual(VoteHistogram.for_poll(self.poll, 'hour').series()[0], [(hour, {1: 1})])
+            histogram = VoteHistogram.for_poll(self.poll, 'hour')
+            Vote.objects.create(caller_id=self.caller_id2, vote_option=self.vote_option1, created=hour)
+        self.assertIsNot(VoteHistogram.for_poll(self.poll, 'hour'), histogram)
+        finished_points, unfinished_points = VoteHistogram.for_poll(self.poll, 'hour').series()
+        self.assertEqual(finished_points, [(hour, {1: 2})])
+
     def test_vote_deduplication(self):
         Vote.objects.create(
             caller_id=self.caller_id1,
@@ -64,6 +327,56 @@ class PollTests(TestCase):
 
         self.assertEquals(vote_counts, expected_vote_counts)
 
+    def test_vote_tally_other_poll(self):
+        """
+        Votes of a caller in another poll don't replace their vote in this poll.
+        """
+        other_poll = Poll.objects.create(start_date=timezone.now(), duration=timedelta(days=10))
+        other_vote_option = VoteOption.objects.create(poll=other_poll, value=1)
+        Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option2)
+        Vote.objects.create(caller_id=self.caller_id1, vote_option=other_vote_option)
+
+        self.assertEqual(list(self.poll.count_votes()), [
+            VoteResult(vote_value=1, vote_count=0),
+            VoteResult(vote_value=2, vote_count=1),
+        ])
+        self.assertEqual(list(other_poll.count_votes()), [VoteResult(vote_value=1, vote_count=1)])
+
+    def test_count_votes_without_scanning_votes(self):
+        Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option1)
+        with CaptureQueriesContext(connection) as queries:
+            list(self.poll.count_votes())
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('polls_vote"', queries[0]['sql'])
+
+    def test_vote_tally_buffered_votes(self):
+        Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option1)
+        vote_buffer = get_vote_buffer()
+        vote_buffer.add(Vote(caller_id=self.caller_id1, vote_option=self.vote_option2))
+        vote_buffer.add(Vote(caller_id=self.caller_id2, vote_option=self.vote_option2,
+                             created=timezone.now() - timedelta(days=1)))
+        vote_buffer.add(Vote(caller_id=self.caller_id2, vote_option=self.vote_option1))
+        vote_buffer.flush()
+
+        self.assertEqual(list(self.poll.count_votes()), [
+            VoteResult(vote_value=1, vote_count=1),
+            VoteResult(vote_value=2, vote_count=1),
+        ])
+        self.assertEqual(CurrentVote.objects.get(caller_id=self.caller_id1).vote_option,
+                         self.vote_option2)
+
+    def test_rebuild_vote_tallies(self):
+        Vote.objects.create(caller_id=self.caller_id1, vote_option=self.vote_option1)
+        Vote.objects.create(caller_id=self.caller_id2, vote_option=self.vote_option1)
+        expected_vote_counts = list(self.poll.count_votes())
+
+        CurrentVote.objects.all().delete()
+        VoteOption.objects.update(vote_count=0)
+        call_command('rebuild_vote_tallies', self.poll.id, stdout=open(os.devnull, 'w'))
+
+        self.assertEqual(list(self.poll.count_votes()), expected_vote_counts)
+        self.assertEqual(CurrentVote.objects.count(), 2)
+
 
 class TestCreatePoll(TestCase):
     def setUp(self):
@@ -143,3 +456,15 @@ class TestEndPoll(TestCase):
         result = self.client.get(url)
         self.assertEqual(result.status_code, 200)
         self.assertEqual(Poll.objects.filter(voice_service=self.voice_service).count(), 0)
+
+    def test_no_bips_after_end_poll(self):
+        poll = Poll.objects.create(voice_service=self.voice_service,
+                                   start_date=timezone.now(),
+                                   duration=timedelta(days=10))
+        VoteOption.objects.create(poll=poll, value=1)
+        bip_url = f'/polls/bip/{self.voice_service.id}?callerid=10001'
+        self.assertEqual(self.client.get(bip_url).status_code, 204)
+
+        element = EndPoll.objects.create(service=self.voice_service)
+        self.client.get(element.get_absolute_url(self.session))
+        self.assertEqual(self.client.get(bip_url).status_code, 404)
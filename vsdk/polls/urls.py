@@ -2,13 +2,14 @@ from django.conf.urls import url
 
 from .views import (handle_bip, poll_results, ask_poll_duration, ask_poll_duration_confirmation,
                     poll_duration_presentation, create_poll, end_poll, confirm_poll_created,
-                    votes_json)
+                    votes_json, votes_stream, votes_histogram, bip_stats)
 
 app_name = 'polls'
 urlpatterns = [
     url(r'^poll-duration/(?P<element_id>[0-9]+)/(?P<session_id>[0-9]+)$',
         poll_duration_presentation, name='poll-duration-presentation'),
     url(r'^bip/(?P<voice_service_id>[0-9]+)$', handle_bip, name='handle-bip'),
+    url(r'^bip-stats$', bip_stats, name='bip-stats'),
     url(r'^poll-results/(?P<element_id>[0-9]+)/(?P<session_id>[0-9]+)$',
         poll_results, name='poll-results'),
     url(r'^ask-poll-duration/(?P<element_id>[0-9]+)/(?P<session_id>[0-9]+)$',
@@ -22,4 +23,6 @@ urlpatterns = [
     url(r'^end-poll/(?P<element_id>[0-9]+)/(?P<session_id>[0-9]+)$',
         end_poll, name='end-poll'),
     url(r'^votes-json/(?P<poll_id>[0-9]+)$', votes_json, name='votes-json'),
+    url(r'^votes-stream/(?P<poll_id>[0-9]+)$', votes_stream, name='votes-stream'),
+    url(r'^votes-histogram/(?P<poll_id>[0-9]+)$', votes_histogram, name='votes-histogram'),
 ]
@@ -1,16 +1,25 @@
-from datetime import timedelta
-
-from django.http import HttpResponse, HttpRequest, Http404, JsonResponse
+import json
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.http import (HttpResponse, HttpRequest, Http404, JsonResponse, HttpResponseBadRequest,
+                         StreamingHttpResponse)
 from django.shortcuts import render, get_object_or_404
 from django.utils import timezone
+from django.utils.timezone import utc
 
 from vsdk.polls.exceptions import NoCallerIDError
+from vsdk.polls.histogram import BUCKETS, VoteHistogram
+from vsdk.polls.live import PollBroadcaster, PollSnapshot, poll_update, vote_to_json, votes_since
 from vsdk.polls.models import (VoteOption, Vote, Poll, PollResultsPresentation,
                                AskPollDurationConfirmation, CreatePoll, ConfirmPollCreation,
                                EndPoll,
-                               AskPollDuration)
+                               AskPollDuration, bip_routes, get_vote_buffer)
 from vsdk.polls.models.custom_elements import PollDurationPresentation
-from vsdk.service_development.models import CallSession, VoiceService, Language
+from vsdk.service_development.models import (CallSession, Language,
+                                             get_element_or_404)
 from vsdk.service_development.views import choice_generate_context
 
 
@@ -22,13 +31,13 @@ def poll_duration_presentation(request: HttpRequest,
     Take the current active vote for the current user, and communicate its duration.
     In case there's no active vote, communicate this fact.
     """
-    element = get_object_or_404(PollDurationPresentation, pk=element_id)
     session = get_object_or_404(CallSession, pk=session_id)
+    element = get_element_or_404(PollDurationPresentation, element_id, session)
     session.record_step(element)
 
     language: Language = session.language
 
-    poll = getattr(element.service, 'poll', None)
+    poll = Poll.objects.filter(voice_service_id=element.service_id).first()
     redirect_url = None
 
     # There's an active poll
@@ -68,8 +77,11 @@ def handle_bip(request: HttpRequest, voice_service_id: int) -> HttpResponse:
     This view requires a `callerid` in GET parameters. If it's not the case,
     NoCallerIDError (a subclass of Http404) is thrown.
 
-    It also requires the voice service to be active. If it's not active,
-    Http404 is thrown.
+    It also requires the voice service to be active, and to have a poll with vote options.
+    If it's not the case, Http404 is thrown.
+
+    The vote options of voice services are cached (see BipRoutes). With POLLS_BIP_BUFFERING
+    enabled, votes are saved in batches shortly after the response is sent.
 
     TODO: Stop assigning vote options randomly
     """
@@ -80,31 +92,50 @@ def handle_bip(request: HttpRequest, voice_service_id: int) -> HttpResponse:
     else:
         caller_id = caller_id.strip()
 
-    voice_service = get_object_or_404(VoiceService, pk=voice_service_id)
+    # We're taking a random vote option, because we don't have access to multiple numbers yet
+    vote_option_id = bip_routes.random_vote_option_id(int(voice_service_id))
 
-    if not voice_service.active:
+    if vote_option_id is None:
         raise Http404()
 
-    # We're taking a random vote option, because we don't have access to multiple numbers yet
-    vote_option = VoteOption.objects.filter(poll__voice_service=voice_service).order_by('?').first()
-
-    Vote.objects.create(caller_id=caller_id, vote_option=vote_option)
+    vote = Vote(caller_id=caller_id, vote_option_id=vote_option_id)
+    if settings.POLLS_BIP_BUFFERING:
+        get_vote_buffer().add(vote)
+    else:
+        vote.save()
 
     return HttpResponse(status=204)
 
 
+def bip_stats(request: HttpRequest) -> HttpResponse:
+    """
+    Get the state of the bip buffer of this process in a JSON format.
+
+    Example:
+    {"buffering": true, "queue_depth": 12, "last_flush_duration": 0.0042}
+
+    `last_flush_duration` is in seconds, and null if no votes were saved in batch yet.
+    """
+    vote_buffer = get_vote_buffer()
+    return JsonResponse({
+        'buffering': settings.POLLS_BIP_BUFFERING,
+        'queue_depth': vote_buffer.depth,
+        'last_flush_duration': vote_buffer.last_flush_duration,
+    })
+
+
 def poll_results(request: HttpRequest, element_id: int, session_id: int) -> HttpResponse:
     """
     Take the current active poll for the current voice service, and present its results.
     In case there's no active poll, communicate this fact.
     """
-    element = get_object_or_404(PollResultsPresentation, pk=element_id)
     session = get_object_or_404(CallSession, pk=session_id)
+    element = get_element_or_404(PollResultsPresentation, element_id, session)
     session.record_step(element)
 
     language: Language = session.language
 
-    poll: Poll = getattr(element.service, 'poll', None)
+    poll: Poll = Poll.objects.filter(voice_service_id=element.service_id).first()
 
     if not poll or not poll.active:
         poll = Poll.objects.order_by('-start_date').first()
@@ -151,8 +182,8 @@ def ask_poll_duration(request: HttpRequest, element_id: int, session_id: int) ->
     """
     Ask for the duration of a poll, and redirect to the confirmation element.
     """
-    element = get_object_or_404(AskPollDuration, pk=element_id)
     session = get_object_or_404(CallSession, pk=session_id)
+    element = get_element_or_404(AskPollDuration, element_id, session)
     session.record_step(element)
 
     if not element.final_element and element.redirect:
@@ -176,8 +207,8 @@ def ask_poll_duration_confirmation(request: HttpRequest,
 
     To both choice options the duration is sent as a GET parameter.
     """
-    element = get_object_or_404(AskPollDurationConfirmation, pk=element_id)
     session = get_object_or_404(CallSession, pk=session_id)
+    element = get_element_or_404(AskPollDurationConfirmation, element_id, session)
     session.record_step(element)
 
     language: Language = session.language
@@ -201,11 +232,12 @@ def create_poll(request: HttpRequest, element_id: int, session_id: int) -> HttpR
 
     Then, redirect to the next element (possibly confirmation).
     """
-    element = get_object_or_404(CreatePoll, pk=element_id)
     session = get_object_or_404(CallSession, pk=session_id)
+    element = get_element_or_404(CreatePoll, element_id, session)
     session.record_step(element)
 
     Poll.objects.filter(voice_service=session.service).update(voice_service=None)
+    bip_routes.invalidate(session.service_id)
 
     duration = int(request.GET['duration'])  # in days
     poll = Poll.objects.create(voice_service=session.service, start_date=timezone.now(),
@@ -229,8 +261,8 @@ def confirm_poll_created(request: HttpRequest, element_id: int, session_id: int)
     """
     Confirm the duration of a freshly created poll.
     """
-    element = get_object_or_404(ConfirmPollCreation, pk=element_id)
     session = get_object_or_404(CallSession, pk=session_id)
+    element = get_element_or_404(ConfirmPollCreation, element_id, session)
     session.record_step(element)
 
     poll: Poll = session.service.poll
@@ -256,11 +288,12 @@ def end_poll(request: HttpRequest, element_id: int, session_id: int) -> HttpResp
     """
     End the current poll.
     """
-    element = get_object_or_404(EndPoll, pk=element_id)
     session = get_object_or_404(CallSession, pk=session_id)
+    element = get_element_or_404(EndPoll, element_id, session)
     session.record_step(element)
 
     Poll.objects.filter(voice_service=session.service).update(voice_service=None)
+    bip_routes.invalidate(session.service_id)
 
     if not element.final_element and element.redirect:
         redirect_url = element.redirect.get_absolute_url(session)
@@ -281,6 +314,7 @@ def votes_json(request: HttpRequest, poll_id: int) -> HttpResponse:
     Example:
     {
         "options": [1, 2, 3],
+        "cursor": 3,
         "votes": [
             {"id": 1, "nr": "+31611490678", "option": 1, "time": 1526034800000},
             {"id": 2, "nr": "+31611490678", "option": 2, "time": 1526034800001},
@@ -289,21 +323,158 @@ def votes_json(request: HttpRequest, poll_id: int) -> HttpResponse:
     }
 
     `options` contains all possible options vor this poll, and `time` is a Unix timestamp.
+
+    Only new votes can be requested with the optional GET parameters `since_id` (only
+    votes after this cursor) and `since_time` (only votes cast at or after this Unix
+    timestamp). `cursor` is the id of the last vote of the poll at the time of the
+    request, to be passed as `since_id` in the next request. Votes are ordered by id,
+    and streamed without loading them as Vote objects.
+
+    Votes that are committed late can have a lower id than the cursor, so the votes cast
+    up to POLLS_VOTES_CURSOR_OVERLAP seconds before the cursor are sent again, and clients
+    should de-duplicate votes by id.
     """
     poll = get_object_or_404(Poll, pk=poll_id)
-    votes = Vote.objects.filter(vote_option__poll=poll).prefetch_related('vote_option')
 
-    results = {
-        'options': [vo.value for vo in poll.vote_options.all()],
-        'votes': [
-            {
-                'id': vote.id,
-                'nr': vote.caller_id,
-                'option': vote.vote_option.value,
-                'time': int(vote.created.timestamp())
-            }
-            for vote in votes
+    try:
+        since_id = int(request.GET.get('since_id', 0))
+        since_time = request.GET.get('since_time')
+        since_time = datetime.fromtimestamp(float(since_time), tz=utc) if since_time else None
+    except (ValueError, OverflowError, OSError):
+        return HttpResponseBadRequest('Invalid since_id or since_time')
+
+    votes = Vote.objects.filter(vote_option__poll=poll)
+    # Votes added while streaming are left for the next request
+    cursor = votes.aggregate(last_id=Max('id'))['last_id'] or since_id
+    votes = votes_since(votes, since_id).filter(id__lte=cursor)
+    if since_time:
+        votes = votes.filter(created__gte=since_time)
+    votes = votes.order_by('id').values_list('id', 'caller_id', 'vote_option__value', 'created')
+
+    def stream_json():
+        yield '{"options": %s, "cursor": %s, "votes": [' % (
+            json.dumps([vo.value for vo in poll.vote_options.all()]), json.dumps(cursor))
+        separator = ''
+        for vote_id, caller_id, option, created in votes.iterator():
+            yield separator + json.dumps(vote_to_json(vote_id, caller_id, option, created))
+            separator = ', '
+        yield ']}'
+
+    return StreamingHttpResponse(stream_json(), content_type='application/json')
+
+
+def votes_stream(request: HttpRequest, poll_id: int) -> HttpResponse:
+    """
+    Stream the new votes and the vote counts of a poll as server-sent events.
+
+    Every event contains the votes since the previous event (in the format of votes_json),
+    the current counts of the vote options, and a cursor, which is also the id of the event.
+    Example:
+    {
+        "cursor": 3,
+        "votes": [{"id": 3, "nr": "+31611490679", "option": 2, "time": 1526034800}],
+        "tally": [{"option": 1, "count": 1}, {"option": 2, "count": 1}]
+    }
+
+    The first event contains the votes since the `since_id` GET parameter (or the
+    Last-Event-ID header of a reconnecting client). After that, votes are taken from the
+    PollBroadcaster of the poll, so clients don't query the database themselves.
+
+    The stream is closed after POLLS_LIVE_STREAM_TIMEOUT seconds, to free the worker;
+    clients (EventSource) reconnect automatically and continue from their last event.
+
+    An open stream holds a worker, so votes are only streamed when POLLS_LIVE_STREAMING is
+    set, which requires an asynchronous worker class (like gunicorn's gevent). Otherwise,
+    only the first event is sent, and the client is told to reconnect after
+    POLLS_LIVE_POLL_INTERVAL seconds: it polls for new votes with its last cursor, which
+    are taken from the PollSnapshot of the poll.
+    """
+    poll = get_object_or_404(Poll, pk=poll_id)
+
+    try:
+        since_id = int(request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('since_id', 0))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid since_id')
+
+    def server_sent_event(update: dict) -> str:
+        return f'id: {update["cursor"]}\ndata: {json.dumps(update)}\n\n'
+
+    if not settings.POLLS_LIVE_STREAMING:
+        retry = int(settings.POLLS_LIVE_POLL_INTERVAL * 1000)
+        update = PollSnapshot.get(poll).update(since_id)
+        response = HttpResponse(f'retry: {retry}\n' + server_sent_event(update),
+                                content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def stream_events():
+        subscription = PollBroadcaster.subscribe(poll)
+        try:
+            update = poll_update(poll, since_id, subscription.cursor)
+            update['cursor'] = max(since_id, subscription.cursor)
+            yield server_sent_event(update)
+
+            closes_at = time.monotonic() + settings.POLLS_LIVE_STREAM_TIMEOUT
+            while not subscription.closed and time.monotonic() < closes_at:
+                update = subscription.get(timeout=settings.POLLS_LIVE_KEEP_ALIVE_INTERVAL)
+                if update is None:
+                    # Comments keep the connection open, and detect disconnected clients
+                    yield ': keep-alive\n\n'
+                else:
+                    yield server_sent_event(update)
+        finally:
+            PollBroadcaster.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream_events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Don't let nginx buffer the events
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def votes_histogram(request: HttpRequest, poll_id: int) -> HttpResponse:
+    """
+    Get the cumulative vote counts of a poll per time bucket in a JSON format.
+
+    Only the last vote of every caller is counted. The `bucket` GET parameter is the
+    size of the buckets: minute, hour (default) or day.
+
+    Example:
+    {
+        "bucket": "hour",
+        "options": [1, 2],
+        "cursor": 3,
+        "series": [
+            {"option": 1, "data": [[1526032800, 1], [1526036400, 0]]},
+            {"option": 2, "data": [[1526032800, 1], [1526036400, 2]]}
         ]
     }
 
-    return JsonResponse(results)
+    Every point is the Unix timestamp of the start of a bucket in which votes were cast,
+    and the count at the end of that bucket. `cursor` is the id of the last vote of the
+    poll, to continue with votes_stream.
+    """
+    poll = get_object_or_404(Poll, pk=poll_id)
+
+    bucket = request.GET.get('bucket', 'hour')
+    if bucket not in BUCKETS:
+        return HttpResponseBadRequest(f'Invalid bucket, should be one of {", ".join(BUCKETS)}')
+
+    # Taken first, so votes_stream may repeat votes that are already counted, but doesn't skip any
+    cursor = Vote.objects.filter(vote_option__poll=poll).aggregate(last_id=Max('id'))['last_id'] or 0
+    finished_points, unfinished_points = VoteHistogram.for_poll(poll, bucket).series()
+    points = finished_points + unfinished_points
+    options = [vo.value for vo in poll.vote_options.all()]
+
+    return JsonResponse({
+        'bucket': bucket,
+        'options': options,
+        'cursor': cursor,
+        'series': [
+            {
+                'option': option,
+                'data': [[int(start.timestamp()), counts.get(option, 0)] for start, counts in points]
+            }
+            for option in options
+        ]
+    })
@@ -18,7 +18,7 @@ class VoiceServiceAdmin(admin.ModelAdmin):
     fieldsets = [(_('General'),    {'fields' : ['name', 'description', 'vxml_url', 'active', 'is_valid', 'validation_details', 'supported_languages']}),
                     (_('Registration process'), {'fields': ['registration', 'registration_language']}),
                     (_('Call flow'), {'fields': ['_start_element']})]
-    list_display = ('name','active')
+    list_display = ('name','active','validation_status')
     readonly_fields = ('vxml_url', 'is_valid', 'validation_details')
 
     def save_model(self, request, obj, form, change):
@@ -67,7 +67,7 @@ class VoiceServiceAdmin(admin.ModelAdmin):
 class VoiceServiceElementAdmin(admin.ModelAdmin):
     fieldsets = [(_('General'),    {'fields' : [ 'name', 'description','service','is_valid', 'validation_details', 'voice_label']})]
     list_filter = ['service']
-    list_display = ('name', 'service', 'is_valid')
+    list_display = ('name', 'service', 'validation_status')
     readonly_fields = ('is_valid', 'validation_details')
      
     def validation_details(self, obj=None):
@@ -89,8 +89,8 @@ class VoiceLabelInline(admin.TabularInline):
     model = VoiceFragment
     extra = 2
     fk_name = 'parent'
-    fieldsets = [(_('General'),    {'fields' : [ 'language', 'is_valid', 'audio', 'audio_file_player']})]
-    readonly_fields = ('audio_file_player','is_valid')
+    fieldsets = [(_('General'),    {'fields' : [ 'language', 'is_valid', 'audio', 'audio_file_player', 'conversion_status']})]
+    readonly_fields = ('audio_file_player','is_valid', 'conversion_status')
 
 
 
@@ -125,13 +125,15 @@ class VoiceLabelByVoiceServicesFilter(admin.SimpleListFilter):
         return VoiceLabel.objects.filter(voiceservicesubelement__service__id=self.value()).distinct()
 
 class VoiceLabelAdmin(admin.ModelAdmin):
-    list_display = ['name']
+    list_display = ['name', 'validation_status']
     list_filter = [VoiceLabelByVoiceServicesFilter]
     inlines = [VoiceLabelInline]
 
     def save_model(self, request, obj, form, change):
         if not settings.KASADAKA:
             messages.add_message(request, messages.WARNING, _('Automatic .wav file conversion only works when running on real KasaDaka system. MANUALLY ensure your files are in the correct format! Wave (.wav) : Sample rate 8KHz, 16 bit, mono, Codec: PCM 16 LE (s16l)'))
+        else:
+            messages.add_message(request, messages.INFO, _('New audio files are converted to the correct format in the background. The conversion status is shown with each Voice Fragment.'))
         super(VoiceLabelAdmin,self).save_model(request, obj, form, change)
 
 
@@ -173,10 +175,11 @@ class KasaDakaUserAdmin(admin.ModelAdmin):
     list_display = ('__str__','caller_id', 'service', 'language')
 
 class SpokenUserInputAdmin(admin.ModelAdmin):
-    list_display = ('__str__','category','description','audio_file_player')
-    list_filter = ('category',)
-    fieldsets = [(_('General'), {'fields' : ['audio', 'audio_file_player', 'session','category','description']})]
-    readonly_fields = ('audio','session','category', 'audio_file_player') 
+    list_display = ('__str__','category','description','duration','processing_status','audio_file_player')
+    list_filter = ('category','processing_status')
+    fieldsets = [(_('General'), {'fields' : ['audio', 'audio_file_player', 'session','category','description',
+        'duration','processing_status','processing_error']})]
+    readonly_fields = ('audio','session','category', 'audio_file_player','duration','processing_status','processing_error') 
     can_delete = True
 
     def has_add_permission(self, request):
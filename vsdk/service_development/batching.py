@@ -0,0 +1,133 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.db import IntegrityError, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class BulkCreateBuffer(object):
+    """
+    Buffers unsaved model instances in memory, and saves them in batches
+    using bulk_create(). A batch is saved when max_size instances are buffered,
+    or max_age seconds after the first instance of the batch was added.
+    Instances that are still buffered when the process exits are saved as well.
+
+    Subclasses can override after_bulk_create() to do additional work on each
+    saved batch (in the same transaction).
+    """
+
+    def __init__(self, model, max_size = 100, max_age = 5.0):
+        self.model = model
+        self.max_size = max_size
+        self.max_age = max_age
+        self.last_flush_duration = None
+        self._instances = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        atexit.register(self.flush)
+
+    @property
+    def depth(self):
+        """
+        Returns the number of instances waiting to be saved.
+        """
+        return len(self._instances)
+
+    def add(self, instance):
+        with self._lock:
+            self._instances.append(instance)
+            full = len(self._instances) >= self.max_size
+            if not full:
+                self._start_timer()
+        if full:
+            self.flush()
+
+    def _start_timer(self):
+        # Called with self._lock held
+        if self._timer is None:
+            self._timer = threading.Timer(self.max_age, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """
+        Saves all buffered instances. Returns the number of saved instances.
+        Instances that could not be saved because of an error other than an
+        IntegrityError are buffered again, and retried in max_age seconds.
+        """
+        with self._flush_lock:
+            with self._lock:
+                instances, self._instances = self._instances, []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not instances:
+                return 0
+            started = time.monotonic()
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create(instances)
+                    self.after_bulk_create(instances)
+                saved, failed = instances, []
+            except IntegrityError:
+                # A single bad instance (like one referring to a deleted row) would fail every retry
+                saved, failed = self._save_one_by_one(instances)
+            except Exception:
+                logger.exception('Could not save %d buffered %s instances, will retry',
+                        len(instances), self.model.__name__)
+                saved, failed = [], instances
+            if failed:
+                self._buffer_again(failed)
+            if saved:
+                self.last_flush_duration = time.monotonic() - started
+            return len(saved)
+
+    def _save_one_by_one(self, instances):
+        """
+        Saves the instances of a batch that failed one at a time, and drops (and logs)
+        the ones that can not be saved. Returns the saved instances, and the instances
+        that are left for a retry after another error (like a lost database connection).
+        """
+        saved = []
+        for index, instance in enumerate(instances):
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create([instance])
+                    self.after_bulk_create([instance])
+            except IntegrityError:
+                logger.exception('Dropped buffered %s instance that can not be saved: %r',
+                        self.model.__name__, instance.__dict__)
+            except Exception:
+                logger.exception('Could not save %d buffered %s instances, will retry',
+                        len(instances) - index, self.model.__name__)
+                return saved, instances[index:]
+            else:
+                saved.append(instance)
+        return saved, []
+
+    def _buffer_again(self, instances):
+        """
+        Puts instances that could not be saved back in front of the buffer, but keeps
+        at most 10 batches of them, so the buffer does not grow unbounded.
+        """
+        kept = instances[-10 * self.max_size:]
+        if len(kept) < len(instances):
+            logger.error('Dropped %d buffered %s instances that could not be saved',
+                    len(instances) - len(kept), self.model.__name__)
+        with self._lock:
+            self._instances[:0] = kept
+            self._start_timer()
+
+    def after_bulk_create(self, instances):
+        pass
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread has its own database connection
+            connection.close()
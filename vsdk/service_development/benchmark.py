@@ -0,0 +1,314 @@
+"""
+End-to-end benchmark of voice service calls.
+
+Builds a realistic voice service (multi-level choices, a record element, the polls
+and nums elements, 3 languages), and walks simulated calls through it, starting at
+voice_service_start and following the VoiceXML of every element like a caller would.
+The latency and number of SQL queries of every view are reported, and compared to
+QUERY_BUDGETS.
+
+Run it with the benchmark_call_flows management command, or as part of the tests.
+"""
+import random
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from xml.etree import ElementTree as ET
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from .models import (VoiceService, Language, VoiceLabel, VoiceFragment, Choice, ChoiceOption,
+        MessagePresentation, Record, UserInputCategory)
+
+# The maximum number of SQL queries of a single request to a view (by URL name).
+QUERY_BUDGETS = {
+        'service-development:voice-service': 8,
+        'service-development:language-selection': 6,
+        'service-development:choice': 6,
+        'service-development:message-presentation': 6,
+        'service-development:record': 6,
+        'polls:poll-duration-presentation': 8,
+        'polls:poll-results': 9,
+        'polls:ask-poll-duration': 6,
+        'polls:confirm-poll-duration': 6,
+        'polls:create-poll': 9,
+        'polls:poll-created': 7,
+        'polls:end-poll': 6,
+        'nums:generate-number': 6,
+        }
+
+LANGUAGES = [('English', 'en'), ('French', 'fr'), ('Bambara', 'bm')]
+
+# A WAV header without samples, as uploaded by the record element
+EMPTY_WAV = (b'RIFF\x24\x00\x00\x00WAVEfmt \x10\x00\x00\x00\x01\x00\x01\x00'
+        b'\x40\x1f\x00\x00\x80\x3e\x00\x00\x02\x00\x10\x00data\x00\x00\x00\x00')
+
+
+def create_benchmark_language(name, code):
+    """
+    Creates a Language with Voice Labels (and Voice Fragments) for all its interface
+    and number fields.
+    """
+    fields = [field for field in Language._meta.get_fields()
+            if field.many_to_one and field.related_model is VoiceLabel]
+    labels = {field.name: create_benchmark_voice_label('%s %s' % (code, field.name), []) for field in fields}
+    language = Language.objects.create(name = name, code = code, **labels)
+    for voice_label in labels.values():
+        VoiceFragment(parent = voice_label, language = language,
+                audio = '%s.wav' % voice_label.name.replace(' ', '_')).save()
+    return language
+
+def create_benchmark_voice_label(name, languages):
+    """
+    Creates a VoiceLabel with a VoiceFragment for each of the languages.
+    """
+    voice_label = VoiceLabel.objects.create(name = name)
+    for language in languages:
+        VoiceFragment(parent = voice_label, language = language,
+                audio = '%s_%s.wav' % (name.replace(' ', '_'), language.code)).save()
+    return voice_label
+
+@transaction.atomic
+def create_benchmark_service(depth = 3, width = 3):
+    """
+    Creates an active voice service supporting 3 languages, whose start element is a
+    Choice between:
+    - a tree of Choices (depth levels of width options), ending in messages and records
+    - the poll elements: duration, creating, results and ending a poll
+    - a random number presentation
+    """
+    from vsdk.nums.models import NumberPresentation
+    from vsdk.polls.models import (PollDurationPresentation, PollResultsPresentation,
+            AskPollDuration, AskPollDurationConfirmation, CreatePoll, ConfirmPollCreation, EndPoll)
+
+    languages = [create_benchmark_language(name, code) for name, code in LANGUAGES]
+    service = VoiceService.objects.create(name = 'benchmark', description = 'benchmark service',
+            active = True, registration = 'disabled')
+    service.supported_languages.add(*languages)
+    category = UserInputCategory.objects.create(name = 'benchmark', service = service)
+
+    def label(name):
+        return create_benchmark_voice_label(name, languages)
+
+    def element(model, name, **kwargs):
+        return model.objects.create(name = name, voice_label = label(name), service = service, **kwargs)
+
+    def option(parent, name, redirect):
+        return element(ChoiceOption, name, parent = parent, _redirect = redirect)
+
+    start = element(Choice, 'start')
+
+    def choice_tree(name, level):
+        choice = element(Choice, name)
+        for i in range(width):
+            child_name = '%s.%d' % (name, i + 1)
+            if level < depth:
+                child = choice_tree(child_name, level + 1)
+            elif i % 2:
+                child = element(Record, child_name, input_category = category,
+                        not_heard_voice_label = label(child_name + ' not heard'),
+                        repeat_voice_label = label(child_name + ' repeat'),
+                        ask_confirmation_voice_label = label(child_name + ' confirm'),
+                        final_voice_label = label(child_name + ' final'),
+                        _redirect = start)
+            else:
+                child = element(MessagePresentation, child_name, _redirect = start)
+            option(choice, child_name, child)
+        option(choice, name + ' back', start)
+        return choice
+
+    option(start, 'menu', choice_tree('menu', 1))
+
+    end = element(MessagePresentation, 'end', final_element = True)
+    results = element(PollResultsPresentation, 'results', in_previous_vote_label = label('previous'),
+            _redirect = start, _no_active_poll_redirect = start)
+    poll_created = element(ConfirmPollCreation, 'created', days_label = label('created days'),
+            _redirect = results)
+    create_poll = element(CreatePoll, 'create', _redirect = poll_created)
+    confirm_duration = element(AskPollDurationConfirmation, 'confirm duration',
+            days_label = label('confirm days'), duration_correct_label = label('correct'))
+    ask_duration = element(AskPollDuration, 'ask duration', _redirect = confirm_duration)
+    option(confirm_duration, 'confirm', create_poll)
+    option(confirm_duration, 'retry', ask_duration)
+    duration = element(PollDurationPresentation, 'duration', days_label = label('duration days'),
+            no_active_poll_label = label('no active poll'), _redirect = ask_duration,
+            _no_active_poll_redirect = ask_duration)
+    end_poll = element(EndPoll, 'end poll', _redirect = start)
+
+    option(start, 'poll', duration)
+    option(start, 'results', results)
+    option(start, 'end poll', end_poll)
+    option(start, 'number', element(NumberPresentation, 'number', final_element = True))
+    option(start, 'hang up', end)
+
+    service._start_element = start
+    service.save()
+    return service
+
+
+def vxml_elements(vxml):
+    """
+    Returns the elements of a parsed VoiceXML document, by tag name (without namespace).
+    """
+    elements = defaultdict(list)
+    for element in vxml.iter():
+        elements[element.tag.split('}')[-1]].append(element)
+    return elements
+
+def next_transition(vxml, random, recording):
+    """
+    Picks one of the gotos or submits of a parsed VoiceXML document, like a caller
+    pressing a key, and returns it as (method, url, data), or None if the call ends here.
+    Submitted variables are taken from the assigns in the document, recording() is
+    called for an uploaded recording, and a duration is a random number of days.
+    """
+    elements = vxml_elements(vxml)
+
+    variables = defaultdict(list)
+    for assign in elements['assign']:
+        variables[assign.get('name')].append(assign.get('expr').strip("'"))
+
+    transitions = [element for element in elements['goto'] + elements['submit']
+            if not element.get('next', '#').startswith('#')]
+    if not transitions:
+        return None
+    transition = random.choice(transitions)
+
+    data = {}
+    for name in transition.get('namelist', '').split():
+        if name == 'recording':
+            data[name] = recording()
+        elif name == 'duration':
+            data[name] = random.randint(1, 30)
+        else:
+            data[name] = random.choice(variables[name])
+    method = 'post' if transition.get('method', 'get').lower() == 'post' else 'get'
+    return method, transition.get('next'), data or None
+
+
+class ViewStatistics(object):
+    """
+    The latencies (in seconds) and query counts of the requests to a single view.
+    """
+
+    def __init__(self, view_name):
+        self.view_name = view_name
+        self.latencies = []
+        self.query_counts = []
+
+    def add(self, latency, query_count):
+        self.latencies.append(latency)
+        self.query_counts.append(query_count)
+
+    @staticmethod
+    def percentile(values, percentage):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percentage / 100))]
+
+    @property
+    def budget(self):
+        return QUERY_BUDGETS.get(self.view_name)
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and max(self.query_counts) > self.budget
+
+    def __str__(self):
+        return '%-45s %6d %9.1f %9.1f %8d %8d %8s' % (self.view_name, len(self.latencies),
+                self.percentile(self.latencies, 50) * 1000, self.percentile(self.latencies, 95) * 1000,
+                self.percentile(self.query_counts, 50), max(self.query_counts),
+                self.budget if self.budget is not None else '-')
+
+
+class CallWalker(object):
+    """
+    Walks simulated calls through a voice service, by following the VoiceXML
+    of every element, and keeps statistics per view.
+    """
+    max_steps = 40
+
+    def __init__(self, service, seed = 0):
+        self.service = service
+        self.client = Client()
+        self.random = random.Random(seed)
+        self.statistics = {}
+
+    def request(self, method, url, data = None):
+        view_name = resolve(urlsplit(url).path).view_name
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(url, data)
+            latency = time.perf_counter() - started
+        if view_name not in self.statistics:
+            self.statistics[view_name] = ViewStatistics(view_name)
+        self.statistics[view_name].add(latency, len(queries))
+        if response.status_code not in (200, 302):
+            raise AssertionError('%s %s returned %d' % (method.upper(), url, response.status_code))
+        return response
+
+    def call(self, caller_id):
+        """
+        Walks a single call, until it reaches a final element or max_steps.
+        """
+        method, url, data = 'get', reverse('service-development:voice-service',
+                args = [self.service.id]), {'callerid': caller_id}
+        for step in range(self.max_steps):
+            response = self.request(method, url, data)
+            if response.status_code == 302:
+                method, url, data = 'get', response.url, None
+                continue
+            transition = self.next_transition(ET.fromstring(response.content))
+            if transition is None:
+                return
+            method, url, data = transition
+
+    def next_transition(self, vxml):
+        return next_transition(vxml, self.random,
+                lambda: SimpleUploadedFile('recording.wav', EMPTY_WAV, 'audio/wav'))
+
+    @property
+    def over_budget(self):
+        return [statistics for statistics in self.statistics.values() if statistics.over_budget]
+
+    def report(self):
+        lines = ['%-45s %6s %9s %9s %8s %8s %8s' % ('view', 'calls', 'p50 (ms)', 'p95 (ms)',
+                'queries', 'max', 'budget')]
+        lines.extend(str(self.statistics[view_name]) for view_name in sorted(self.statistics))
+        return '\n'.join(lines)
+
+
+def run_benchmark(calls = 50, depth = 3, width = 3, seed = 0):
+    """
+    Builds the benchmark service, and walks calls through it, in a transaction that is
+    rolled back afterwards. Uploaded recordings are stored in a temporary directory.
+    Call steps and votes are not buffered, and fragments are not converted, so nothing
+    is saved outside of the transaction. Returns the CallWalker with the statistics.
+    """
+    with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT = media_root,
+            CALL_SESSION_STEP_BUFFERING = False, POLLS_BIP_BUFFERING = False, KASADAKA = False):
+        with transaction.atomic():
+            walker = CallWalker(create_benchmark_service(depth, width), seed)
+            for call in range(calls):
+                walker.call('benchmark%d' % call)
+            transaction.set_rollback(True)
+    return walker
+
+
+@contextmanager
+def scratch_database():
+    """
+    Replaces the configured database with a new, empty test database while the block
+    runs, and destroys it afterwards.
+    """
+    database_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity = 0, autoclobber = True, serialize = False)
+    try:
+        yield connection.settings_dict['NAME']
+    finally:
+        connection.creation.destroy_test_db(database_name, verbosity = 0)
@@ -0,0 +1,411 @@
+"""
+Content-addressed storage of audio files.
+
+Files are stored under the SHA-256 hash of their contents, as
+<upload_to>/<directories>/<hash><extension>, in the storage of their FileField
+(so this works with remote storage as well). Identical uploads are stored once,
+and since the contents behind such a name never change, its URL can be cached
+forever.
+
+The directories below upload_to are chosen by an upload layout, so no directory
+grows too large: HashPrefixLayout (ab/cd/<hash>) or DateLayout (2018/05/31/<hash>),
+set per field in settings (FRAGMENT_UPLOAD_LAYOUT, RECORDING_UPLOAD_LAYOUT) by
+their name in UPLOAD_LAYOUTS or the dotted path of a class. Files stored in
+another layout can be moved with the reshard_media management command.
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Case, Value, When
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+CONTENT_ADDRESSED_NAME = re.compile(r'(^|/)(?P<digest>[0-9a-f]{64})\.\w+$')
+
+CHUNK_SIZE = 64 * 1024
+
+
+class HashPrefixLayout(object):
+    """
+    Shards files by the first digits of their hash, in levels directories of two
+    digits (256 directories per level).
+    """
+
+    def __init__(self, levels = 2):
+        self.levels = levels
+        self.pattern = re.compile(r'^%s(?P<digest>[0-9a-f]{64})\.\w+$' % (r'[0-9a-f]{2}/' * levels))
+
+    def name(self, digest, extension, date = None):
+        shards = [digest[2 * level:2 * level + 2] for level in range(self.levels)]
+        return '/'.join(shards + [digest + extension.lower()])
+
+    def matches(self, name):
+        match = self.pattern.match(name)
+        return match is not None and self.name(match.group('digest'), os.path.splitext(name)[1]) == name
+
+
+class DateLayout(object):
+    """
+    Shards files by the date they were stored, as year/month/day directories.
+    """
+    pattern = re.compile(r'^\d{4}/\d{2}/\d{2}/[0-9a-f]{64}\.\w+$')
+
+    def name(self, digest, extension, date = None):
+        date = timezone.localtime(date or timezone.now())
+        return '%s/%s%s' % (date.strftime('%Y/%m/%d'), digest, extension.lower())
+
+    def matches(self, name):
+        return self.pattern.match(name) is not None
+
+
+UPLOAD_LAYOUTS = {
+    'hash': HashPrefixLayout,
+    'date': DateLayout,
+}
+
+
+def get_upload_layout(name):
+    """
+    Returns the upload layout with a name in UPLOAD_LAYOUTS, or the dotted path of its class.
+    """
+    layout_class = UPLOAD_LAYOUTS.get(name)
+    if layout_class is None:
+        layout_class = import_string(name)
+    return layout_class()
+
+
+def content_hash(content):
+    """
+    Returns the SHA-256 hex digest of a File, reading it in chunks.
+    """
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks(CHUNK_SIZE):
+        sha256.update(chunk)
+    content.seek(0)
+    return sha256.hexdigest()
+
+
+def is_content_addressed(name):
+    """
+    True if name is the name of a content-addressed file, which never changes.
+    """
+    return CONTENT_ADDRESSED_NAME.search(name or '') is not None
+
+
+def content_digest(name):
+    """
+    The hash in the name of a content-addressed file.
+    """
+    return CONTENT_ADDRESSED_NAME.search(name).group('digest')
+
+
+def content_addressed_name(digest, extension, directory = '', layout = None, date = None):
+    return directory + (layout or HashPrefixLayout()).name(digest, extension, date)
+
+
+def store_content(storage, content, extension, directory = '', layout = None):
+    """
+    Saves a File to storage under the hash of its contents, unless a file with
+    the same contents is stored already (in the same place of the layout), and
+    returns its name.
+
+    A file that is stored already is touched, so delete_unreferenced_files()
+    keeps it while the row that is going to use it has not been committed yet.
+    """
+    name = content_addressed_name(content_hash(content), extension, directory, layout)
+    if storage.exists(name) and touch_file(storage, name):
+        return name
+    saved_name = storage.save(name, content)
+    if saved_name != name:
+        # Stored by another process in the meantime, with the same contents
+        storage.delete(saved_name)
+    return name
+
+
+def touch_file(storage, name):
+    """
+    Sets the modification time of a local file to now. Returns False if the file
+    no longer exists (it is being deleted).
+    """
+    try:
+        os.utime(storage.path(name))
+    except NotImplementedError:
+        pass
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def modified_since(storage, name, path, since):
+    """
+    True if the file name (moved to path, for local files) was modified after the
+    timestamp since.
+    """
+    try:
+        if path is not None:
+            return os.path.getmtime(path) > since
+        return storage.get_modified_time(name).timestamp() > since
+    except (NotImplementedError, OSError):
+        return False
+
+
+def referenced_names(names):
+    """
+    The names of files that are used by a Voice Fragment or Spoken User Input.
+    """
+    from .models import VoiceFragment, SpokenUserInput
+    referenced = set()
+    for model in (VoiceFragment, SpokenUserInput):
+        referenced.update(model.objects.filter(audio__in = names).values_list('audio', flat = True))
+    return referenced
+
+
+def delete_unreferenced_files(storage, names, grace_period = None):
+    """
+    Deletes the files that are no longer used by any Voice Fragment or Spoken User
+    Input, and returns their names. Files that were modified (or stored again by
+    store_content()) in the last grace_period seconds (by default,
+    MEDIA_DELETION_GRACE_PERIOD) are kept.
+
+    A file with the same contents can be stored again while it is being deleted
+    (store_content() finds it, and a row starts using it), so the rows are checked
+    again afterwards, as well as the modification time, for rows that are not
+    committed yet. Local files are moved aside until then, and put back if they
+    are used again.
+    """
+    if grace_period is None:
+        grace_period = settings.MEDIA_DELETION_GRACE_PERIOD
+    since = time.time() - grace_period
+    names = set(names)
+    names.difference_update(referenced_names(names))
+    deleted, set_aside = set(), {}
+    for name in sorted(names):
+        try:
+            try:
+                path = storage.path(name)
+            except NotImplementedError:
+                if modified_since(storage, name, None, since):
+                    continue
+                storage.delete(name)
+            else:
+                os.rename(path, path + '.deleted')
+                set_aside[name] = path
+        except FileNotFoundError:
+            pass
+        except (NotImplementedError, OSError) as e:
+            logger.warning('Could not delete %s: %s', name, e)
+            continue
+        deleted.add(name)
+
+    recent = {name for name, path in set_aside.items() if modified_since(storage, name, path + '.deleted', since)}
+    for name in recent | referenced_names(deleted):
+        deleted.discard(name)
+        if name in set_aside:
+            os.rename(set_aside.pop(name) + '.deleted', storage.path(name))
+        else:
+            logger.error('%s was deleted while it was stored again', name)
+    for path in set_aside.values():
+        os.remove(path + '.deleted')
+    return deleted
+
+
+class DeferredDeletions(object):
+    """
+    Deletes files that are no longer used after MEDIA_DELETION_GRACE_PERIOD
+    seconds, since other processes may still serve their names (from their
+    caches) for a while. A timer thread is started per batch of names, and files
+    that are used again in the meantime are kept.
+    """
+
+    def __init__(self):
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def add(self, storage, names):
+        names = list(names)
+        if not names:
+            return
+        timer = threading.Timer(settings.MEDIA_DELETION_GRACE_PERIOD, self._run, args = (storage, names))
+        timer.daemon = True
+        with self._lock:
+            self._timers[timer] = (storage, names)
+        timer.start()
+
+    def _run(self, storage, names):
+        with self._lock:
+            self._timers.pop(threading.current_thread(), None)
+        try:
+            delete_unreferenced_files(storage, names)
+        except Exception:
+            logger.exception('Could not delete %s', ', '.join(names))
+        finally:
+            # The timer thread has its own database connection
+            connection.close()
+
+    def run_pending(self):
+        """
+        Deletes the files of all pending batches right away.
+        """
+        with self._lock:
+            timers, self._timers = self._timers, {}
+        for timer, (storage, names) in timers.items():
+            timer.cancel()
+            delete_unreferenced_files(storage, names)
+
+
+deferred_deletions = DeferredDeletions()
+
+
+class ContentAddressedFieldFile(FieldFile):
+
+    def save(self, name, content, save = True):
+        extension = os.path.splitext(name)[1] or self.field.default_extension
+        self.name = self.field.store_content(content, extension)
+        setattr(self.instance, self.field.name, self.name)
+        self._committed = True
+        if save:
+            self.instance.save()
+    save.alters_data = True
+
+
+class ContentAddressedFileField(models.FileField):
+    """
+    A FileField that stores uploaded files by the hash of their contents, in the
+    directory upload_to (which may not be a callable), in the upload layout
+    named by the setting layout_setting (by default, HashPrefixLayout).
+    """
+    attr_class = ContentAddressedFieldFile
+
+    def __init__(self, *args, default_extension = '.wav', layout_setting = None, **kwargs):
+        self.default_extension = default_extension
+        self.layout_setting = layout_setting
+        super(ContentAddressedFileField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(ContentAddressedFileField, self).deconstruct()
+        if self.default_extension != '.wav':
+            kwargs['default_extension'] = self.default_extension
+        if self.layout_setting is not None:
+            kwargs['layout_setting'] = self.layout_setting
+        return name, path, args, kwargs
+
+    def content_directory(self):
+        directory = str(self.upload_to or '')
+        return directory if not directory or directory.endswith('/') else directory + '/'
+
+    def layout(self):
+        if self.layout_setting is None:
+            return HashPrefixLayout()
+        return get_upload_layout(getattr(settings, self.layout_setting))
+
+    def store_content(self, content, extension):
+        """
+        Saves a File to the storage of this field, and returns its name.
+        """
+        return store_content(self.storage, content, extension, self.content_directory(), self.layout())
+
+
+def rehash_files(model, field_name = 'audio'):
+    """
+    Stores the files of a ContentAddressedFileField that were saved before it was
+    content-addressed under the hash of their contents, and updates the rows using
+    them. Returns a dict of the old to the new names, and a list of the names of
+    files that could not be read.
+    """
+    field = model._meta.get_field(field_name)
+    names = model.objects.exclude(**{field_name: ''}).values_list(field_name, flat = True).distinct()
+    renamed, missing = {}, []
+    for name in sorted(names):
+        if is_content_addressed(name):
+            continue
+        try:
+            with field.storage.open(name) as content:
+                extension = os.path.splitext(name)[1] or field.default_extension
+                renamed[name] = field.store_content(content, extension)
+        except (OSError, NotImplementedError) as e:
+            logger.warning('Could not rehash %s: %s', name, e)
+            missing.append(name)
+            continue
+        model.objects.filter(**{field_name: name}).update(**{field_name: renamed[name]})
+    return renamed, missing
+
+
+def copy_file(storage, name, new_name):
+    """
+    Copies a file within storage (as a hard link when possible), unless new_name exists already.
+    """
+    if storage.exists(new_name):
+        return
+    try:
+        path, new_path = storage.path(name), storage.path(new_name)
+    except NotImplementedError:
+        with storage.open(name) as content:
+            saved_name = storage.save(new_name, content)
+        if saved_name != new_name:
+            storage.delete(saved_name)
+        return
+    os.makedirs(os.path.dirname(new_path), exist_ok = True)
+    try:
+        os.link(path, new_path)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copyfile(path, new_path)
+
+
+def reshard_files(model, field_name = 'audio', batch_size = 500):
+    """
+    Moves the files of a ContentAddressedFileField that are not in its upload
+    layout (or not content-addressed yet) to their place in the layout, in batches
+    of batch_size files. The files of a batch are copied, and the rows using them
+    are updated at once. The old files are left in place, since other processes
+    may still use their names for a while (see MEDIA_DELETION_GRACE_PERIOD).
+    Returns a dict of the old to the new names, and a list of the names of files
+    that could not be read.
+    """
+    field = model._meta.get_field(field_name)
+    directory, layout = field.content_directory(), field.layout()
+    names = sorted(model.objects.exclude(**{field_name: ''}).values_list(field_name, flat = True).distinct())
+    moved, missing = {}, []
+    for start in range(0, len(names), batch_size):
+        batch = {}
+        for name in names[start:start + batch_size]:
+            if name.startswith(directory) and layout.matches(name[len(directory):]):
+                continue
+            try:
+                if is_content_addressed(name):
+                    digest = content_digest(name)
+                else:
+                    with field.storage.open(name) as content:
+                        digest = content_hash(content)
+                try:
+                    date = field.storage.get_modified_time(name)
+                except NotImplementedError:
+                    date = None
+                extension = os.path.splitext(name)[1] or field.default_extension
+                new_name = content_addressed_name(digest, extension, directory, layout, date)
+                copy_file(field.storage, name, new_name)
+            except (OSError, NotImplementedError) as e:
+                logger.warning('Could not move %s: %s', name, e)
+                missing.append(name)
+                continue
+            batch[name] = new_name
+        if not batch:
+            continue
+
+        with transaction.atomic():
+            model.objects.filter(**{field_name + '__in': list(batch)}).update(**{field_name: Case(
+                    *[When(then = Value(new_name), **{field_name: name}) for name, new_name in batch.items()],
+                    output_field = models.CharField())})
+        moved.update(batch)
+    return moved, missing
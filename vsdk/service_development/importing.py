@@ -0,0 +1,192 @@
+"""
+Bulk import of Voice Labels from a directory tree of audio files.
+
+The tree has a directory per language (named by the language code), in which
+every audio file (.wav or .mp3) is a Voice Fragment in that language, named
+<label>_<language code>.<extension>. The name of its Voice Label is the path of
+the file below the language directory, without that suffix, so
+en/numbers/1_en.wav and fr/numbers/1_fr.wav are the English and French
+fragments of the Voice Label "numbers/1".
+"""
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files import File
+from django.db import transaction
+
+from .models import Language, VoiceLabel, VoiceFragment, voice_fragment_url_index, validation_queue
+from .transcoding import convert_audio_file
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3')
+
+AudioFile = namedtuple('AudioFile', ['path', 'language_code', 'label_name'])
+
+
+def number_field(label_name):
+    """
+    Returns the number field of Language for a label name, if the last part of the
+    name is a number sample key (like 1, 20, and) or field (like one, twenty, andsep).
+    """
+    name = label_name.rsplit('/', 1)[-1].lower()
+    for key, field in Language.number_sample_fields:
+        if name in (str(key), field):
+            return field
+    return None
+
+
+def scan_audio_files(root, prefix = ''):
+    """
+    Returns the AudioFiles in the directory tree at root, sorted by path.
+    Files that do not follow the naming conventions are skipped.
+    """
+    audio_files = []
+    for language_code in sorted(os.listdir(root)):
+        language_root = os.path.join(root, language_code)
+        if not os.path.isdir(language_root):
+            continue
+        for directory, subdirectories, files in os.walk(language_root):
+            subdirectories.sort()
+            for file_name in sorted(files):
+                stem, extension = os.path.splitext(file_name)
+                suffix = '_' + language_code
+                if extension.lower() not in AUDIO_EXTENSIONS or not stem.endswith(suffix):
+                    continue
+                relative_directory = os.path.relpath(directory, language_root)
+                label_name = stem[:-len(suffix)]
+                if relative_directory != '.':
+                    label_name = '/'.join(relative_directory.split(os.sep) + [label_name])
+                audio_files.append(AudioFile(os.path.join(directory, file_name), language_code,
+                        prefix + label_name))
+    return audio_files
+
+
+def convert_or_copy_audio_file(path, converted_path):
+    """
+    Like convert_audio_file, but copies files that already have the correct format.
+    Returns True if the file was converted. Runs in a worker process.
+    """
+    if not convert_audio_file(path, converted_path):
+        shutil.copyfile(path, converted_path)
+        return False
+    return True
+
+
+class VoiceLabelImport(object):
+    """
+    Imports the audio files in a directory tree as Voice Labels and Fragments.
+    Files are converted (or copied) in a pool of processes, then saved to the
+    storage of Voice Fragments, and all rows are created with bulk_create().
+    """
+
+    def __init__(self, root, prefix = '', replace = False, numbers = False, workers = None):
+        self.root = root
+        self.prefix = prefix
+        self.replace = replace
+        self.numbers = numbers
+        self.workers = workers
+        self.created_voice_labels = 0
+        self.created_fragments = 0
+        self.converted = 0
+        self.skipped = []
+        self.number_fields = {}
+        # The names of the audio files of replaced Voice Fragments
+        self.replaced_names = set()
+
+    def run(self):
+        languages = {language.code: language for language in Language.objects.all()}
+        audio_files = []
+        for audio_file in scan_audio_files(self.root, self.prefix):
+            if audio_file.language_code not in languages:
+                self.skipped.append((audio_file.path, 'unknown language'))
+            elif len(audio_file.label_name) > VoiceLabel._meta.get_field('name').max_length:
+                self.skipped.append((audio_file.path, 'label name too long'))
+            else:
+                audio_files.append(audio_file)
+
+        existing = set(VoiceFragment.objects.filter(parent__name__in = {audio_file.label_name
+                for audio_file in audio_files}).values_list('parent__name', 'language__code'))
+        if not self.replace:
+            for audio_file in audio_files:
+                if (audio_file.label_name, audio_file.language_code) in existing:
+                    self.skipped.append((audio_file.path, 'already imported'))
+            audio_files = [audio_file for audio_file in audio_files
+                    if (audio_file.label_name, audio_file.language_code) not in existing]
+
+        with tempfile.TemporaryDirectory() as converted_root:
+            audio_files, names = self.convert(audio_files, converted_root)
+            with transaction.atomic():
+                self.create(audio_files, names, languages)
+
+    def convert(self, audio_files, converted_root):
+        """
+        Converts the audio files in parallel, and saves them to the storage by the
+        hash of their contents.
+        Returns the converted audio files, and their names in the storage with
+        their conversion status.
+        """
+        field = VoiceFragment._meta.get_field('audio')
+        with ProcessPoolExecutor(max_workers = self.workers) as executor:
+            futures = [executor.submit(convert_or_copy_audio_file, audio_file.path,
+                    os.path.join(converted_root, '%d.wav' % i)) for i, audio_file in enumerate(audio_files)]
+
+        converted_files, names = [], []
+        for i, (audio_file, future) in enumerate(zip(audio_files, futures)):
+            try:
+                converted = future.result()
+            except Exception as e:
+                self.skipped.append((audio_file.path, 'conversion failed: %s' % e))
+                continue
+            with open(os.path.join(converted_root, '%d.wav' % i), 'rb') as converted_file:
+                names.append((field.store_content(File(converted_file), '.wav'),
+                        'converted' if converted else 'correct'))
+            self.converted += converted
+            converted_files.append(audio_file)
+        return converted_files, names
+
+    def create(self, audio_files, names, languages):
+        label_names = sorted({audio_file.label_name for audio_file in audio_files})
+        voice_labels = {}
+        for voice_label in VoiceLabel.objects.filter(name__in = label_names).order_by('-id'):
+            voice_labels[voice_label.name] = voice_label
+        new_voice_labels = [VoiceLabel(name = name) for name in label_names if name not in voice_labels]
+        VoiceLabel.objects.bulk_create(new_voice_labels)
+        self.created_voice_labels = len(new_voice_labels)
+        # bulk_create() does not set the ids on all databases
+        for voice_label in VoiceLabel.objects.filter(name__in = [voice_label.name
+                for voice_label in new_voice_labels]).order_by('-id'):
+            voice_labels[voice_label.name] = voice_label
+
+        if self.replace:
+            for audio_file in audio_files:
+                replaced = VoiceFragment.objects.filter(parent = voice_labels[audio_file.label_name],
+                        language = languages[audio_file.language_code])
+                self.replaced_names.update(replaced.values_list('audio', flat = True))
+                replaced.delete()
+        VoiceFragment.objects.bulk_create([VoiceFragment(parent = voice_labels[audio_file.label_name],
+                language = languages[audio_file.language_code], audio = name, conversion_status = status)
+                for audio_file, (name, status) in zip(audio_files, names)])
+        self.created_fragments = len(audio_files)
+
+        if self.numbers:
+            self.wire_numbers(audio_files, voice_labels, languages)
+
+        # bulk_create() does not send signals
+        voice_fragment_url_index.invalidate()
+        for voice_label in voice_labels.values():
+            validation_queue.add_voice_label(voice_label.id)
+
+    def wire_numbers(self, audio_files, voice_labels, languages):
+        """
+        Points the number fields of the languages to the imported number labels.
+        """
+        for audio_file in audio_files:
+            field = number_field(audio_file.label_name)
+            if field is not None:
+                language = languages[audio_file.language_code]
+                setattr(language, field, voice_labels[audio_file.label_name])
+                self.number_fields.setdefault(language.code, []).append(field)
+        for code in self.number_fields:
+            languages[code].save()
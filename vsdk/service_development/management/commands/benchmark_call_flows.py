@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from vsdk.service_development.benchmark import run_benchmark, scratch_database
+
+
+class Command(BaseCommand):
+    help = ('Walks simulated calls through a generated voice service, and reports the latency '
+            'and SQL queries per view. Fails when a view exceeds its query budget. '
+            'It runs in a new test database, which is destroyed afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type = int, default = 50, help = 'Number of calls to walk')
+        parser.add_argument('--depth', type = int, default = 3, help = 'Number of levels of the choice tree')
+        parser.add_argument('--width', type = int, default = 3, help = 'Number of options per choice')
+        parser.add_argument('--seed', type = int, default = 0, help = 'Seed of the choices of the callers')
+        parser.add_argument('--use-configured-database', action = 'store_true',
+                help = 'Run in the configured database instead (never a production database), in a '
+                       'transaction that is rolled back afterwards, for when no test database can be created')
+
+    def handle(self, *args, **options):
+        if options['use_configured_database']:
+            walker = self.run_benchmark(options)
+        else:
+            with scratch_database():
+                walker = self.run_benchmark(options)
+        self.stdout.write(walker.report())
+        over_budget = walker.over_budget
+        if over_budget:
+            raise CommandError('Query budget exceeded: %s' % ', '.join(
+                '%s (%d > %d)' % (statistics.view_name, max(statistics.query_counts), statistics.budget)
+                for statistics in over_budget))
+
+    def run_benchmark(self, options):
+        return run_benchmark(options['calls'], options['depth'], options['width'], options['seed'])
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from vsdk.service_development.splicing import delete_unused_spliced_files
+
+
+class Command(BaseCommand):
+    help = ('Deletes the spliced audio files of announcements (like spoken numbers and vote counts) '
+            'that were not used for a number of days. Files that are still used are spliced again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type = float, default = 7,
+                help = 'Number of days after which an unused spliced file is deleted')
+
+    def handle(self, *args, **options):
+        deleted = delete_unused_spliced_files(timedelta(days = options['days']))
+        self.stdout.write('Deleted %d spliced files' % len(deleted))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from vsdk.service_development.models import VoiceFragment
+from vsdk.service_development.transcoding import audio_conversion_queue
+
+
+class Command(BaseCommand):
+    help = ('Converts the audio files of Voice Fragments that are waiting for conversion (for example after a '
+            'restart) to the correct format, in parallel, and waits until they are done.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed', action = 'store_true', help = 'Also retry failed conversions')
+        parser.add_argument('--all', action = 'store_true', help = 'Check and convert all Voice Fragments')
+
+    def handle(self, *args, **options):
+        fragments = VoiceFragment.objects.exclude(audio = '').order_by('id')
+        if not options['all']:
+            fragments = fragments.filter(conversion_status__in = ['pending', 'failed'] if options['failed'] else ['pending'])
+        fragments = list(fragments.values_list('id', 'audio'))
+        VoiceFragment.objects.filter(pk__in = [fragment_id for fragment_id, audio in fragments]).update(
+                conversion_status = 'pending', conversion_error = '')
+        for fragment_id, audio in fragments:
+            audio_conversion_queue.submit(fragment_id, audio)
+        audio_conversion_queue.shutdown()
+
+        results = VoiceFragment.objects.filter(pk__in = [fragment_id for fragment_id, audio in fragments])
+        for status, description in VoiceFragment.conversion_status_choices:
+            count = results.filter(conversion_status = status).count()
+            if count:
+                self.stdout.write('%s: %d' % (description, count))
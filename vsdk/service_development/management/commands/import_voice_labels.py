@@ -0,0 +1,50 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from vsdk.service_development.content_store import delete_unreferenced_files
+from vsdk.service_development.importing import VoiceLabelImport
+from vsdk.service_development.models import VoiceFragment
+
+
+class Command(BaseCommand):
+    help = ('Imports Voice Labels from a directory tree with a directory per language code, containing '
+            '<label>_<language code>.wav (or .mp3) files, for example bipvote_samples/en/numbers/1_en.wav. '
+            'Files are converted to the correct format in parallel.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help = 'The directory containing the language directories')
+        parser.add_argument('--prefix', default = '', help = 'Prefix of the names of the Voice Labels')
+        parser.add_argument('--replace', action = 'store_true',
+                help = 'Replace the Voice Fragments of labels that were imported before')
+        parser.add_argument('--numbers', action = 'store_true',
+                help = 'Point the number fields of the languages to the imported number labels '
+                    '(like numbers/1_en.wav or one_fr.wav)')
+        parser.add_argument('--workers', type = int, help = 'Number of conversion processes (default: number of CPUs)')
+        parser.add_argument('--grace-period', type = float, default = settings.MEDIA_DELETION_GRACE_PERIOD,
+                help = 'Number of seconds to wait before deleting the audio files of replaced Voice Fragments, '
+                       'while running processes may still use their names')
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['directory']):
+            raise CommandError('%s is not a directory' % options['directory'])
+        voice_label_import = VoiceLabelImport(options['directory'], prefix = options['prefix'],
+                replace = options['replace'], numbers = options['numbers'], workers = options['workers'])
+        voice_label_import.run()
+
+        for path, reason in voice_label_import.skipped:
+            self.stderr.write('Skipped %s: %s' % (path, reason))
+        self.stdout.write('Created %d Voice Labels and %d Voice Fragments (%d converted)' % (
+                voice_label_import.created_voice_labels, voice_label_import.created_fragments,
+                voice_label_import.converted))
+        for code, fields in sorted(voice_label_import.number_fields.items()):
+            self.stdout.write('Number labels of %s: %s' % (code, ', '.join(fields)))
+
+        if not voice_label_import.replaced_names:
+            return
+        self.stdout.write('Deleting the replaced audio files in %g seconds' % options['grace_period'])
+        time.sleep(options['grace_period'])
+        delete_unreferenced_files(VoiceFragment._meta.get_field('audio').storage, voice_label_import.replaced_names,
+                options['grace_period'])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from vsdk.service_development.models import VoiceService, VoiceLabel, validation_queue
+
+
+class Command(BaseCommand):
+    help = ('Validates all voice services (with their elements) and voice labels, and stores the results '
+            'shown in the admin. They are kept up to date automatically afterwards.')
+
+    def handle(self, *args, **options):
+        for service in VoiceService.objects.order_by('id'):
+            validation_queue.validate_service(service)
+            self.stdout.write('Validated %s' % service)
+        voice_label_ids = list(VoiceLabel.objects.values_list('id', flat = True))
+        validation_queue.validate_voice_labels(voice_label_ids)
+        self.stdout.write('Validated %d voice labels' % len(voice_label_ids))
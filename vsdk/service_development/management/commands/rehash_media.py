@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vsdk.service_development.content_store import delete_unreferenced_files, rehash_files
+from vsdk.service_development.media import audio_file_cache
+from vsdk.service_development.models import VoiceFragment, SpokenUserInput, voice_fragment_url_index
+
+
+class Command(BaseCommand):
+    help = ('Stores the audio files of Voice Fragments and Spoken User Inputs that were uploaded before '
+            'they were content-addressed under the hash of their contents, so identical files are stored '
+            'once, and deletes the original files after a grace period.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-originals', action = 'store_true', help = 'Do not delete the original files')
+        parser.add_argument('--grace-period', type = float, default = settings.MEDIA_DELETION_GRACE_PERIOD,
+                help = 'Number of seconds to wait before deleting the original files, while running '
+                       'processes may still use their names')
+
+    def handle(self, *args, **options):
+        originals = []
+        for model in (VoiceFragment, SpokenUserInput):
+            renamed, missing = rehash_files(model)
+            for name in missing:
+                self.stderr.write('Could not read %s' % name)
+            originals.append((model._meta.get_field('audio').storage, renamed))
+            self.stdout.write('%s: rehashed %d files into %d files' % (model._meta.verbose_name,
+                    len(renamed), len(set(renamed.values()))))
+
+        # Rows were updated without signals
+        voice_fragment_url_index.invalidate()
+        audio_file_cache.invalidate()
+
+        if options['keep_originals'] or not any(renamed for storage, renamed in originals):
+            return
+        self.stdout.write('Deleting the original files in %g seconds' % options['grace_period'])
+        time.sleep(options['grace_period'])
+        for storage, renamed in originals:
+            delete_unreferenced_files(storage, renamed, options['grace_period'])
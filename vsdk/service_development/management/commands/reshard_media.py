@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vsdk.service_development.content_store import delete_unreferenced_files, reshard_files
+from vsdk.service_development.media import audio_file_cache
+from vsdk.service_development.models import VoiceFragment, SpokenUserInput, voice_fragment_url_index
+
+
+class Command(BaseCommand):
+    help = ('Moves the audio files of Voice Fragments and Spoken User Inputs to their place in the upload '
+            'layout (FRAGMENT_UPLOAD_LAYOUT and RECORDING_UPLOAD_LAYOUT), in batches, storing files that are '
+            'not content-addressed yet under the hash of their contents. The old files are deleted after '
+            'a grace period.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type = int, default = 500,
+                help = 'Number of files that are moved (and updated in the database) at once')
+        parser.add_argument('--grace-period', type = float, default = settings.MEDIA_DELETION_GRACE_PERIOD,
+                help = 'Number of seconds to wait before deleting the old files, while running '
+                       'processes may still use their names')
+
+    def handle(self, *args, **options):
+        old_files = []
+        for model in (VoiceFragment, SpokenUserInput):
+            moved, missing = reshard_files(model, batch_size = options['batch_size'])
+            for name in missing:
+                self.stderr.write('Could not move %s' % name)
+            old_files.append((model._meta.get_field('audio').storage, moved))
+            self.stdout.write('%s: moved %d files' % (model._meta.verbose_name, len(moved)))
+
+        # Rows were updated without signals
+        voice_fragment_url_index.invalidate()
+        audio_file_cache.invalidate()
+
+        if not any(moved for storage, moved in old_files):
+            return
+        self.stdout.write('Deleting the old files in %g seconds' % options['grace_period'])
+        time.sleep(options['grace_period'])
+        for storage, moved in old_files:
+            delete_unreferenced_files(storage, moved, options['grace_period'])
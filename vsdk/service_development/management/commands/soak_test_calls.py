@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from vsdk.service_development.soak import SoakTestDriver
+
+
+class Command(BaseCommand):
+    help = ('Drives concurrent simulated calls (like the VoiceXML interpreter of Asterisk) '
+            'against a running server, and reports throughput, latency percentiles and error rates.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url', help = 'URL of the server, for example http://127.0.0.1:8000')
+        parser.add_argument('voice_service_id', type = int, help = 'The voice service to call')
+        parser.add_argument('--callers', type = int, default = 10, help = 'Number of simultaneous callers')
+        parser.add_argument('--duration', type = float, help = 'Number of seconds to run (default 60)')
+        parser.add_argument('--calls', type = int, help = 'Number of calls to make, instead of a duration')
+        parser.add_argument('--no-audio', action = 'store_true', help = 'Do not fetch the audio of the elements')
+        parser.add_argument('--bip-ratio', type = float, default = 0.0,
+                help = 'Fraction of the calls after which a bip is fired')
+        parser.add_argument('--timeout', type = float, default = 30, help = 'Timeout of a request in seconds')
+        parser.add_argument('--seed', type = int, default = 0, help = 'Seed of the choices of the callers')
+
+    def handle(self, *args, **options):
+        if options['callers'] < 1:
+            raise CommandError('There should be at least one caller')
+        duration = options['duration']
+        if duration is None and options['calls'] is None:
+            duration = 60
+        driver = SoakTestDriver(options['base_url'], options['voice_service_id'],
+                callers = options['callers'], duration = duration, calls = options['calls'],
+                fetch_audio = not options['no_audio'], bip_ratio = options['bip_ratio'],
+                timeout = options['timeout'], seed = options['seed'])
+        statistics = driver.run()
+        self.stdout.write(statistics.report())
@@ -0,0 +1,134 @@
+"""
+Checks of the audio files of Voice Fragments, which may be on remote storage
+(SFTP, or only reachable over HTTP).
+"""
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .wave import WaveFormatError, read_wave_format, read_wave_format_from_url
+
+
+class AudioFileStatus(object):
+    """
+    The result of checking an audio file. version identifies the contents of the
+    file: its size and modification time, or its ETag for files checked over HTTP.
+    It is None if the file is not accessible. wave_format is the WaveFormat read
+    from the header of the file, or None if it is not a Wave file.
+    """
+
+    def __init__(self, version, wave_format = None):
+        self.version = version
+        self.wave_format = wave_format
+        self.checked_at = time.monotonic()
+
+    @property
+    def accessible(self):
+        return self.version is not None
+
+
+class AudioFileCache(object):
+    """
+    Process-wide cache of the status of audio files, by file name.
+
+    A status is reused for MEDIA_VALIDATION_CACHE_TIMEOUT seconds, and dropped when
+    the Voice Fragment of the file is saved or deleted in this process. After that,
+    the format is only read again when the version of the file changed. Many files
+    are checked concurrently by check_all(), on at most MEDIA_VALIDATION_WORKERS threads.
+    """
+
+    def __init__(self):
+        self._statuses = {}
+        self._lock = threading.Lock()
+
+    def get_status(self, fieldfile):
+        """
+        Returns the AudioFileStatus of the file of a FileField, checking it if needed.
+        """
+        status = self._statuses.get(fieldfile.name)
+        if status is None or time.monotonic() - status.checked_at > settings.MEDIA_VALIDATION_CACHE_TIMEOUT:
+            version = self.file_version(fieldfile)
+            if version is None:
+                status = AudioFileStatus(None)
+            elif status is not None and status.version == version:
+                status = AudioFileStatus(version, status.wave_format)
+            else:
+                status = AudioFileStatus(version, self.wave_format(fieldfile))
+            with self._lock:
+                self._statuses[fieldfile.name] = status
+        return status
+
+    def is_accessible(self, fieldfile):
+        return self.get_status(fieldfile).accessible
+
+    def check_all(self, fieldfiles):
+        """
+        Checks the files of many FileFields concurrently, and returns their
+        AudioFileStatus by file name.
+        """
+        fieldfiles = list({fieldfile.name: fieldfile for fieldfile in fieldfiles if fieldfile}.values())
+        if not fieldfiles:
+            return {}
+        workers = max(1, min(settings.MEDIA_VALIDATION_WORKERS, len(fieldfiles)))
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            statuses = executor.map(self.get_status, fieldfiles)
+            return {fieldfile.name: status for fieldfile, status in zip(fieldfiles, statuses)}
+
+    def invalidate(self, name = None):
+        with self._lock:
+            if name is None:
+                self._statuses.clear()
+            else:
+                self._statuses.pop(name, None)
+
+    def file_version(self, fieldfile):
+        """
+        Returns the size and modification time of the file in its storage, or the
+        version reported by the web server when the storage can not tell.
+        Returns None if the file is not accessible.
+        """
+        storage = fieldfile.storage
+        try:
+            size = storage.size(fieldfile.name)
+        except NotImplementedError:
+            return self.http_version(fieldfile.url)
+        except (OSError, ValueError):
+            return None
+        try:
+            modified = storage.get_modified_time(fieldfile.name).timestamp()
+        except (NotImplementedError, OSError):
+            modified = None
+        return (size, modified)
+
+    def wave_format(self, fieldfile):
+        """
+        Returns the WaveFormat of the file, read from the storage or over HTTP, or None.
+        """
+        try:
+            try:
+                path = fieldfile.path
+            except NotImplementedError:
+                return read_wave_format_from_url(fieldfile.url)
+            return read_wave_format(path)
+        except (WaveFormatError, OSError):
+            return None
+
+    def http_version(self, url):
+        """
+        Returns the ETag (or length and modification date) of the file at url,
+        with a HEAD request. Returns None if it is not accessible.
+        """
+        request = urllib.request.Request(url, method = 'HEAD')
+        try:
+            with urllib.request.urlopen(request, timeout = settings.MEDIA_VALIDATION_TIMEOUT) as response:
+                return (response.headers.get('ETag')
+                        or (response.headers.get('Content-Length'), response.headers.get('Last-Modified')))
+        except (urllib.error.URLError, OSError, ValueError):
+            return None
+
+
+audio_file_cache = AudioFileCache()
@@ -0,0 +1,201 @@
+"""
+Per-request metrics of the VoiceXML views.
+
+RequestMetricsMiddleware records the number of SQL queries, the query time, the
+template render time and the total time of every request to the vxml/, polls/ and
+nums/ URLs, per view (which is the _urls_name of the element type). These are kept
+as in-memory histograms (per process), which are exposed as plain text by the
+metrics view. Requests that exceed REQUEST_METRICS_SLOW_QUERY_COUNT queries or
+REQUEST_METRICS_SLOW_REQUEST_TIME seconds are logged, with their SQL.
+"""
+import bisect
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+# The URL namespaces of the views for which metrics are recorded, and their URL prefixes
+# (other requests, like those of the admin, are not instrumented at all)
+METRICS_NAMESPACES = ('service-development', 'polls', 'nums')
+METRICS_PATH_PREFIXES = ('/vxml/', '/polls/', '/nums/')
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+_current = threading.local()
+
+
+def current_request_metrics():
+    """
+    Returns the RequestMetrics of the request handled by this thread, or None.
+    """
+    return getattr(_current, 'metrics', None)
+
+
+class RequestMetrics(object):
+    """
+    The queries and template render time of a single request. Used as an execute
+    wrapper of the database connection, to time every query.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.query_time = 0.0
+        self.template_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.query_time += duration
+            self.queries.append((sql, duration))
+
+
+class Histogram(object):
+    """
+    The number of observed values up to each of the buckets, like a Prometheus histogram.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        Returns (upper bound, number of values up to it) for every bucket, ending with '+Inf'.
+        """
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry(object):
+    """
+    The histograms of the metrics of all requests, per view.
+    """
+    metrics = (
+            ('vsdk_request_duration_seconds', 'Total time of a request', TIME_BUCKETS),
+            ('vsdk_request_queries', 'Number of SQL queries of a request', QUERY_BUCKETS),
+            ('vsdk_request_query_duration_seconds', 'Time spent in SQL queries of a request', TIME_BUCKETS),
+            ('vsdk_request_template_duration_seconds', 'Time spent rendering templates of a request',
+                TIME_BUCKETS),
+            )
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view_name, request_metrics, duration):
+        values = (duration, len(request_metrics.queries), request_metrics.query_time,
+                request_metrics.template_time)
+        with self._lock:
+            for (name, description, buckets), value in zip(self.metrics, values):
+                key = (name, view_name)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(buckets)
+                self.histograms[key].observe(value)
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def render(self):
+        """
+        Returns the histograms in the Prometheus text format.
+        """
+        lines = []
+        with self._lock:
+            for name, description, buckets in self.metrics:
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s histogram' % name)
+                for (metric_name, view_name) in sorted(self.histograms):
+                    if metric_name != name:
+                        continue
+                    histogram = self.histograms[(name, view_name)]
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append('%s_bucket{view="%s",le="%s"} %d' % (name, view_name, bound, count))
+                    lines.append('%s_sum{view="%s"} %s' % (name, view_name, round(histogram.sum, 6)))
+                    lines.append('%s_count{view="%s"} %d' % (name, view_name, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+metrics_registry = MetricsRegistry()
+
+
+class RequestMetricsMiddleware(object):
+    """
+    Records the metrics of the requests to the views in METRICS_NAMESPACES
+    (except the metrics view itself), and logs slow requests.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path_info.startswith(METRICS_PATH_PREFIXES):
+            return self.get_response(request)
+        request_metrics = _current.metrics = RequestMetrics()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(request_metrics):
+                response = self.get_response(request)
+        finally:
+            _current.metrics = None
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        if match and match.namespace in METRICS_NAMESPACES and match.view_name != 'service-development:metrics':
+            metrics_registry.observe(match.view_name, request_metrics, duration)
+            if (len(request_metrics.queries) > settings.REQUEST_METRICS_SLOW_QUERY_COUNT
+                    or duration > settings.REQUEST_METRICS_SLOW_REQUEST_TIME):
+                self.log_slow_request(request, match.view_name, request_metrics, duration)
+        return response
+
+    def log_slow_request(self, request, view_name, request_metrics, duration):
+        logger.warning('Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms, templates %.1f ms\n%s',
+                request.method, request.get_full_path(), view_name, duration * 1000,
+                len(request_metrics.queries), request_metrics.query_time * 1000,
+                request_metrics.template_time * 1000,
+                '\n'.join('%8.1f ms  %s' % (query_duration * 1000, sql)
+                    for sql, query_duration in request_metrics.queries))
+
+
+class InstrumentedTemplate(Template):
+    """
+    A Django template that adds its render time to the metrics of the current request.
+    """
+
+    def render(self, context = None, request = None):
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            request_metrics = current_request_metrics()
+            if request_metrics is not None:
+                request_metrics.template_time += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, with render times recorded by RequestMetricsMiddleware.
+    """
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name).template, self)
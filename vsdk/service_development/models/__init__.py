@@ -7,3 +7,5 @@ from .vse_choice import *
 from .vse_message import *
 from .vse_record import *
 from .user_input import *
+from .call_flow import *
+from .validation_queue import *
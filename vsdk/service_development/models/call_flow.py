@@ -0,0 +1,188 @@
+import threading
+from collections import defaultdict
+from types import MappingProxyType
+
+from django.db.models import Count, Max, Prefetch, prefetch_related_objects
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.shortcuts import get_object_or_404
+
+from ..media import audio_file_cache
+from .voicelabel import VoiceLabel, VoiceFragment
+from .voiceservice import VoiceService
+from .vs_element import VoiceServiceSubElement
+from .vse_choice import Choice, ChoiceOption
+
+
+class CompiledCallFlow(object):
+    """
+    An in-memory snapshot of the call flow of a Voice Service: all its
+    elements as their actual subclassed objects, with their redirects, choice
+    options and voice labels already resolved.
+
+    Snapshots are shared between requests, so the elements taken from them
+    must be treated as read-only. A snapshot is reused until the modification
+    date of the service or of any of its elements changes.
+    """
+    _cache = {}
+    _lock = threading.Lock()
+
+    def __init__(self, service, version, elements):
+        self.service = service
+        self.version = version
+        self.elements = MappingProxyType(elements)
+
+    def get_element(self, element_id):
+        """
+        Returns the subclassed element with element_id, or None if it is not
+        part of this call flow.
+        """
+        return self.elements.get(int(element_id))
+
+    @classmethod
+    def current_version(cls, service_id):
+        """
+        Returns a value that changes whenever the service or one of its
+        elements is modified, or None if the service does not exist.
+        """
+        return VoiceService.objects.filter(pk = service_id).annotate(
+                latest_modification = Max('voiceservicesubelement__modification_date'),
+                number_of_elements = Count('voiceservicesubelement')).values_list(
+                'modification_date', 'latest_modification', 'number_of_elements').first()
+
+    @classmethod
+    def for_service(cls, service_id):
+        """
+        Returns the up-to-date compiled call flow of the service with service_id,
+        compiling it if necessary. Returns None if the service does not exist.
+        """
+        version = cls.current_version(service_id)
+        if version is None:
+            return None
+        flow = cls._cache.get(service_id)
+        if flow is not None and flow.version == version:
+            return flow
+        flow = cls.compile(service_id, version)
+        with cls._lock:
+            cls._cache[service_id] = flow
+        return flow
+
+    @classmethod
+    def invalidate(cls, service_id = None):
+        """
+        Drops the compiled call flow of a service (or of all services).
+        """
+        with cls._lock:
+            if service_id is None:
+                cls._cache.clear()
+            else:
+                cls._cache.pop(service_id, None)
+
+    @classmethod
+    def compile(cls, service_id, version):
+        service = VoiceService.objects.get(pk = service_id)
+        elements = {element.id: element for element in
+                VoiceServiceSubElement.objects.filter(service_id = service_id).select_subclasses()}
+
+        voice_label_ids = set()
+        for element in elements.values():
+            for field in _relation_fields(element):
+                if field.related_model is VoiceLabel:
+                    voice_label_ids.add(getattr(element, field.attname))
+        voice_labels = VoiceLabel.objects.in_bulk(voice_label_ids)
+
+        choice_options = defaultdict(list)
+        for element in elements.values():
+            _link_relations(element, service, elements, voice_labels)
+            if isinstance(element, ChoiceOption):
+                choice_options[element.parent_id].append(element)
+
+        for element in elements.values():
+            if isinstance(element, Choice):
+                _set_prefetched_choice_options(element,
+                        sorted(choice_options[element.id], key = lambda option: option.id))
+
+        return cls(service, version, elements)
+
+    @classmethod
+    def for_validation(cls, service_id):
+        """
+        Compiles a private (not cached) snapshot of the call flow of a service, with
+        the Voice Fragments of its voice labels in the supported languages prefetched,
+        and their audio files checked concurrently, so it can be validated without
+        a query or storage request per element.
+        """
+        flow = cls.compile(service_id, None)
+        prefetch_related_objects([flow.service], 'supported_languages')
+        voice_labels = {element.voice_label.id: element.voice_label
+                for element in flow.elements.values() if element.voice_label_id}
+        prefetch_related_objects(list(voice_labels.values()), Prefetch('voicefragment_set',
+                queryset = VoiceFragment.objects.filter(language__in = flow.service.supported_languages.all())
+                    .select_related('language').order_by('id')))
+        audio_file_cache.check_all(fragment.audio for voice_label in voice_labels.values()
+                for fragment in voice_label.voicefragment_set.all())
+        return flow
+
+
+def _relation_fields(instance):
+    """
+    Returns the (non parent link) foreign keys of a model instance that are set.
+    """
+    for field in instance._meta.concrete_fields:
+        if field.many_to_one and not field.remote_field.parent_link \
+                and getattr(instance, field.attname) is not None:
+            yield field
+
+
+def _link_relations(instance, service, elements, voice_labels):
+    """
+    Points the foreign keys of instance to the objects in the snapshot,
+    so following them does not query the database.
+    """
+    for field in _relation_fields(instance):
+        related_id = getattr(instance, field.attname)
+        if field.related_model is VoiceService:
+            related = service if related_id == service.id else None
+        elif field.related_model is VoiceLabel:
+            related = voice_labels.get(related_id)
+        elif issubclass(field.related_model, VoiceServiceSubElement):
+            related = elements.get(related_id)
+        else:
+            continue
+        if isinstance(related, field.related_model):
+            setattr(instance, field.name, related)
+
+
+def _set_prefetched_choice_options(choice, choice_options):
+    """
+    Makes choice.choice_options.all() return choice_options, in the same way
+    prefetch_related() fills its cache.
+    """
+    queryset = choice.choice_options.all()
+    queryset._result_cache = choice_options
+    queryset._prefetch_done = True
+    choice._prefetched_objects_cache = {'choice_options': queryset}
+
+
+def get_element_or_404(model, element_id, session):
+    """
+    Returns the element of the given model with element_id, taken from the
+    compiled call flow of the voice service of the session when possible.
+    Falls back to the database otherwise, raising Http404 if it does not exist.
+    """
+    if session.service_id:
+        flow = CompiledCallFlow.for_service(session.service_id)
+        element = flow.get_element(element_id) if flow else None
+        if isinstance(element, model):
+            return element
+    return get_object_or_404(model, pk = element_id)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_call_flow_on_change(sender, instance, **kwargs):
+    if isinstance(instance, VoiceService):
+        CompiledCallFlow.invalidate(instance.id)
+    elif isinstance(instance, VoiceServiceSubElement):
+        CompiledCallFlow.invalidate(instance.service_id)
+
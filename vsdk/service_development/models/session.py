@@ -1,4 +1,8 @@
+import threading
+
+from django.conf import settings
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
@@ -7,7 +11,9 @@ from django.utils.translation import ugettext_lazy as _
 
 from . import KasaDakaUser
 from . import VoiceService, VoiceServiceElement
+from .vs_element import resolve_subclass
 from . import Language
+from ..batching import BulkCreateBuffer
 
 class CallSession(models.Model):
     start = models.DateTimeField(_('Starting time'),auto_now_add = True)
@@ -38,25 +44,45 @@ class CallSession(models.Model):
         for the session. 
         Returns a determined to be valid Language for the Session.
         Returns None if the language cannot be determined.
+        The language is only determined again when the service, user or language
+        of the session change, and is only saved when it changes.
         """
-        if self.service:
-            if self.service.supports_single_language:
-                self._language = self.service.supported_languages.all()[0]
-            elif self.user and self.user.language in self.service.supported_languages.all(): 
-                    self._language = self.user.language
-            elif self._language and not self._language in self.service.supported_languages.all():
-                    self._language = None
-        else:
-            self._language = None
-        
-        self.save()
+        if getattr(self, '_resolved_language_for', None) != self._language_resolution_key():
+            language = self._resolve_language()
+            changed = (language.id if language else None) != self._language_id
+            self._language = language
+            if changed and self.pk:
+                CallSession.objects.filter(pk = self.pk).update(_language = language)
+            self._resolved_language_for = self._language_resolution_key()
         return self._language
+
+    def _language_resolution_key(self):
+        return (self.service_id, self.user_id, self._language_id)
+
+    def _resolve_language(self):
+        if not self.service:
+            return None
+        supported_languages = {language.id: language for language in self.service.supported_languages.all()}
+        if len(supported_languages) == 1:
+            return list(supported_languages.values())[0]
+        elif self.user and self.user.language_id in supported_languages:
+            return supported_languages[self.user.language_id]
+        return supported_languages.get(self._language_id)
     
     def record_step(self, element = None, description = None):
-        step = CallSessionStep(session = self, _visited_element = element, description = description)
-        self.end = timezone.now() 
-        self.save()
-        step.save()
+        """
+        Records a step in this session, and updates the ending time of the session.
+        When settings.CALL_SESSION_STEP_BUFFERING is enabled, the step is buffered
+        and saved in a batch together with the steps of other sessions.
+        """
+        step = CallSessionStep(session = self, _visited_element = element, description = description,
+                time = timezone.now())
+        self.end = step.time
+        if settings.CALL_SESSION_STEP_BUFFERING:
+            get_call_session_step_buffer().add(step)
+        else:
+            self.save()
+            step.save()
         return
 
     def link_to_user(self, user):
@@ -65,7 +91,7 @@ class CallSession(models.Model):
         return self
 
 class CallSessionStep(models.Model):
-    time = models.DateTimeField(_('Time'),auto_now_add = True)
+    time = models.DateTimeField(_('Time'),default = timezone.now, editable = False)
     session = models.ForeignKey(CallSession, on_delete = models.CASCADE, related_name = "steps")
     _visited_element = models.ForeignKey(VoiceServiceElement, on_delete = models.SET_NULL, null = True)
     description = models.CharField(_('Description'),max_length = 1000,blank = True, null = True)
@@ -91,9 +117,41 @@ class CallSessionStep(models.Model):
         instead of the VoiceServiceElement superclass object (which does
         not have specific fields and methods).
         """
-        if self._visited_element:
-            return VoiceServiceElement.objects.get_subclass(id = self._visited_element.id)
-        else: return None
+        return resolve_subclass(self._visited_element)
+
+
+class CallSessionStepBuffer(BulkCreateBuffer):
+    """
+    Saves buffered CallSessionSteps in batches, and updates the ending time
+    of each session in the batch with a single UPDATE.
+    """
+    def __init__(self, max_size = 100, max_age = 5.0):
+        super(CallSessionStepBuffer, self).__init__(CallSessionStep, max_size, max_age)
+
+    def after_bulk_create(self, steps):
+        ends = {}
+        for step in steps:
+            if step.session_id not in ends or ends[step.session_id] < step.time:
+                ends[step.session_id] = step.time
+        for session_id, end in ends.items():
+            CallSession.objects.filter(Q(end__isnull = True) | Q(end__lt = end),
+                    pk = session_id).update(end = end)
+
+
+_call_session_step_buffer = None
+_call_session_step_buffer_lock = threading.Lock()
+
+def get_call_session_step_buffer():
+    """
+    Returns the CallSessionStepBuffer of this process.
+    """
+    global _call_session_step_buffer
+    with _call_session_step_buffer_lock:
+        if _call_session_step_buffer is None:
+            _call_session_step_buffer = CallSessionStepBuffer(
+                    settings.CALL_SESSION_STEP_BUFFER_SIZE,
+                    settings.CALL_SESSION_STEP_BUFFER_MAX_AGE)
+        return _call_session_step_buffer
 
 
 def lookup_or_create_session(voice_service, session_id=None, caller_id = None):
@@ -5,6 +5,8 @@ from django.utils.translation import ugettext
 
 from django.utils import timezone
 from . import CallSession, VoiceService
+from ..content_store import ContentAddressedFileField
+from ..recordings import recording_processing_queue
 
 
 class UserInputCategory(models.Model):
@@ -20,16 +22,46 @@ class UserInputCategory(models.Model):
 
 class SpokenUserInput(models.Model):
     #value = models.CharField(max_length = 100, blank = True, null = True)
-    audio = models.FileField(_('Audio file'),upload_to='uploads/', blank=False, null= False)
+    audio = ContentAddressedFileField(_('Audio file'),upload_to='uploads/', layout_setting='RECORDING_UPLOAD_LAYOUT', blank=False, null= False)
     time = models.DateTimeField(_('Time'),auto_now_add = True)
     session = models.ForeignKey(CallSession, on_delete=models.CASCADE, related_name="session")
     category = models.ForeignKey(UserInputCategory, on_delete=models.CASCADE, related_name="category", verbose_name = _('Category'))
     description = models.CharField(max_length = 1000, blank = True, null = True, verbose_name = _('Description'))
+    duration = models.FloatField(_('Duration (seconds)'), blank = True, null = True, editable = False)
+    processing_status_choices = [('', _('Not processed')),
+                                 ('pending', _('Waiting for processing')),
+                                 ('correct', _('In the correct format')),
+                                 ('converted', _('Converted')),
+                                 ('failed', _('Processing failed'))]
+    processing_status = models.CharField(_('Processing status'), max_length = 10, blank = True, default = '',
+            choices = processing_status_choices, editable = False)
+    processing_error = models.TextField(_('Processing error'), blank = True, editable = False)
 
 
     class Meta:
         verbose_name = _('Spoken User Input')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(SpokenUserInput, cls).from_db(db, field_names, values)
+        instance._saved_audio_name = instance.__dict__.get('audio')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        New recordings are checked (and converted) in the background, when they are stored locally.
+        """
+        process = bool(self.audio) and self.audio.name != getattr(self, '_saved_audio_name', None) and \
+                recording_processing_queue.can_process()
+        if process:
+            self.processing_status = 'pending'
+            self.processing_error = ''
+            self.duration = None
+        super(SpokenUserInput, self).save(*args, **kwargs)
+        self._saved_audio_name = self.audio.name
+        if process:
+            recording_processing_queue.add(self)
+
     def __str__(self):
         from django.template import defaultfilters
         date = defaultfilters.date(self.time, "SHORT_DATE_FORMAT")
@@ -0,0 +1,29 @@
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+
+class StoredValidationStatus(models.Model):
+    """
+    The stored result of the validator() of a model, so lists of objects can show
+    whether they are valid without validating them. It is kept up to date by the
+    validation queue (see validation_queue.py).
+    """
+    validation_status = models.NullBooleanField(_('Is valid'), editable = False,
+            help_text = _("Empty if this has not been validated yet"))
+    validation_errors = models.TextField(_('Validation errors'), blank = True, editable = False)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def stored_validation_errors(self):
+        return self.validation_errors.splitlines()
+
+    @classmethod
+    def store_validation_result(cls, pk, errors):
+        """
+        Stores the validation errors of the object with pk, without saving the
+        other fields (or sending signals).
+        """
+        cls._default_manager.filter(pk = pk).update(validation_status = not errors,
+                validation_errors = '\n'.join(errors))
@@ -0,0 +1,195 @@
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from ..media import audio_file_cache
+from .voicelabel import VoiceLabel, VoiceFragment, Language
+from .voiceservice import VoiceService
+from .vs_element import VoiceServiceSubElement
+
+logger = logging.getLogger(__name__)
+
+
+class ValidationQueue(object):
+    """
+    Recomputes the stored validation status of Voice Services (together with all
+    their elements) and Voice Labels, when something they depend on changes.
+
+    Changes are collected per thread while a transaction is running. When it is
+    committed, they are handed to a background thread, which validates every
+    affected service and label once. Outside of a transaction, they are handed
+    over right away.
+
+    Every change registers its own commit callback, so changes made after a
+    rolled back transaction (or savepoint) are still validated. Changes of the
+    rolled back transaction itself stay queued, and are validated with the next
+    committed change of the thread, which is harmless.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._service_ids = set()
+        self._voice_label_ids = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _pending(self):
+        if not hasattr(self._local, 'service_ids'):
+            self._local.service_ids = set()
+            self._local.voice_label_ids = set()
+        return self._local
+
+    def _take_pending(self):
+        pending = self._pending()
+        service_ids, voice_label_ids = pending.service_ids, pending.voice_label_ids
+        pending.service_ids, pending.voice_label_ids = set(), set()
+        return service_ids, voice_label_ids
+
+    def add_service(self, service_id):
+        if service_id is not None:
+            self._pending().service_ids.add(service_id)
+            transaction.on_commit(self.submit)
+
+    def add_voice_label(self, voice_label_id):
+        """
+        Queues a Voice Label, and the Voice Services whose elements use it.
+        """
+        if voice_label_id is not None:
+            self._pending().voice_label_ids.add(voice_label_id)
+            transaction.on_commit(self.submit)
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # A single thread, so every service is validated by one thread at a time
+                self._executor = ThreadPoolExecutor(max_workers = 1)
+            return self._executor
+
+    def shutdown(self):
+        """
+        Waits until all submitted changes are validated, and stops the background thread.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait = True)
+
+    def submit(self):
+        """
+        Hands the queued services and labels of this thread to the background thread.
+        """
+        service_ids, voice_label_ids = self._take_pending()
+        if not service_ids and not voice_label_ids:
+            return
+        with self._lock:
+            self._service_ids.update(service_ids)
+            self._voice_label_ids.update(voice_label_ids)
+        self.executor().submit(self._process_submitted)
+
+    def _process_submitted(self):
+        with self._lock:
+            service_ids, voice_label_ids = self._service_ids, self._voice_label_ids
+            self._service_ids, self._voice_label_ids = set(), set()
+        try:
+            self.validate(service_ids, voice_label_ids)
+        finally:
+            # The background thread has its own database connection
+            connection.close()
+
+    def process(self):
+        """
+        Validates the queued services and labels of this thread right away, and stores the results.
+        """
+        self.validate(*self._take_pending())
+
+    def validate(self, service_ids, voice_label_ids):
+        if not service_ids and not voice_label_ids:
+            return
+        try:
+            service_ids = set(service_ids)
+            service_ids.update(VoiceServiceSubElement.objects.filter(
+                    voice_label_id__in = voice_label_ids).values_list('service_id', flat = True))
+            self.validate_voice_labels(voice_label_ids)
+            for service in VoiceService.objects.filter(pk__in = service_ids):
+                self.validate_service(service)
+        except Exception:
+            # The change itself has been committed, the status is recomputed on the next change
+            logger.exception('Could not recompute the validation status of services %s and voice labels %s',
+                    sorted(service_ids), sorted(voice_label_ids))
+
+    def validate_voice_labels(self, voice_label_ids):
+        """
+        Validates Voice Labels like VoiceLabel.validator() does, with their
+        fragments and languages loaded in bulk.
+        """
+        voice_labels = list(VoiceLabel.objects.filter(pk__in = voice_label_ids).prefetch_related(
+                Prefetch('voicefragment_set', queryset = VoiceFragment.objects.select_related('language').order_by('id'))))
+        languages = Language.objects.in_bulk()
+        service_language_ids = defaultdict(set)
+        for voice_label_id, language_id in VoiceServiceSubElement.objects.filter(
+                voice_label_id__in = voice_label_ids, service__supported_languages__isnull = False).values_list(
+                'voice_label_id', 'service__supported_languages'):
+            service_language_ids[voice_label_id].add(language_id)
+        audio_file_cache.check_all(fragment.audio for voice_label in voice_labels
+                for fragment in voice_label.voicefragment_set.all())
+
+        for voice_label in voice_labels:
+            language_ids = service_language_ids[voice_label.id] or \
+                    {fragment.language_id for fragment in voice_label.voicefragment_set.all()}
+            errors = voice_label.validator(languages = [languages[language_id] for language_id in sorted(language_ids)])
+            VoiceLabel.store_validation_result(voice_label.id, errors)
+
+    def validate_service(self, service):
+        element_errors = service.validate_elements()
+        # Elements with the same errors (mostly none) are stored at once
+        elements_by_errors = defaultdict(list)
+        for element, errors in element_errors.items():
+            elements_by_errors[tuple(errors)].append(element.id)
+        for errors, element_ids in elements_by_errors.items():
+            VoiceServiceSubElement.objects.filter(pk__in = element_ids).update(
+                    validation_status = not errors, validation_errors = '\n'.join(errors))
+        VoiceService.store_validation_result(service.id, service.validator(element_errors))
+
+
+validation_queue = ValidationQueue()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def queue_validation_on_change(sender, instance, raw = False, **kwargs):
+    if raw:
+        return
+    if isinstance(instance, VoiceService):
+        validation_queue.add_service(instance.id)
+    elif isinstance(instance, VoiceServiceSubElement):
+        validation_queue.add_service(instance.service_id)
+    elif isinstance(instance, VoiceLabel):
+        validation_queue.add_voice_label(instance.id)
+    elif isinstance(instance, VoiceFragment):
+        validation_queue.add_voice_label(instance.parent_id)
+
+
+@receiver(pre_delete, sender = VoiceLabel)
+def queue_validation_on_voice_label_delete(sender, instance, **kwargs):
+    # The voice label of the elements using it is cleared without signals
+    for service_id in VoiceServiceSubElement.objects.filter(
+            voice_label = instance).values_list('service_id', flat = True).distinct():
+        validation_queue.add_service(service_id)
+
+
+@receiver(m2m_changed, sender = VoiceService.supported_languages.through)
+def queue_validation_on_supported_languages_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        validation_queue.add_service(instance.id)
+    else:
+        service_ids = pk_set if pk_set is not None else VoiceService.objects.values_list('id', flat = True)
+        for service_id in service_ids:
+            validation_queue.add_service(service_id)
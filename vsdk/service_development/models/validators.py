@@ -15,35 +15,36 @@ def validate_audio_file_extension(value):
         raise ValidationError(_('Unsupported file extension. Only .wav files are supported.'))
 
 def validate_audio_file_format(value):
-    import os
-    import subprocess
-    import re
-    from django.core.exceptions import ValidationError
     #Required for Heroku, django-storages backend
     try:
         path_to_file = value.path
     except NotImplementedError:
         path_to_file = value.url
-    mediainfo_result = subprocess.getoutput("mediainfo "+ path_to_file)
-
+    return audio_file_format_is_correct(path_to_file)
+
+def read_audio_file_format(path_to_file):
+    """
+    Returns the WaveFormat of a file (path or URL), reading only its header.
+    Raises WaveFormatError or OSError if it can not be read.
+    """
+    from ..wave import read_wave_format, read_wave_format_from_url
+    if path_to_file.startswith(('http://', 'https://')):
+        return read_wave_format_from_url(path_to_file)
+    return read_wave_format(path_to_file)
+
+def audio_file_format_is_correct(path_to_file):
+    """
+    Returns True if the file (path or URL) is a Wave file with the format required by Asterisk:
+    Sample rate 8KHz, 16 bit, mono, Codec: PCM 16 LE (s16l)
+    """
+    import os
+    from ..wave import WaveFormatError
     ext = os.path.splitext(path_to_file)[1]  # [0] returns path+filename
     valid_extensions = ['.wav']
     if not ext.lower() in valid_extensions:
         return False
 
-    if not re.search(r"Channel\(s\)\s*:\s*1\s*channel", mediainfo_result):
-        return False
-
-    if not re.search(r"Sampling rate\s*: 8 000 Hz", mediainfo_result):
-        return False
-
-    if not re.search(r"Bit depth\s*: 16 bits", mediainfo_result):
-        return False
-
-    if not re.search(r"Audio\s*Format\s*: PCM", mediainfo_result):
-        return False
-
-    if not re.search(r".wav\s*Format\s*: Wave\s*", mediainfo_result):
+    try:
+        return read_audio_file_format(path_to_file).is_correct
+    except (WaveFormatError, OSError):
         return False
-
-    return True
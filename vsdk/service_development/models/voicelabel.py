@@ -1,4 +1,9 @@
+import threading
+import time
+
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import ugettext
@@ -6,11 +11,15 @@ from django.utils.safestring import mark_safe
 
 
 from .validators import validate_audio_file_extension, validate_audio_file_format
+from .validation import StoredValidationStatus
+from ..content_store import ContentAddressedFileField
+from ..media import audio_file_cache
+from ..transcoding import audio_conversion_queue
 
 from number_generator.program import *
 
 
-class VoiceLabel(models.Model):
+class VoiceLabel(StoredValidationStatus):
     name = models.CharField(_('Name'),max_length=50)
     description = models.CharField(_('Description'),max_length=1000, blank = True, null = True)
 
@@ -25,18 +34,39 @@ class VoiceLabel(models.Model):
     is_valid.boolean = True
     is_valid.short_description = _('Is valid')
 
-    def validator(self, language):
-        errors = []        
-        if len(self.voicefragment_set.filter(language = language)) > 0:
-            errors.extend(self.voicefragment_set.filter(language=language)[0].validator())
+    def validator(self, language = None, languages = None):
+        """
+        Validates the Voice Fragment in language, or (without a language) in all
+        languages, which default to validation_languages().
+        """
+        if language is None:
+            errors = []
+            for language in (languages if languages is not None else self.validation_languages()):
+                errors.extend(error for error in self.validator(language) if error not in errors)
+            return errors
+
+        errors = []
+        # Filtered in Python, so Voice Fragments prefetched for validation are used
+        fragments = [fragment for fragment in self.voicefragment_set.all() if fragment.language_id == language.id]
+        if fragments:
+            errors.extend(fragments[0].validator())
         else:
             errors.append(ugettext('"%(description_of_this_element)s" does not have a Voice Fragment for "%(language)s"') %{'description_of_this_element' : str(self),'language' : str(language)})
         return errors
 
     def get_voice_fragment_url(self, language):
-        result = self.voicefragment_set.filter(language=language)
-        if result: return result[0].get_url()
-        else: return ''
+        if not language: return ''
+        return voice_fragment_url_index.get_url(self.id, language.id)
+
+    def validation_languages(self):
+        """
+        Returns the languages of the voice services using this label, or the
+        languages of its Voice Fragments if there are none.
+        """
+        languages = Language.objects.filter(voiceservice__voiceservicesubelement__voice_label = self).distinct()
+        if not languages:
+            languages = Language.objects.filter(voicefragment__parent = self).distinct()
+        return languages
 
 class Language(models.Model):
     name = models.CharField(_('Name'),max_length=100, unique = True)
@@ -254,70 +284,64 @@ class Language(models.Model):
         Returns the URL of the Voice Fragment describing
         the language, in the language itself.
         """
-        return self.voice_label.get_voice_fragment_url(self)
+        return self.get_voice_label_url(self.voice_label_id)
+
+    def get_voice_label_url(self, voice_label_id):
+        """
+        Returns the URL of the Voice Fragment of the Voice Label with
+        voice_label_id in this language, without querying the database
+        (see VoiceFragmentUrlIndex).
+        """
+        return voice_fragment_url_index.get_url(voice_label_id, self.id)
 
     @property
     def get_interface_numbers_voice_label_url_list(self):
-        numbers = [
-                    self.zero,
-                    self.one,
-                    self.two,
-                    self.three,
-                    self.four,
-                    self.five,
-                    self.six,
-                    self.seven,
-                    self.eight,
-                    self.nine
-                    ]
-        result = []
-        for number in numbers:
-            result.append(number.get_voice_fragment_url(self))
-        return result
+        number_samples = self.number_samples
+        return [number_samples.get(number, '') for number in range(10)]
     
     @property
     def get_interface_numbers_voice_label_url_dict(self):
-        result = {}
-        if self.zero: result[0] = self.zero.get_voice_fragment_url(self)
-        if self.one: result[1] = self.one.get_voice_fragment_url(self)
-        if self.two: result[2] = self.two.get_voice_fragment_url(self)
-        if self.three: result[3] = self.three.get_voice_fragment_url(self)
-        if self.four: result[4] = self.four.get_voice_fragment_url(self)
-        if self.five: result[5] = self.five.get_voice_fragment_url(self)
-        if self.six: result[6] = self.six.get_voice_fragment_url(self)
-        if self.seven: result[7] = self.seven.get_voice_fragment_url(self)
-        if self.eight: result[8] = self.eight.get_voice_fragment_url(self)
-        if self.nine: result[9] = self.nine.get_voice_fragment_url(self)
-        if self.ten: result[10] = self.ten.get_voice_fragment_url(self)
-        if self.eleven: result[11] = self.eleven.get_voice_fragment_url(self)
-        if self.twelve: result[12] = self.twelve.get_voice_fragment_url(self)
-        if self.thirteen: result[13] = self.thirteen.get_voice_fragment_url(self)
-        if self.fourteen: result[14] = self.fourteen.get_voice_fragment_url(self)
-        if self.fifteen: result[15] = self.fifteen.get_voice_fragment_url(self)
-        if self.sixteen: result[16] = self.sixteen.get_voice_fragment_url(self)
-        if self.seventeen: result[17] = self.seventeen.get_voice_fragment_url(self)
-        if self.eighteen: result[18] = self.eighteen.get_voice_fragment_url(self)
-        if self.nineteen: result[19] = self.nineteen.get_voice_fragment_url(self)
-        if self.twenty: result[20] = self.twenty.get_voice_fragment_url(self)
-        if self.thirty: result[30] = self.thirty.get_voice_fragment_url(self)
-        if self.fourty: result[40] = self.fourty.get_voice_fragment_url(self)
-        if self.fifty: result[50] = self.fifty.get_voice_fragment_url(self)
-        if self.sixty: result[60] = self.sixty.get_voice_fragment_url(self)
-        if self.seventy: result[70] = self.seventy.get_voice_fragment_url(self)
-        if self.eighty: result[80] = self.eighty.get_voice_fragment_url(self)
-        if self.ninety: result[90] = self.ninety.get_voice_fragment_url(self)
-        if self.hundred: result[100] = self.hundred.get_voice_fragment_url(self)
-        if self.thousand: result[1000] = self.thousand.get_voice_fragment_url(self)
-        if self.andsep: result['and'] = self.andsep.get_voice_fragment_url(self)
-        if self.commasep: result['comma'] = self.commasep.get_voice_fragment_url(self)
-        if self.tens: result['10s'] = self.tens.get_voice_fragment_url(self)
-        if self.hundreds: result['100s'] = self.hundreds.get_voice_fragment_url(self)
-        if self.thousands: result['1000s'] = self.thousands.get_voice_fragment_url(self)
-        return result
+        return dict(self.number_samples)
+
+    # The keys of the number sample table (see number_generator.program),
+    # and the fields of the Voice Labels of those samples.
+    number_sample_fields = (
+            (0, 'zero'), (1, 'one'), (2, 'two'), (3, 'three'), (4, 'four'),
+            (5, 'five'), (6, 'six'), (7, 'seven'), (8, 'eight'), (9, 'nine'),
+            (10, 'ten'), (11, 'eleven'), (12, 'twelve'), (13, 'thirteen'), (14, 'fourteen'),
+            (15, 'fifteen'), (16, 'sixteen'), (17, 'seventeen'), (18, 'eighteen'), (19, 'nineteen'),
+            (20, 'twenty'), (30, 'thirty'), (40, 'fourty'), (50, 'fifty'), (60, 'sixty'),
+            (70, 'seventy'), (80, 'eighty'), (90, 'ninety'), (100, 'hundred'), (1000, 'thousand'),
+            ('and', 'andsep'), ('comma', 'commasep'),
+            ('10s', 'tens'), ('100s', 'hundreds'), ('1000s', 'thousands'),
+            )
+
+    _number_samples_cache = {}
+
+    @property
+    def number_samples(self):
+        """
+        Returns the table of number samples (digits, tens, hundreds, separators and
+        multitudes) of this language, mapping to the URLs of their Voice Fragments.
+        The table is cached, and only rebuilt when one of the number Voice Labels
+        of this language, or a Voice Fragment in this language changes.
+        The returned dict is shared, and should not be modified.
+        """
+        voice_label_urls = voice_fragment_url_index.get_urls(self.id)
+        voice_label_ids = tuple(getattr(self, field + '_id') for key, field in self.number_sample_fields)
+        cached = Language._number_samples_cache.get(self.id)
+        if cached and cached[0] is voice_label_urls and cached[1] == voice_label_ids:
+            return cached[2]
+        number_samples = {}
+        for (key, field), voice_label_id in zip(self.number_sample_fields, voice_label_ids):
+            if voice_label_id:
+                number_samples[key] = voice_label_urls.get(voice_label_id, '')
+        Language._number_samples_cache[self.id] = (voice_label_urls, voice_label_ids, number_samples)
+        return number_samples
     
     def generate_number(self,d):
         code = '%s' % (self.code)
-        dict = self.get_interface_numbers_voice_label_url_dict
+        dict = self.number_samples
         if (code == 'en'):
             return generate_num_english(d, dict);
         if (code == 'fr'):
@@ -333,14 +357,14 @@ class Language(models.Model):
         Fragments of the hardcoded interface audio fragments.
         """
         interface_voice_labels = {
-                'voice_label':self.voice_label,
-                'error_message':self.error_message,
-                'select_language':self.select_language,
-                'pre_choice_option':self.pre_choice_option,
-                'post_choice_option':self.post_choice_option,
+                'voice_label':self.voice_label_id,
+                'error_message':self.error_message_id,
+                'select_language':self.select_language_id,
+                'pre_choice_option':self.pre_choice_option_id,
+                'post_choice_option':self.post_choice_option_id,
                 }
         for k, v in interface_voice_labels.items():
-            interface_voice_labels[k] = v.get_voice_fragment_url(self)
+            interface_voice_labels[k] = self.get_voice_label_url(v)
         return interface_voice_labels
 
 
@@ -351,38 +375,41 @@ class VoiceFragment(models.Model):
     language = models.ForeignKey(
             'Language',
             on_delete = models.CASCADE)
-    audio = models.FileField(_('Audio'),
+    audio = ContentAddressedFileField(_('Audio'), upload_to = 'fragments/', layout_setting = 'FRAGMENT_UPLOAD_LAYOUT',
             validators=[validate_audio_file_extension],
             help_text = _("Ensure your file is in the correct format! Wave (.wav) : Sample rate 8KHz, 16 bit, mono, Codec: PCM 16 LE (s16l)"))
-
+    conversion_status_choices = [('', _('Not converted automatically')),
+                                 ('pending', _('Waiting for conversion')),
+                                 ('correct', _('Already in the correct format')),
+                                 ('converted', _('Converted')),
+                                 ('failed', _('Conversion failed'))]
+    conversion_status = models.CharField(_('Conversion status'), max_length = 10, blank = True, default = '',
+            choices = conversion_status_choices, editable = False)
+    conversion_error = models.TextField(_('Conversion error'), blank = True, editable = False)
 
     class Meta:
         verbose_name = _('Voice Fragment')
 
-    def convert_wav_to_correct_format(self):
-        from vsdk import settings
-        if not settings.KASADAKA:
-            pass
-
-        import subprocess
-        from os.path import basename
-        new_file_name = self.audio.path[:-4] + "_conv.wav"
-        subprocess.getoutput("sox -S %s -r 8k -b 16 -c 1 -e signed-integer %s"% (self.audio.path, new_file_name))
-        self.audio = basename(new_file_name)
-        
-        
-
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(VoiceFragment, cls).from_db(db, field_names, values)
+        instance._saved_audio_name = instance.__dict__.get('audio')
+        instance._saved_language_id = instance.__dict__.get('language_id')
+        return instance
 
     def save(self, *args, **kwargs):
+        """
+        New audio files are converted to the correct format in the background (on a KasaDaka system).
+        """
+        convert = settings.KASADAKA and bool(self.audio) and \
+                self.audio.name != getattr(self, '_saved_audio_name', None)
+        if convert:
+            self.conversion_status = 'pending'
+            self.conversion_error = ''
         super(VoiceFragment, self).save(*args, **kwargs)
-        from vsdk import settings
-        if  settings.KASADAKA:
-            format_correct = validate_audio_file_format(self.audio)
-            if not format_correct: 
-                self.convert_wav_to_correct_format()
-        super(VoiceFragment, self).save(*args, **kwargs)
-
-
+        self._saved_audio_name = self.audio.name
+        if convert:
+            audio_conversion_queue.add(self)
 
 
     def __str__(self):
@@ -393,24 +420,14 @@ class VoiceFragment(models.Model):
 
     def validator(self):
         errors = []
-        try:
-            accessible = self.audio.storage.exists(self.audio.name)
-        except NotImplementedError:
-            import urllib.request
-            try:
-                response = urllib.request.urlopen(self.audio.url)
-                accessible = True
-            except urllib.error.HTTPError:
-                accessible = False
-
-
         if not self.audio:
             errors.append(ugettext('%s does not have an audio file')%str(self))
-        elif not accessible:
-            errors.append(ugettext('%s audio file not accessible')%str(self))
-        #TODO verift whether this really is not needed anymore
-        #elif not validate_audio_file_format(self.audio):
-        #    errors.append(ugettext('%s audio file is not in the correct format! Should be: Wave: Sample rate 8KHz, 16 bit, mono, Codec: PCM 16 LE (s16l)'%str(self)))
+        else:
+            status = audio_file_cache.get_status(self.audio)
+            if not status.accessible:
+                errors.append(ugettext('%s audio file not accessible')%str(self))
+            elif status.wave_format is None or not status.wave_format.is_correct:
+                errors.append(ugettext('%s audio file is not in the correct format! Should be: Wave: Sample rate 8KHz, 16 bit, mono, Codec: PCM 16 LE (s16l)')%str(self))
         return errors
 
     def is_valid(self):
@@ -428,3 +445,80 @@ class VoiceFragment(models.Model):
     audio_file_player.short_description = _('Audio file player')
 
 
+class VoiceFragmentUrlIndex(object):
+    """
+    Process-wide index of the URLs of all Voice Fragments, by the ids of their
+    Voice Label and Language. The fragments of a language are loaded in bulk
+    the first time a URL in that language is requested.
+
+    The index of a language is dropped when one of its Voice Fragments is
+    saved or deleted in this process, and expires after
+    settings.VOICE_FRAGMENT_URL_INDEX_TIMEOUT seconds, so changes made by
+    other processes are picked up as well. A load that an invalidation
+    happened during is not kept, as it may miss the change.
+    """
+
+    def __init__(self):
+        self._urls = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_url(self, voice_label_id, language_id):
+        """
+        Returns the URL of the Voice Fragment of a Voice Label in a language,
+        or an empty string if there is none.
+        """
+        if voice_label_id is None or language_id is None:
+            return ''
+        return self.get_urls(language_id).get(voice_label_id, '')
+
+    def get_urls(self, language_id):
+        """
+        Returns a dict of Voice Label ids to Voice Fragment URLs in a language.
+        """
+        loaded_at, urls = self._urls.get(language_id, (None, None))
+        if urls is None or time.monotonic() - loaded_at > settings.VOICE_FRAGMENT_URL_INDEX_TIMEOUT:
+            generation = self._generation
+            loaded_at, urls = time.monotonic(), self._load(language_id)
+            with self._lock:
+                if generation == self._generation:
+                    self._urls[language_id] = (loaded_at, urls)
+        return urls
+
+    def invalidate(self, language_id = None):
+        with self._lock:
+            self._generation += 1
+            if language_id is None:
+                self._urls.clear()
+            else:
+                self._urls.pop(language_id, None)
+
+    def _load(self, language_id):
+        storage = VoiceFragment._meta.get_field('audio').storage
+        urls = {}
+        # Like VoiceLabel.voicefragment_set.filter(language=...)[0], the oldest fragment wins
+        for voice_label_id, audio in VoiceFragment.objects.filter(
+                language_id = language_id).order_by('-id').values_list('parent_id', 'audio'):
+            urls[voice_label_id] = storage.url(audio) if audio else ''
+        return urls
+
+
+voice_fragment_url_index = VoiceFragmentUrlIndex()
+
+
+@receiver(post_save, sender = VoiceFragment)
+@receiver(post_delete, sender = VoiceFragment)
+def invalidate_voice_fragment_url_index(sender, instance, **kwargs):
+    voice_fragment_url_index.invalidate(instance.language_id)
+    # A fragment moved to another language is no longer in the index of the old one
+    saved_language_id = getattr(instance, '_saved_language_id', None)
+    if saved_language_id is not None and saved_language_id != instance.language_id:
+        voice_fragment_url_index.invalidate(saved_language_id)
+    instance._saved_language_id = instance.language_id
+
+
+@receiver(post_save, sender = VoiceFragment)
+@receiver(post_delete, sender = VoiceFragment)
+def invalidate_audio_file_status(sender, instance, **kwargs):
+    if instance.audio:
+        audio_file_cache.invalidate(instance.audio.name)
@@ -11,8 +11,9 @@ from django.utils.translation import ugettext
 
 from .voicelabel import VoiceLabel, Language, VoiceFragment
 from .vs_element import VoiceServiceElement
+from .validation import StoredValidationStatus
 
-class VoiceService(models.Model):
+class VoiceService(StoredValidationStatus):
     _urls_name = 'service-development:voice-service'
 
     name = models.CharField(_('Name'),max_length=100)
@@ -53,8 +54,14 @@ class VoiceService(models.Model):
         Returns the actual subclassed object that is redirected to,
         instead of the VoiceServiceElement superclass object (which does
         not have specific fields and methods).
+        The element is taken from the compiled call flow of this service.
         """
-        return VoiceServiceElement.objects.get_subclass(id = self._start_element.id)
+        from .call_flow import CompiledCallFlow
+        flow = CompiledCallFlow.for_service(self.id)
+        start_element = flow.get_element(self._start_element_id) if flow else None
+        if start_element is None:
+            return VoiceServiceElement.objects.get_subclass(id = self._start_element_id)
+        return start_element
     _get_start_element.short_description = _('Starting element')
     start_element = property(_get_start_element)
 
@@ -92,14 +99,19 @@ class VoiceService(models.Model):
     is_valid.boolean = True
     is_valid.short_description = _('Is valid')
 
-    def validator(self):
+    def validator(self, element_errors = None):
+        """
+        element_errors are the errors of the elements of this service, as returned by
+        validate_elements(), if they are already known.
+        """
         errors = []
-        if not self._start_element:
+        if not self._start_element_id:
             errors.append(ugettext('No starting element'))
         else:
-            associated_elements = self.voiceservicesubelement_set.all()
-            for sub_element in associated_elements:
-                errors.extend(sub_element.get_subclass_object().validator())
+            if element_errors is None:
+                element_errors = self.validate_elements()
+            for sub_element_errors in element_errors.values():
+                errors.extend(sub_element_errors)
         if len(self.supported_languages.all()) == 0:
             errors.append(ugettext('No supported languages'))
 
@@ -107,3 +119,12 @@ class VoiceService(models.Model):
         errors = list(set(errors))
         return errors
 
+    def validate_elements(self):
+        """
+        Returns the validation errors of all elements of this service, by element.
+        All elements, voice labels and fragments are loaded in bulk, and the audio files checked concurrently.
+        """
+        from .call_flow import CompiledCallFlow
+        flow = CompiledCallFlow.for_validation(self.id)
+        return {element: element.validator() for element in flow.elements.values()}
+
@@ -4,9 +4,10 @@ from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import ugettext
 
-from .voicelabel import VoiceLabel
+from .voicelabel import VoiceLabel, voice_fragment_url_index
+from .validation import StoredValidationStatus
 
-class VoiceServiceSubElement(models.Model):
+class VoiceServiceSubElement(StoredValidationStatus):
     """
     A sub-element in a voice service (could be ChoiceOption, etc).
     Is NOT accessible through HTTP in a VoiceXML
@@ -62,12 +63,14 @@ class VoiceServiceSubElement(models.Model):
         """
         Returns the url of the audio file of this element, in the given language.
         """
-        return self.voice_label.get_voice_fragment_url(language)
+        if not language: return ''
+        return voice_fragment_url_index.get_url(self.voice_label_id, language.id)
 
     def get_subclass_object(self):
         return VoiceServiceSubElement.objects.get_subclass(id = self.id)
 
 
+
 class VoiceServiceElement(VoiceServiceSubElement):
     """
     An element in a voice service (could be Choice, Message, etc.)
@@ -87,3 +90,17 @@ class VoiceServiceElement(VoiceServiceSubElement):
         Returns the url at which this element is accessible through VoiceXML.
         """
         return reverse(self._urls_name, kwargs= {'element_id':str(self.id), 'session_id':session.id})
+
+
+def resolve_subclass(element):
+    """
+    Returns the actual subclassed object of element, instead of the
+    VoiceServiceSubElement or VoiceServiceElement superclass object.
+    Elements that already are of their subclass (e.g. elements taken from
+    a compiled call flow) are returned as-is, without querying the database.
+    """
+    if element is None:
+        return None
+    if type(element) in (VoiceServiceSubElement, VoiceServiceElement):
+        return VoiceServiceSubElement.objects.get_subclass(id = element.id)
+    return element
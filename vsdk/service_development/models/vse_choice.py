@@ -2,7 +2,7 @@ from django.db import models
 from django.utils.translation import ugettext
 from django.utils.translation import ugettext_lazy as _
 
-from .vs_element import VoiceServiceElement, VoiceServiceSubElement
+from .vs_element import VoiceServiceElement, VoiceServiceSubElement, resolve_subclass
 
 class Choice(VoiceServiceElement):
     _urls_name = 'service-development:choice'
@@ -54,7 +54,7 @@ class ChoiceOption(VoiceServiceSubElement):
         instead of the VoiceServiceElement superclass object (which does
         not have specific fields and methods).
         """
-        return VoiceServiceSubElement.objects.get_subclass(id = self._redirect.id)
+        return resolve_subclass(self._redirect)
 
     def __str__(self):
         return "(%s): %s" % (self.parent.name,self.name)
@@ -2,7 +2,7 @@ from django.db import models
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import ugettext
 
-from .vs_element import VoiceServiceElement
+from .vs_element import VoiceServiceElement, resolve_subclass
 
 class MessagePresentation(VoiceServiceElement):
     """
@@ -29,10 +29,7 @@ class MessagePresentation(VoiceServiceElement):
         instead of the VoiceServiceElement superclass object (which does
         not have specific fields and methods).
         """
-        if self._redirect :
-            return VoiceServiceElement.objects.get_subclass(id = self._redirect.id)
-        else: 
-            return None
+        return resolve_subclass(self._redirect)
 
     def __str__(self):
         return _("Message: ") + self.name
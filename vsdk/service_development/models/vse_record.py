@@ -3,7 +3,7 @@ from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import ugettext
 
 from vsdk.service_development.models import VoiceLabel
-from .vs_element import VoiceServiceElement
+from .vs_element import VoiceServiceElement, resolve_subclass
 from .user_input import UserInputCategory
 
 class Record(VoiceServiceElement):
@@ -84,10 +84,7 @@ class Record(VoiceServiceElement):
         instead of the VoiceServiceElement superclass object (which does
         not have specific fields and methods).
         """
-        if self._redirect:
-            return VoiceServiceElement.objects.get_subclass(id=self._redirect.id)
-        else:
-            return None
+        return resolve_subclass(self._redirect)
 
     def __str__(self):
         return "Record: " + self.name
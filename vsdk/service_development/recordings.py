@@ -0,0 +1,129 @@
+"""
+Background post-processing of recordings (Spoken User Inputs).
+
+Saving a Spoken User Input with a new audio file marks it as pending, and queues
+it after the transaction is committed, so the next VoiceXML document is returned
+right away. In the process pool of the audio conversion queue, the format of the
+recording is checked, it is converted to the format required by Asterisk (on a
+KasaDaka system, where sox is available), and its duration is read. The result
+is recorded on the Spoken User Input when it is done.
+"""
+import logging
+import os
+import tempfile
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from .content_store import deferred_deletions
+from .transcoding import AudioConversionQueue, audio_conversion_queue, convert_audio_file
+from .wave import WaveFormatError, read_wave_duration
+
+logger = logging.getLogger(__name__)
+
+
+class RecordingProcessingError(Exception):
+    pass
+
+
+def process_recording(path, processed_path, convert):
+    """
+    Converts the recording at path to processed_path if convert is set and it does
+    not have the correct format yet, and returns whether it was converted, and its
+    duration. Runs in a worker process.
+    """
+    converted = convert and convert_audio_file(path, processed_path)
+    try:
+        wave_format, duration = read_wave_duration(processed_path if converted else path)
+    except WaveFormatError as e:
+        raise RecordingProcessingError('Not a Wave file: %s' % e)
+    if not wave_format.is_correct:
+        raise RecordingProcessingError('Not in the correct format: %s' % wave_format)
+    return converted, duration
+
+
+class RecordingProcessingQueue(AudioConversionQueue):
+    """
+    Queues recordings for processing, in the process pool of the audio conversion queue.
+    """
+
+    def executor(self):
+        return audio_conversion_queue.executor()
+
+    def shutdown(self):
+        audio_conversion_queue.shutdown()
+
+    def storage(self):
+        from .models import SpokenUserInput
+        return SpokenUserInput._meta.get_field('audio').storage
+
+    def local_path(self, name):
+        """
+        The path of the file name in the storage of recordings, or None if it has no local files.
+        """
+        try:
+            return self.storage().path(name)
+        except NotImplementedError:
+            return None
+
+    def can_process(self):
+        return self.local_path('') is not None
+
+    def add(self, recording):
+        """
+        Queues the processing of the audio file of recording, once the current transaction is committed.
+        """
+        transaction.on_commit(partial(self.submit, recording.id, recording.audio.name))
+
+    def submit(self, recording_id, name):
+        """
+        Starts the processing of the audio file name of a recording, and returns its
+        Future, or None if it can not be processed.
+        """
+        from .models import SpokenUserInput
+        path = self.local_path(name)
+        if path is None:
+            SpokenUserInput.objects.filter(pk = recording_id, audio = name).update(processing_status = '')
+            return None
+        processed_file, processed_path = tempfile.mkstemp(suffix = '.wav')
+        os.close(processed_file)
+        future = self.executor().submit(process_recording, path, processed_path, settings.KASADAKA)
+        future.add_done_callback(partial(self._finished, recording_id, name, processed_path, threading.get_ident()))
+        return future
+
+    def finish(self, recording_id, name, processed_path, future):
+        """
+        Records the result of processing on the recording, unless another audio
+        file was stored in the meantime. A converted recording is stored under the
+        hash of its contents, and the original is deleted after
+        MEDIA_DELETION_GRACE_PERIOD.
+        """
+        from .models import SpokenUserInput
+        try:
+            field = SpokenUserInput._meta.get_field('audio')
+            try:
+                converted, duration = future.result()
+                fields = {'processing_status': 'converted' if converted else 'correct', 'processing_error': '',
+                        'duration': duration}
+                if converted:
+                    with open(processed_path, 'rb') as processed_file:
+                        fields['audio'] = field.store_content(File(processed_file), '.wav')
+            except Exception as e:
+                logger.warning('Could not process %s: %s', name, e)
+                fields = {'processing_status': 'failed', 'processing_error': str(e)}
+
+            # Updated without saving, which would queue the recording again
+            if SpokenUserInput.objects.filter(pk = recording_id, audio = name).update(**fields):
+                if 'audio' in fields:
+                    # Other processes may still serve the original for a while
+                    deferred_deletions.add(field.storage, [name])
+            elif 'audio' in fields:
+                deferred_deletions.add(field.storage, [fields['audio']])
+        except Exception:
+            logger.exception('Could not record the processing of %s', name)
+
+
+recording_processing_queue = RecordingProcessingQueue()
@@ -0,0 +1,255 @@
+"""
+Soak test driver, which plays the role of the VoiceXML interpreter of Asterisk.
+
+Simulated callers run concurrently (with asyncio) against a running server: every
+call fetches the entry URL of a voice service, and follows the VoiceXML of every
+element (gotos, submits, fetching the audio), picks DTMF choices at random, posts
+synthetic recordings, and can fire a bip after the call. Throughput, latency
+percentiles and error rates are reported per view.
+
+Run it with the soak_test_calls management command.
+"""
+import asyncio
+import random
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlencode, urljoin, urlsplit
+from xml.etree import ElementTree as ET
+
+from django.conf import settings
+from django.urls import Resolver404, resolve, reverse
+
+from .benchmark import EMPTY_WAV, ViewStatistics, next_transition, vxml_elements
+
+
+class HTTPError(Exception):
+    pass
+
+
+async def http_request(url, method = 'GET', data = None, files = None, timeout = 30):
+    """
+    Does a single HTTP/1.0 request, and returns (status, headers, body).
+    Data is form encoded, or multipart encoded together with files ({name: (filename, content)}).
+    """
+    parts = urlsplit(url)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    headers = {'Host': parts.netloc, 'Connection': 'close'}
+    body = b''
+    if files:
+        boundary = uuid.uuid4().hex
+        headers['Content-Type'] = 'multipart/form-data; boundary=%s' % boundary
+        for name, value in (data or {}).items():
+            body += ('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (
+                    boundary, name, value)).encode()
+        for name, (filename, content) in files.items():
+            body += ('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                    'Content-Type: application/octet-stream\r\n\r\n' % (boundary, name, filename)).encode()
+            body += content + b'\r\n'
+        body += ('--%s--\r\n' % boundary).encode()
+    elif data:
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        body = urlencode(data).encode()
+    if body:
+        headers['Content-Length'] = str(len(body))
+
+    request = '%s %s HTTP/1.0\r\n%s\r\n\r\n' % (method, path or '/',
+            '\r\n'.join('%s: %s' % header for header in headers.items()))
+    reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, parts.port or 80), timeout)
+    try:
+        writer.write(request.encode() + body)
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+
+    head, _, content = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        status = int(lines[0].split()[1])
+    except (IndexError, ValueError):
+        raise HTTPError('Invalid response from %s' % url)
+    response_headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        response_headers[name.strip().lower()] = value.strip()
+    return status, response_headers, content
+
+
+class SoakStatistics(object):
+    """
+    The latencies and errors of all requests of a soak test, per view.
+    """
+
+    def __init__(self):
+        self.views = {}
+        self.errors = defaultdict(int)
+        self.calls = 0
+        self.failed_calls = 0
+        self.started = time.perf_counter()
+        self.ended = None
+
+    def add(self, view_name, latency, error = None):
+        if view_name not in self.views:
+            self.views[view_name] = ViewStatistics(view_name)
+        self.views[view_name].latencies.append(latency)
+        if error:
+            self.errors[view_name] += 1
+
+    def report(self):
+        duration = (self.ended or time.perf_counter()) - self.started
+        requests = sum(len(view.latencies) for view in self.views.values())
+        errors = sum(self.errors.values())
+        lines = [
+                'Duration: %.1f s' % duration,
+                'Calls: %d (%d failed), %.2f calls/s' % (self.calls, self.failed_calls, self.calls / duration),
+                'Requests: %d (%d errors, %.2f%%), %.1f requests/s' % (requests, errors,
+                    100.0 * errors / requests if requests else 0, requests / duration),
+                '',
+                '%-45s %8s %8s %9s %9s %9s' % ('view', 'requests', 'errors', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)'),
+                ]
+        for view_name in sorted(self.views):
+            latencies = self.views[view_name].latencies
+            lines.append('%-45s %8d %8d %9.1f %9.1f %9.1f' % (view_name, len(latencies),
+                    self.errors[view_name],
+                    ViewStatistics.percentile(latencies, 50) * 1000,
+                    ViewStatistics.percentile(latencies, 95) * 1000,
+                    ViewStatistics.percentile(latencies, 99) * 1000))
+        return '\n'.join(lines)
+
+
+class SimulatedCaller(object):
+    """
+    A caller that keeps calling a voice service, until the soak test ends.
+    """
+    max_steps = 40
+
+    def __init__(self, driver, number):
+        self.driver = driver
+        self.caller_id = 'soak%d' % number
+        self.random = random.Random(driver.seed + number)
+
+    def view_name(self, url):
+        path = urlsplit(url).path
+        if path.startswith(settings.MEDIA_URL) or path.startswith(settings.STATIC_URL):
+            return 'audio'
+        try:
+            return resolve(path).view_name
+        except Resolver404:
+            return path
+
+    async def request(self, url, method = 'GET', data = None, files = None):
+        statistics = self.driver.statistics
+        view_name = self.view_name(url)
+        started = time.perf_counter()
+        try:
+            status, headers, body = await http_request(url, method, data, files, self.driver.timeout)
+        except (OSError, asyncio.TimeoutError, HTTPError) as e:
+            statistics.add(view_name, time.perf_counter() - started, e)
+            raise
+        statistics.add(view_name, time.perf_counter() - started, status >= 400 and status)
+        if status >= 400:
+            raise HTTPError('%s %s returned %d' % (method, url, status))
+        return status, headers, body
+
+    async def fetch_audio(self, vxml, url, fetched):
+        for audio in vxml_elements(vxml)['audio']:
+            src = audio.get('src')
+            if src and src not in fetched:
+                fetched.add(src)
+                try:
+                    await self.request(urljoin(url, src))
+                except (OSError, asyncio.TimeoutError, HTTPError):
+                    # Like an interpreter, continue the call without the audio (the error is counted)
+                    pass
+
+    async def call(self):
+        """
+        Walks a single call, until it reaches a final element or max_steps.
+        """
+        driver = self.driver
+        url = urljoin(driver.base_url, reverse('service-development:voice-service',
+                args = [driver.service_id]) + '?' + urlencode({'callerid': self.caller_id}))
+        method, data, files = 'GET', None, None
+        fetched_audio = set()
+        for step in range(self.max_steps):
+            status, headers, body = await self.request(url, method, data, files)
+            if status in (301, 302, 303):
+                url, method, data, files = urljoin(url, headers['location']), 'GET', None, None
+                continue
+            try:
+                vxml = ET.fromstring(body)
+            except ET.ParseError:
+                raise HTTPError('Invalid VoiceXML from %s' % url)
+            if driver.fetch_audio:
+                await self.fetch_audio(vxml, url, fetched_audio)
+
+            transition = next_transition(vxml, self.random, lambda: ('recording.wav', EMPTY_WAV))
+            if transition is None:
+                break
+            method, next_url, data = transition
+            method, url = method.upper(), urljoin(url, next_url)
+            files = {'recording': data.pop('recording')} if data and 'recording' in data else None
+            if method == 'GET' and data:
+                url += ('&' if '?' in url else '?') + urlencode(data)
+                data = None
+
+        if self.random.random() < driver.bip_ratio:
+            try:
+                await self.request(urljoin(driver.base_url, reverse('polls:handle-bip',
+                        args = [driver.service_id]) + '?' + urlencode({'callerid': self.caller_id})))
+            except (OSError, asyncio.TimeoutError, HTTPError):
+                # A bip is refused when there is no active poll, the call itself succeeded
+                pass
+
+    async def run(self):
+        driver = self.driver
+        while not driver.finished():
+            driver.statistics.calls += 1
+            try:
+                await self.call()
+            except (OSError, asyncio.TimeoutError, HTTPError):
+                driver.statistics.failed_calls += 1
+
+
+class SoakTestDriver(object):
+    """
+    Runs a number of simulated callers concurrently, for a number of seconds or
+    until a number of calls is made.
+    """
+
+    def __init__(self, base_url, service_id, callers = 10, duration = None, calls = None,
+            fetch_audio = True, bip_ratio = 0.0, timeout = 30, seed = 0):
+        self.base_url = base_url
+        self.service_id = service_id
+        self.callers = callers
+        self.duration = duration
+        self.calls = calls
+        self.fetch_audio = fetch_audio
+        self.bip_ratio = bip_ratio
+        self.timeout = timeout
+        self.seed = seed
+        self.statistics = SoakStatistics()
+
+    def finished(self):
+        if self.calls is not None and self.statistics.calls >= self.calls:
+            return True
+        if self.duration is not None and time.perf_counter() - self.statistics.started >= self.duration:
+            return True
+        return False
+
+    async def run_callers(self):
+        await asyncio.gather(*(SimulatedCaller(self, number).run() for number in range(self.callers)))
+
+    def run(self):
+        """
+        Runs the soak test, and returns its statistics.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            self.statistics = SoakStatistics()
+            loop.run_until_complete(self.run_callers())
+        finally:
+            loop.close()
+        self.statistics.ended = time.perf_counter()
+        return self.statistics
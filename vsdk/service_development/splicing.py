@@ -0,0 +1,203 @@
+"""
+Splices sequences of audio files (like the words of a spoken number) into a
+single file, so the VoiceXML browser fetches one file per announcement.
+
+The sample data of the files is concatenated once, and stored under the hash
+of the sequence (the names of the files, and the size and modification time of
+those that are not content-addressed) as spliced/<xx>/<yy>/<hash>.wav. Sequences
+that can not be spliced (files on another server, or in different or unknown
+formats) are returned unchanged.
+
+Spliced files are written under a temporary name and renamed into place, since
+they are served as immutable. Every new sequence (like a new vote count) adds a
+file, so files that were not used for a while are deleted with the
+clean_spliced_audio management command.
+"""
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+import wave
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from .content_store import content_addressed_name, is_content_addressed
+
+logger = logging.getLogger(__name__)
+
+
+class AudioSplicer(object):
+    """
+    Process-wide cache of spliced files, by the names of the files in the sequence.
+    At most AUDIO_SPLICING_CACHE_SIZE sequences are remembered in memory, and the
+    spliced files are found in the storage again after that. Remembered files are
+    checked (and marked as used) again after AUDIO_SPLICING_CACHE_TIMEOUT seconds.
+    """
+    directory = 'spliced/'
+
+    def __init__(self):
+        self._spliced = {}
+        self._lock = threading.Lock()
+
+    def storage(self):
+        from .models import VoiceFragment
+        return VoiceFragment._meta.get_field('audio').storage
+
+    def splice_urls(self, urls):
+        """
+        Returns a list with the URL of the spliced file of the audio files at urls,
+        or urls itself if they can not be spliced. Empty URLs are left out.
+        """
+        if not settings.AUDIO_SPLICING:
+            return urls
+        urls = [url for url in urls if url]
+        if len(urls) < 2:
+            return urls
+        names = []
+        for url in urls:
+            if not url.startswith(settings.MEDIA_URL):
+                return urls
+            names.append(unquote(url[len(settings.MEDIA_URL):]))
+        name = self.splice(tuple(names))
+        return [self.storage().url(name)] if name else urls
+
+    def splice(self, names):
+        """
+        Returns the name of the spliced file of the files names, creating it if
+        needed, or None if they can not be spliced.
+        """
+        try:
+            key = self.sequence_hash(names)
+        except (OSError, NotImplementedError):
+            return None
+        name, checked_at = self._spliced.get(key, (None, None))
+        if name is None or time.monotonic() - checked_at > settings.AUDIO_SPLICING_CACHE_TIMEOUT:
+            name = content_addressed_name(key, '.wav', self.directory)
+            storage = self.storage()
+            if storage.exists(name):
+                touch(storage, name)
+            else:
+                try:
+                    content = self.concatenate(names)
+                except (wave.Error, EOFError, OSError, ValueError) as e:
+                    logger.warning('Could not splice %s: %s', ', '.join(names), e)
+                    return None
+                store(storage, name, content)
+            with self._lock:
+                if len(self._spliced) >= settings.AUDIO_SPLICING_CACHE_SIZE:
+                    self._spliced.clear()
+                self._spliced[key] = (name, time.monotonic())
+        return name
+
+    def sequence_hash(self, names):
+        """
+        The hash of the names of the files, and of the version of the files whose
+        contents may change.
+        """
+        storage = self.storage()
+        sha256 = hashlib.sha256()
+        for name in names:
+            sha256.update(name.encode('utf-8') + b'\0')
+            if not is_content_addressed(name):
+                stat = os.stat(storage.path(name))
+                sha256.update(b'%d-%d\0' % (stat.st_mtime_ns, stat.st_size))
+        return sha256.hexdigest()
+
+    def concatenate(self, names):
+        """
+        Returns a Wave file with the sample data of the files names, which should
+        all have the same format. Raises ValueError if they do not.
+        """
+        storage = self.storage()
+        params, frames = None, []
+        for name in names:
+            with storage.open(name) as audio_file, wave.open(audio_file) as wave_file:
+                file_params = (wave_file.getnchannels(), wave_file.getsampwidth(), wave_file.getframerate())
+                if params is None:
+                    params = file_params
+                elif file_params != params:
+                    raise ValueError('%s has a different format' % name)
+                frames.append(wave_file.readframes(wave_file.getnframes()))
+
+        output = io.BytesIO()
+        with wave.open(output, 'wb') as spliced:
+            spliced.setnchannels(params[0])
+            spliced.setsampwidth(params[1])
+            spliced.setframerate(params[2])
+            spliced.writeframes(b''.join(frames))
+        return output.getvalue()
+
+    def invalidate(self):
+        with self._lock:
+            self._spliced.clear()
+
+
+def store(storage, name, content):
+    """
+    Saves the bytes content as the file name, which appears in the storage once it is
+    complete: local files are written under a temporary name, and renamed into place.
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        saved_name = storage.save(name, ContentFile(content))
+        if saved_name != name:
+            # Spliced by another process in the meantime
+            storage.delete(saved_name)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    temporary_file, temporary_path = tempfile.mkstemp(dir = os.path.dirname(path), prefix = '.', suffix = '.tmp')
+    try:
+        with os.fdopen(temporary_file, 'wb') as spliced:
+            spliced.write(content)
+        os.chmod(temporary_path, storage.file_permissions_mode or 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def touch(storage, name):
+    """
+    Marks a local spliced file as used, so clean_spliced_audio keeps it.
+    """
+    try:
+        os.utime(storage.path(name))
+    except (NotImplementedError, OSError):
+        pass
+
+
+def delete_unused_spliced_files(unused_for):
+    """
+    Deletes the spliced files that were not used for unused_for (a timedelta), and
+    returns their names.
+    """
+    storage = audio_splicer.storage()
+    unused_since = timezone.now() - unused_for
+    deleted = []
+
+    def walk(directory):
+        try:
+            directories, files = storage.listdir(directory)
+        except FileNotFoundError:
+            return
+        for subdirectory in directories:
+            walk(directory + subdirectory + '/')
+        for file_name in files:
+            name = directory + file_name
+            if is_content_addressed(name) and storage.get_modified_time(name) < unused_since:
+                storage.delete(name)
+                deleted.append(name)
+
+    walk(AudioSplicer.directory)
+    audio_splicer.invalidate()
+    return deleted
+
+
+audio_splicer = AudioSplicer()
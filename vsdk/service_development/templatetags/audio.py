@@ -0,0 +1,14 @@
+from django import template
+
+from ..splicing import audio_splicer
+
+register = template.Library()
+
+
+@register.filter
+def spliced(audio_urls):
+    """
+    The URL of the spliced file of the audio files at audio_urls, as a list, so
+    that {% for url in audio_urls|spliced %} plays them with a single fetch.
+    """
+    return audio_splicer.splice_urls(audio_urls)
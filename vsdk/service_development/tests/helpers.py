@@ -7,7 +7,7 @@ from django.core.files import File
 from django.core.files.storage import Storage
 
 from ..models import KasaDakaUser, CallSession, CallSessionStep
-from ..models import VoiceService, Choice, ChoiceOption
+from ..models import VoiceService, Choice, ChoiceOption, MessagePresentation
 from ..models import Language, VoiceLabel, VoiceFragment
 
 def create_sample_voice_service(cls):
@@ -80,3 +80,65 @@ def create_sample_voice_service(cls):
 
 
 
+def create_voice_label(name, *languages):
+    """
+    Creates a VoiceLabel with a VoiceFragment for each of the given languages.
+    """
+    voice_label = VoiceLabel.objects.create(name = name)
+    for language in languages:
+        VoiceFragment(parent = voice_label,
+                language = language,
+                audio = '%s_%s.wav' % (name, language.code)).save()
+    return voice_label
+
+def create_language(name, code):
+    """
+    Creates a Language with all its required interface voice labels.
+    """
+    placeholder = VoiceLabel.objects.create(name = "%s placeholder" % code)
+    required_labels = ['voice_label', 'error_message', 'select_language',
+            'pre_choice_option', 'post_choice_option',
+            'zero', 'one', 'two', 'three', 'four',
+            'five', 'six', 'seven', 'eight', 'nine']
+    language = Language.objects.create(name = name, code = code,
+            **{label: placeholder for label in required_labels})
+    for label in required_labels:
+        setattr(language, label, create_voice_label('%s %s' % (code, label), language))
+    language.save()
+    return language
+
+def create_sample_call_flow(cls):
+    """
+    Creates an active voice service with a Choice element, whose options redirect
+    to a MessagePresentation and to the Choice itself.
+    """
+    cls.language = create_language("English", "en")
+    cls.voice_service = VoiceService.objects.create(
+            name = "call flow",
+            description = "sample call flow",
+            active = True,
+            registration = 'disabled')
+    cls.voice_service.supported_languages.add(cls.language)
+
+    cls.message_element = MessagePresentation.objects.create(name = "message",
+            voice_label = create_voice_label("message", cls.language),
+            final_element = True,
+            service = cls.voice_service)
+    cls.choice_element = Choice.objects.create(name = "choice",
+            voice_label = create_voice_label("choice", cls.language),
+            service = cls.voice_service)
+    cls.choice_option1 = ChoiceOption.objects.create(name = "option1",
+            parent = cls.choice_element,
+            voice_label = create_voice_label("option1", cls.language),
+            _redirect = cls.message_element,
+            service = cls.voice_service)
+    cls.choice_option2 = ChoiceOption.objects.create(name = "option2",
+            parent = cls.choice_element,
+            voice_label = create_voice_label("option2", cls.language),
+            _redirect = cls.choice_element,
+            service = cls.voice_service)
+    cls.voice_service._start_element = cls.choice_element
+    cls.voice_service.save()
+
+    cls.session = CallSession.objects.create(service = cls.voice_service,
+            _language = cls.language)
@@ -0,0 +1,16 @@
+from django.test import TestCase
+
+from ..benchmark import run_benchmark, QUERY_BUDGETS
+from ..models import CompiledCallFlow, voice_fragment_url_index
+
+
+class TestCallFlowBenchmark(TestCase):
+
+    def setUp(self):
+        CompiledCallFlow.invalidate()
+        voice_fragment_url_index.invalidate()
+
+    def test_query_budgets(self):
+        walker = run_benchmark(calls = 20, depth = 2, width = 3)
+        assert set(walker.statistics) == set(QUERY_BUDGETS), 'Every view should be visited'
+        assert not walker.over_budget, walker.report()
@@ -0,0 +1,200 @@
+import datetime
+import hashlib
+import io
+import os
+import tempfile
+import time
+
+import mock
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ..benchmark import EMPTY_WAV
+from ..content_store import (DateLayout, DeferredDeletions, HashPrefixLayout, delete_unreferenced_files,
+        get_upload_layout, is_content_addressed)
+from ..models import VoiceFragment, SpokenUserInput
+
+from .helpers import create_language, create_voice_label
+
+
+class TestContentStore(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT = self.media_root.name)
+        self.settings.enable()
+        self.language = create_language("English", "en")
+        self.voice_label = create_voice_label("label", self.language)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media_root.cleanup()
+
+    def test_is_content_addressed(self):
+        digest = hashlib.sha256(b'').hexdigest()
+        assert is_content_addressed('fragments/%s/%s.wav' % (digest[:2], digest))
+        assert is_content_addressed('%s/%s.wav' % (digest[:2], digest))
+        assert not is_content_addressed('fragments/%s.wav' % digest[:63])
+        assert not is_content_addressed('recording_1_2.wav')
+        assert not is_content_addressed(None)
+
+    def test_identical_uploads_stored_once(self):
+        fragments = [VoiceFragment.objects.create(parent = self.voice_label, language = self.language,
+                audio = SimpleUploadedFile(name, EMPTY_WAV, 'audio/wav')) for name in ['a.wav', 'B.WAV']]
+        digest = hashlib.sha256(EMPTY_WAV).hexdigest()
+        name = 'fragments/%s/%s/%s.wav' % (digest[:2], digest[2:4], digest)
+        assert fragments[0].audio.name == fragments[1].audio.name == name
+        assert os.listdir(os.path.dirname(os.path.join(self.media_root.name, name))) == [digest + '.wav']
+        assert fragments[0].get_url() == '/uploads/' + name
+
+    def test_delete_unreferenced_files(self):
+        fragment = VoiceFragment.objects.create(parent = self.voice_label, language = self.language,
+                audio = SimpleUploadedFile('a.wav', EMPTY_WAV, 'audio/wav'))
+        storage, name = fragment.audio.storage, fragment.audio.name
+        assert delete_unreferenced_files(storage, [name]) == set()
+        assert storage.exists(name)
+
+        # Stored again by another request while it was deleted
+        with mock.patch('vsdk.service_development.content_store.referenced_names', side_effect = [set(), {name}]):
+            assert delete_unreferenced_files(storage, [name]) == set()
+        assert storage.exists(name)
+        assert os.listdir(os.path.dirname(fragment.audio.path)) == [os.path.basename(name)]
+
+        fragment.delete()
+        # Stored in the last MEDIA_DELETION_GRACE_PERIOD seconds, maybe for a row that is not committed yet
+        assert delete_unreferenced_files(storage, [name]) == set()
+        assert storage.exists(name)
+        assert delete_unreferenced_files(storage, [name, 'missing.wav'], grace_period = 0) == {name, 'missing.wav'}
+        assert not storage.exists(name)
+        assert os.listdir(os.path.dirname(fragment.audio.path)) == []
+
+    @mock.patch('vsdk.service_development.content_store.delete_unreferenced_files')
+    @mock.patch('threading.Timer')
+    def test_deferred_deletions(self, timer, delete):
+        deferred_deletions = DeferredDeletions()
+        deferred_deletions.add('storage', [])
+        assert not timer.called
+        deferred_deletions.add('storage', ['a.wav'])
+        timer.assert_called_once_with(settings.MEDIA_DELETION_GRACE_PERIOD, deferred_deletions._run,
+                args = ('storage', ['a.wav']))
+        assert timer.return_value.start.called
+        assert not delete.called
+
+        deferred_deletions.run_pending()
+        assert timer.return_value.cancel.called
+        delete.assert_called_once_with('storage', ['a.wav'])
+        deferred_deletions.run_pending()
+        assert delete.call_count == 1
+
+    def test_store_content_touches_existing_files(self):
+        fragment = VoiceFragment.objects.create(parent = self.voice_label, language = self.language,
+                audio = SimpleUploadedFile('a.wav', EMPTY_WAV, 'audio/wav'))
+        os.utime(fragment.audio.path, (0, 0))
+        VoiceFragment.objects.create(parent = self.voice_label, language = self.language,
+                audio = SimpleUploadedFile('b.wav', EMPTY_WAV, 'audio/wav'))
+        assert os.path.getmtime(fragment.audio.path) > time.time() - 60
+
+    def test_rehash_media(self):
+        fragments = list(VoiceFragment.objects.order_by('id'))
+        for fragment in fragments:
+            with open(fragment.audio.path, 'wb') as audio:
+                audio.write(EMPTY_WAV)
+        VoiceFragment.objects.create(parent = self.voice_label, language = self.language, audio = 'missing.wav')
+        assert len({fragment.audio.name for fragment in fragments}) > 1
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('rehash_media', '--grace-period', '0', stdout = stdout, stderr = stderr)
+        assert 'Could not read missing.wav' in stderr.getvalue()
+        names = {fragment.audio.name for fragment in VoiceFragment.objects.exclude(audio = 'missing.wav')}
+        assert len(names) == 1
+        assert is_content_addressed(names.pop())
+        for fragment in fragments:
+            assert not os.path.exists(fragment.audio.path)
+        assert self.voice_label.get_voice_fragment_url(self.language).startswith('/uploads/fragments/')
+
+
+class TestUploadLayouts(TestCase):
+
+    def setUp(self):
+        self.digest = hashlib.sha256(b'').hexdigest()
+
+    def test_hash_prefix(self):
+        layout = HashPrefixLayout()
+        name = layout.name(self.digest, '.WAV')
+        assert name == '%s/%s/%s.wav' % (self.digest[:2], self.digest[2:4], self.digest)
+        assert layout.matches(name)
+        assert not layout.matches('%s/%s.wav' % (self.digest[:2], self.digest))
+        assert not layout.matches('00/00/%s.wav' % self.digest)
+        assert HashPrefixLayout(1).name(self.digest, '.wav') == '%s/%s.wav' % (self.digest[:2], self.digest)
+
+    def test_date(self):
+        layout = DateLayout()
+        date = timezone.make_aware(datetime.datetime(2018, 5, 31, 12))
+        name = layout.name(self.digest, '.wav', date)
+        assert name == '2018/05/31/%s.wav' % self.digest
+        assert layout.matches(name)
+        assert not layout.matches('%s/%s.wav' % (self.digest[:2], self.digest))
+
+    def test_settings(self):
+        assert isinstance(get_upload_layout('hash'), HashPrefixLayout)
+        assert isinstance(get_upload_layout('vsdk.service_development.content_store.DateLayout'), DateLayout)
+        assert isinstance(VoiceFragment._meta.get_field('audio').layout(), HashPrefixLayout)
+        assert isinstance(SpokenUserInput._meta.get_field('audio').layout(), DateLayout)
+        with override_settings(RECORDING_UPLOAD_LAYOUT = 'hash'):
+            assert isinstance(SpokenUserInput._meta.get_field('audio').layout(), HashPrefixLayout)
+
+
+class TestReshardMedia(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT = self.media_root.name)
+        self.settings.enable()
+        self.language = create_language("English", "en")
+        self.voice_label = create_voice_label("label", self.language)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media_root.cleanup()
+
+    def create_fragment(self, name, content):
+        path = os.path.join(self.media_root.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'wb') as audio:
+            audio.write(content)
+        # Uploaded before the grace period
+        os.utime(path, (time.time() - 3600, time.time() - 3600))
+        return VoiceFragment.objects.create(parent = self.voice_label, language = self.language, audio = name)
+
+    def test_reshard(self):
+        digest = hashlib.sha256(b'old layout').hexdigest()
+        old_layout = self.create_fragment('fragments/%s/%s.wav' % (digest[:2], digest), b'old layout')
+        flat = [self.create_fragment('flat.wav', EMPTY_WAV),
+                VoiceFragment.objects.create(parent = self.voice_label, language = self.language, audio = 'flat.wav')]
+        other = self.create_fragment('other.wav', EMPTY_WAV + b'\0\0')
+        laid_out = VoiceFragment.objects.create(parent = self.voice_label, language = self.language,
+                audio = SimpleUploadedFile('new.wav', b'new'))
+        VoiceFragment.objects.create(parent = self.voice_label, language = self.language, audio = 'missing.wav')
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        def sleep(seconds):
+            # The old files are still there during the grace period
+            assert os.path.exists(os.path.join(self.media_root.name, 'flat.wav'))
+        with mock.patch('time.sleep', side_effect = sleep) as grace_period:
+            call_command('reshard_media', '--batch-size', '2', stdout = stdout, stderr = stderr)
+        grace_period.assert_called_once_with(settings.MEDIA_DELETION_GRACE_PERIOD)
+        assert 'Could not move missing.wav' in stderr.getvalue()
+        assert 'Voice Fragment: moved 3 files' in stdout.getvalue()
+
+        layout = HashPrefixLayout()
+        for fragment in [old_layout] + flat + [other, laid_out]:
+            name = VoiceFragment.objects.get(pk = fragment.pk).audio.name
+            assert name.startswith('fragments/') and layout.matches(name[len('fragments/'):])
+            assert os.path.exists(os.path.join(self.media_root.name, name))
+        assert VoiceFragment.objects.get(pk = laid_out.pk).audio.name == laid_out.audio.name
+        assert VoiceFragment.objects.get(pk = flat[0].pk).audio.name == VoiceFragment.objects.get(pk = flat[1].pk).audio.name
+        for name in [old_layout.audio.name, 'flat.wav', 'other.wav']:
+            assert not os.path.exists(os.path.join(self.media_root.name, name))
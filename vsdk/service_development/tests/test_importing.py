@@ -0,0 +1,79 @@
+import io
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from ..benchmark import EMPTY_WAV
+from ..importing import number_field, scan_audio_files
+from ..models import Language, VoiceLabel
+
+from .helpers import create_language
+
+
+class TestImportVoiceLabels(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT = self.media_root.name)
+        self.settings.enable()
+        self.root = tempfile.TemporaryDirectory()
+        for path in ['en/numbers/1_en.wav', 'en/001_en.wav', 'en/notes.txt', 'fr/001_fr.wav', 'fr/one_fr.wav',
+                'fr/misnamed_en.wav', 'xx/001_xx.wav']:
+            path = os.path.join(self.root.name, path)
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            with open(path, 'wb') as audio_file:
+                audio_file.write(EMPTY_WAV)
+        create_language('English', 'en')
+        create_language('French', 'fr')
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media_root.cleanup()
+        self.root.cleanup()
+
+    def test_scan_audio_files(self):
+        audio_files = scan_audio_files(self.root.name, 'import/')
+        assert [(audio_file.language_code, audio_file.label_name) for audio_file in audio_files] == [
+                ('en', 'import/001'), ('en', 'import/numbers/1'), ('fr', 'import/001'), ('fr', 'import/one'),
+                ('xx', 'import/001')]
+
+    def test_number_field(self):
+        assert number_field('numbers/1') == 'one'
+        assert number_field('one') == 'one'
+        assert number_field('and') == 'andsep'
+        assert number_field('numbers/1000') == 'thousand'
+        assert number_field('welcome') is None
+
+    def test_import(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_voice_labels', self.root.name, '--numbers', '--workers', '1',
+                stdout = stdout, stderr = stderr)
+        assert 'Created 3 Voice Labels and 4 Voice Fragments (0 converted)' in stdout.getvalue()
+        assert 'unknown language' in stderr.getvalue()
+
+        voice_label = VoiceLabel.objects.get(name = '001')
+        fragments = voice_label.voicefragment_set.order_by('language__code')
+        assert [fragment.language.code for fragment in fragments] == ['en', 'fr']
+        assert all(fragment.conversion_status == 'correct' for fragment in fragments)
+        assert all(os.path.exists(fragment.audio.path) for fragment in fragments)
+        assert Language.objects.get(code = 'en').one.name == 'numbers/1'
+        assert Language.objects.get(code = 'fr').one.name == 'one'
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_voice_labels', self.root.name, '--workers', '1', stdout = stdout, stderr = stderr)
+        assert 'Created 0 Voice Labels and 0 Voice Fragments' in stdout.getvalue()
+        assert stderr.getvalue().count('already imported') == 4
+
+        for path in ['en/numbers/1_en.wav', 'en/001_en.wav', 'fr/001_fr.wav', 'fr/one_fr.wav']:
+            with open(os.path.join(self.root.name, path), 'wb') as audio_file:
+                audio_file.write(EMPTY_WAV + b'\0\0')
+        replaced_path = fragments[0].audio.path
+        call_command('import_voice_labels', self.root.name, '--replace', '--workers', '1', '--grace-period', '0',
+                stdout = io.StringIO(), stderr = io.StringIO())
+        fragments = VoiceLabel.objects.get(name = '001').voicefragment_set.all()
+        assert len(fragments) == 2
+        assert all(os.path.exists(fragment.audio.path) for fragment in fragments)
+        # The audio files of the replaced fragments are no longer used
+        assert not os.path.exists(replaced_path)
@@ -0,0 +1,111 @@
+import os
+import tempfile
+import urllib.error
+
+import mock
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from ..benchmark import EMPTY_WAV, create_benchmark_service
+from ..media import AudioFileCache, audio_file_cache
+from ..models import VoiceFragment
+
+
+class TestAudioFileCache(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT = self.media_root.name)
+        self.settings.enable()
+        self.cache = AudioFileCache()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media_root.cleanup()
+
+    def fieldfile(self, name):
+        return VoiceFragment(audio = name).audio
+
+    def write(self, name, content):
+        with open(os.path.join(self.media_root.name, name), 'wb') as audio_file:
+            audio_file.write(content)
+
+    def test_check_all(self):
+        self.write('a.wav', b'a')
+        statuses = self.cache.check_all([self.fieldfile('a.wav'), self.fieldfile('b.wav'),
+                self.fieldfile('a.wav'), self.fieldfile('')])
+        assert set(statuses) == {'a.wav', 'b.wav'}
+        assert statuses['a.wav'].accessible
+        assert statuses['a.wav'].version[0] == 1
+        assert not statuses['b.wav'].accessible
+
+    def test_wave_format_read_on_new_version(self):
+        self.write('a.wav', EMPTY_WAV)
+        status = self.cache.get_status(self.fieldfile('a.wav'))
+        assert status.wave_format.is_correct
+
+        with override_settings(MEDIA_VALIDATION_CACHE_TIMEOUT = -1):
+            with mock.patch.object(self.cache, 'wave_format') as wave_format:
+                assert self.cache.get_status(self.fieldfile('a.wav')).wave_format is status.wave_format
+                assert not wave_format.called
+            self.write('a.wav', b'not a wave file')
+            assert self.cache.get_status(self.fieldfile('a.wav')).wave_format is None
+
+    def test_cached_until_invalidated(self):
+        assert not self.cache.is_accessible(self.fieldfile('a.wav'))
+        self.write('a.wav', b'a')
+        assert not self.cache.is_accessible(self.fieldfile('a.wav'))
+        self.cache.invalidate('a.wav')
+        assert self.cache.is_accessible(self.fieldfile('a.wav'))
+
+    def test_http_version(self):
+        response = mock.MagicMock()
+        response.__enter__.return_value.headers = {'ETag': '"abc"'}
+        with mock.patch('urllib.request.urlopen', return_value = response) as urlopen:
+            assert self.cache.http_version('http://example.com/a.wav') == '"abc"'
+        assert urlopen.call_args[0][0].get_method() == 'HEAD'
+
+        with mock.patch('urllib.request.urlopen', side_effect = urllib.error.URLError('down')):
+            assert self.cache.http_version('http://example.com/a.wav') is None
+
+
+class TestVoiceServiceValidation(TestCase):
+
+    def setUp(self):
+        audio_file_cache.invalidate()
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT = self.media_root.name)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media_root.cleanup()
+
+    def test_audio_files_validated(self):
+        service = create_benchmark_service(depth = 1, width = 2)
+        errors = service.validator()
+        assert errors
+        assert all('audio file not accessible' in error for error in errors)
+
+        for content, error in [(b'audio', 'not in the correct format'), (EMPTY_WAV, None)]:
+            for fragment in VoiceFragment.objects.all():
+                with open(os.path.join(self.media_root.name, fragment.audio.name), 'wb') as audio_file:
+                    audio_file.write(content)
+            audio_file_cache.invalidate()
+            errors = service.validator()
+            if error:
+                assert errors and all(error in e for e in errors)
+            else:
+                assert errors == []
+
+    def test_queries_independent_of_size(self):
+        counts = []
+        for depth in [1, 3]:
+            with transaction.atomic():
+                service = create_benchmark_service(depth = depth, width = 2)
+                with CaptureQueriesContext(connection) as queries:
+                    service.validator()
+                counts.append(len(queries))
+                transaction.set_rollback(True)
+        assert counts[0] == counts[1]
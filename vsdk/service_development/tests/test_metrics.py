@@ -0,0 +1,70 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..metrics import Histogram, metrics_registry
+from ..models import voice_fragment_url_index
+
+from .helpers import create_sample_call_flow
+
+
+class TestHistogram(TestCase):
+
+    def test_cumulative_counts(self):
+        histogram = Histogram((1, 5))
+        for value in [0, 1, 3, 7]:
+            histogram.observe(value)
+        assert list(histogram.cumulative_counts()) == [(1, 2), (5, 3), ('+Inf', 4)]
+        assert histogram.sum == 11
+        assert histogram.count == 4
+
+
+class TestRequestMetrics(TestCase):
+
+    def setUp(self):
+        metrics_registry.reset()
+        voice_fragment_url_index.invalidate()
+        create_sample_call_flow(self)
+        self.choice_url = self.choice_element.get_absolute_url(self.session)
+
+    def test_recorded_per_view(self):
+        self.client.get(self.choice_url)
+        self.client.get(self.choice_url)
+        self.client.get(reverse('service-development:index'))
+
+        view = 'service-development:choice'
+        duration = metrics_registry.histograms[('vsdk_request_duration_seconds', view)]
+        queries = metrics_registry.histograms[('vsdk_request_queries', view)]
+        templates = metrics_registry.histograms[('vsdk_request_template_duration_seconds', view)]
+        assert duration.count == 2
+        assert queries.sum > 0
+        assert 0 < templates.sum < duration.sum
+        assert ('vsdk_request_duration_seconds', 'service-development:index') in metrics_registry.histograms
+
+    def test_not_recorded_for_admin(self):
+        self.client.get(reverse('admin:jsi18n'))
+        assert {view for name, view in metrics_registry.histograms} == set()
+
+    def test_metrics_endpoint(self):
+        self.client.get(self.choice_url)
+        response = self.client.get(reverse('service-development:metrics'))
+        assert response.status_code == 302
+
+        self.client.force_login(User.objects.create_user('staff', password = 'staff', is_staff = True))
+        response = self.client.get(reverse('service-development:metrics'))
+        assert response.status_code == 200
+        assert response['Content-Type'].startswith('text/plain')
+        content = response.content.decode()
+        assert 'vsdk_request_queries_count{view="service-development:choice"} 1' in content
+        assert 'service-development:metrics' not in content
+
+    def test_slow_requests_logged(self):
+        with override_settings(REQUEST_METRICS_SLOW_QUERY_COUNT = 0):
+            with self.assertLogs('vsdk.service_development.metrics', 'WARNING') as logs:
+                self.client.get(self.choice_url)
+        assert 'service-development:choice' in logs.output[0]
+        assert 'SELECT' in logs.output[0]
+
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('vsdk.service_development.metrics', 'WARNING'):
+                self.client.get(self.choice_url)
@@ -0,0 +1,75 @@
+from xml.etree import ElementTree as ET
+
+from django.db import connection
+from django.http import Http404
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..models import CompiledCallFlow, get_element_or_404
+from ..models import Choice, MessagePresentation, VoiceServiceElement
+
+from .helpers import create_sample_call_flow
+
+
+class TestCompiledCallFlow(TestCase):
+
+    def setUp(self):
+        CompiledCallFlow.invalidate()
+        create_sample_call_flow(self)
+
+    def test_elements_are_subclassed(self):
+        flow = CompiledCallFlow.for_service(self.voice_service.id)
+        assert type(flow.get_element(self.choice_element.id)) is Choice
+        assert type(flow.get_element(self.message_element.id)) is MessagePresentation
+        assert flow.get_element(0) is None
+
+    def test_redirects_and_options_resolved_without_queries(self):
+        flow = CompiledCallFlow.for_service(self.voice_service.id)
+        choice = flow.get_element(self.choice_element.id)
+        with CaptureQueriesContext(connection) as queries:
+            options = list(choice.choice_options.all())
+            redirects = [option.redirect for option in options]
+            voice_label = choice.voice_label
+            service = choice.service
+        assert len(queries) == 0
+        assert [option.id for option in options] == [self.choice_option1.id, self.choice_option2.id]
+        assert type(redirects[0]) is MessagePresentation
+        assert redirects[1] is choice
+        assert voice_label.id == self.choice_element.voice_label_id
+        assert service.id == self.voice_service.id
+
+    def test_snapshot_reused_until_modified(self):
+        flow = CompiledCallFlow.for_service(self.voice_service.id)
+        assert CompiledCallFlow.for_service(self.voice_service.id) is flow
+
+        self.message_element.name = "renamed"
+        self.message_element.save()
+        new_flow = CompiledCallFlow.for_service(self.voice_service.id)
+        assert new_flow is not flow
+        assert new_flow.get_element(self.message_element.id).name == "renamed"
+
+    def test_snapshot_recompiled_after_change_in_other_process(self):
+        flow = CompiledCallFlow.for_service(self.voice_service.id)
+        # Updates through the queryset do not send signals, as if they were
+        # done by another worker process.
+        VoiceServiceElement.objects.filter(pk = self.message_element.id).update(
+                name = "renamed", modification_date = self.message_element.modification_date.replace(year = 2100))
+        new_flow = CompiledCallFlow.for_service(self.voice_service.id)
+        assert new_flow is not flow
+        assert new_flow.get_element(self.message_element.id).name == "renamed"
+
+    def test_get_element_or_404(self):
+        assert get_element_or_404(Choice, self.choice_element.id, self.session) is \
+                CompiledCallFlow.for_service(self.voice_service.id).get_element(self.choice_element.id)
+        with self.assertRaises(Http404):
+            get_element_or_404(MessagePresentation, self.choice_element.id, self.session)
+
+    def test_start_element(self):
+        assert type(self.voice_service.start_element) is Choice
+        assert self.voice_service.start_element.id == self.choice_element.id
+
+    def test_choice_vxml(self):
+        response = self.client.get(self.choice_element.get_absolute_url(self.session))
+        assert response.status_code == 200
+        assert ET.fromstring(response.content), 'Should produce valid XML'
+        assert self.message_element.get_absolute_url(self.session) in response.content.decode()
@@ -1,9 +1,16 @@
+from datetime import timedelta
+
+import mock
 import pytest
 from mixer.backend.django import mixer
 pytestmark = pytest.mark.django_db
 
-from django.test import TestCase
-from ..models.session import lookup_or_create_session, CallSession
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from ..models import VoiceService
+from ..models.session import lookup_or_create_session, CallSession, CallSessionStep, CallSessionStepBuffer
+from .helpers import create_language
 
 class TestCallSession(TestCase):
     def setUp(self):
@@ -129,3 +136,76 @@ def test_lookup_or_create_session():
     
 
 
+
+class TestCallSessionStepBuffer(TestCase):
+
+    def setUp(self):
+        self.buffer = CallSessionStepBuffer(max_size = 3, max_age = 60)
+        self.session = CallSession.objects.create()
+        self.other_session = CallSession.objects.create()
+
+    def tearDown(self):
+        self.buffer._instances = []
+        self.buffer.flush()
+
+    def test_steps_saved_on_flush(self):
+        with override_settings(CALL_SESSION_STEP_BUFFERING = True), \
+                mock.patch('vsdk.service_development.models.session.get_call_session_step_buffer',
+                        return_value = self.buffer):
+            self.session.record_step(description = "first")
+            self.other_session.record_step(description = "other")
+        assert CallSessionStep.objects.count() == 0
+        assert self.buffer.depth == 2
+
+        assert self.buffer.flush() == 2
+        assert self.buffer.depth == 0
+        assert CallSessionStep.objects.count() == 2
+        assert CallSession.objects.get(pk = self.session.pk).end == self.session.end
+        assert CallSession.objects.get(pk = self.other_session.pk).end == self.other_session.end
+
+    def test_flush_when_full(self):
+        with override_settings(CALL_SESSION_STEP_BUFFERING = True), \
+                mock.patch('vsdk.service_development.models.session.get_call_session_step_buffer',
+                        return_value = self.buffer):
+            for i in range(3):
+                self.session.record_step(description = str(i))
+        steps = self.session.steps.order_by('time')
+        assert [step.description for step in steps] == ['0', '1', '2']
+        assert CallSession.objects.get(pk = self.session.pk).end == steps[2].time
+
+    def test_end_never_moves_back(self):
+        self.session.record_step(description = "unbuffered")
+        end = CallSession.objects.get(pk = self.session.pk).end
+        self.buffer.add(CallSessionStep(session = self.session, time = end - timedelta(seconds = 10)))
+        self.buffer.flush()
+        assert CallSession.objects.get(pk = self.session.pk).end == end
+
+class TestCallSessionLanguage(TestCase):
+
+    def setUp(self):
+        self.lang = create_language("English", "en")
+        self.lang2 = create_language("French", "fr")
+        self.service = VoiceService.objects.create(name = "service", description = "",
+                active = True, registration = 'disabled')
+        self.service.supported_languages.add(self.lang, self.lang2)
+
+    def test_language_access_does_not_write(self):
+        session = CallSession.objects.create(service = self.service, _language = self.lang2)
+        session = CallSession.objects.get(pk = session.pk)
+        with CaptureQueriesContext(connection) as queries:
+            assert session.language == self.lang2
+            assert session.language == self.lang2
+        assert len(queries) == 2, 'Only the service and its supported languages are queried'
+        assert not [query for query in queries if not query['sql'].startswith('SELECT')]
+
+    def test_changed_language_is_saved(self):
+        self.service.supported_languages.remove(self.lang2)
+        session = CallSession.objects.create(service = self.service, _language = self.lang2)
+        assert session.language == self.lang
+        assert CallSession.objects.get(pk = session.pk)._language == self.lang
+
+    def test_language_determined_again_when_set(self):
+        session = CallSession.objects.create(service = self.service)
+        assert session.language == None
+        session._language = self.lang
+        assert session.language == self.lang
@@ -0,0 +1,118 @@
+import os
+import tempfile
+
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from ..benchmark import EMPTY_WAV, create_benchmark_service
+from ..media import audio_file_cache
+from ..models import (VoiceService, VoiceServiceSubElement, VoiceLabel, VoiceFragment, Language,
+        validation_queue)
+
+
+class TestStoredValidationStatus(TestCase):
+    """
+    Transactions are not committed in these tests, so the validation queue is
+    processed explicitly.
+    """
+
+    def setUp(self):
+        validation_queue.process()
+        audio_file_cache.invalidate()
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT = self.media_root.name)
+        self.settings.enable()
+        self.service = create_benchmark_service(depth = 1, width = 2)
+        validation_queue.process()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media_root.cleanup()
+
+    def write_audio_files(self):
+        for fragment in VoiceFragment.objects.all():
+            with open(os.path.join(self.media_root.name, fragment.audio.name), 'wb') as audio_file:
+                audio_file.write(EMPTY_WAV)
+        audio_file_cache.invalidate()
+
+    def test_stored_on_change(self):
+        service = VoiceService.objects.get(pk = self.service.id)
+        assert service.validation_status is False
+        assert sorted(service.stored_validation_errors) == sorted(service.validator())
+        assert not VoiceServiceSubElement.objects.filter(validation_status = None).exists()
+        assert not VoiceLabel.objects.filter(validation_status = None).exists()
+
+        self.write_audio_files()
+        fragment = VoiceFragment.objects.filter(parent__voiceservicesubelement__isnull = False).first()
+        fragment.save()
+        validation_queue.process()
+
+        service.refresh_from_db()
+        assert service.stored_validation_errors == []
+        assert service.validation_status is True
+        assert service.stored_validation_errors == []
+        assert VoiceLabel.objects.get(pk = fragment.parent_id).validation_status is True
+        assert not VoiceServiceSubElement.objects.filter(validation_status = False).exists()
+
+    def test_supported_languages_change(self):
+        self.write_audio_files()
+        self.service.save()
+        validation_queue.process()
+        assert VoiceService.objects.get(pk = self.service.id).validation_status is True
+
+        language = Language.objects.create(name = 'Dutch', code = 'nl',
+                **{field: getattr(Language.objects.first(), field) for field in
+                    ['voice_label_id', 'error_message_id', 'select_language_id', 'pre_choice_option_id',
+                        'post_choice_option_id', 'one_id', 'two_id', 'three_id', 'four_id', 'five_id',
+                        'six_id', 'seven_id', 'eight_id', 'nine_id', 'zero_id']})
+        self.service.supported_languages.add(language)
+        validation_queue.process()
+        service = VoiceService.objects.get(pk = self.service.id)
+        assert service.validation_status is False
+        assert any('Dutch' in error for error in service.stored_validation_errors)
+
+    def test_voice_label_delete(self):
+        self.write_audio_files()
+        self.service.save()
+        validation_queue.process()
+
+        element = VoiceServiceSubElement.objects.filter(voice_label__isnull = False).first()
+        element.voice_label.delete()
+        validation_queue.process()
+        element.refresh_from_db()
+        assert element.validation_status is False
+        assert VoiceService.objects.get(pk = self.service.id).validation_status is False
+
+
+class Rollback(Exception):
+    pass
+
+
+class TestValidationAfterRollback(TransactionTestCase):
+    """
+    Transactions are committed in these tests, so changes are validated by the background thread.
+    """
+
+    def create_service(self, name):
+        return VoiceService.objects.create(name = name, description = name, active = False,
+                registration = 'disabled')
+
+    def test_validated_after_rollback(self):
+        with self.assertRaises(Rollback):
+            with transaction.atomic():
+                self.create_service('rolled back')
+                raise Rollback()
+
+        service = self.create_service('committed')
+        validation_queue.shutdown()
+        assert VoiceService.objects.get(pk = service.id).validation_status is not None
+
+    def test_validated_after_savepoint_rollback(self):
+        with transaction.atomic():
+            with self.assertRaises(Rollback):
+                with transaction.atomic():
+                    self.create_service('rolled back')
+                    raise Rollback()
+            service = self.create_service('committed')
+        validation_queue.shutdown()
+        assert VoiceService.objects.get(pk = service.id).validation_status is not None
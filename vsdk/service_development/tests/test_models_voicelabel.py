@@ -0,0 +1,101 @@
+import mock
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..models import VoiceLabel, VoiceFragment, voice_fragment_url_index
+
+from .helpers import create_language, create_voice_label
+
+
+class TestVoiceFragmentUrlIndex(TestCase):
+
+    def setUp(self):
+        voice_fragment_url_index.invalidate()
+        self.language = create_language("English", "en")
+        self.language2 = create_language("French", "fr")
+        self.voice_label = create_voice_label("label", self.language, self.language2)
+
+    def test_urls_of_fragments(self):
+        fragment = self.voice_label.voicefragment_set.get(language = self.language)
+        assert self.voice_label.get_voice_fragment_url(self.language) == fragment.get_url()
+        assert self.voice_label.get_voice_fragment_url(self.language2) != fragment.get_url()
+        assert self.voice_label.get_voice_fragment_url(None) == ''
+
+        without_fragment = VoiceLabel.objects.create(name = "no fragment")
+        assert without_fragment.get_voice_fragment_url(self.language) == ''
+
+    def test_language_loaded_in_bulk(self):
+        with CaptureQueriesContext(connection) as queries:
+            for label in ['zero', 'one', 'two', 'pre_choice_option', 'post_choice_option']:
+                assert self.language.get_voice_label_url(getattr(self.language, label + '_id'))
+            assert self.language.get_interface_voice_label_url_dict['pre_choice_option']
+            assert len(self.language.get_interface_numbers_voice_label_url_list) == 10
+        assert len(queries) == 1
+
+    def test_invalidated_on_change(self):
+        fragment = self.voice_label.voicefragment_set.get(language = self.language)
+        self.voice_label.get_voice_fragment_url(self.language)
+
+        fragment.audio = 'other.wav'
+        fragment.save()
+        assert self.voice_label.get_voice_fragment_url(self.language) == fragment.get_url()
+
+        fragment.delete()
+        assert self.voice_label.get_voice_fragment_url(self.language) == ''
+
+    def test_invalidated_on_language_change(self):
+        fragment = VoiceFragment.objects.get(parent = self.voice_label, language = self.language2)
+        assert self.voice_label.get_voice_fragment_url(self.language2) == fragment.get_url()
+
+        fragment.language = self.language
+        fragment.save()
+        assert self.voice_label.get_voice_fragment_url(self.language2) == ''
+
+    def test_invalidated_while_loading(self):
+        load = voice_fragment_url_index._load
+
+        def load_and_invalidate(language_id):
+            urls = load(language_id)
+            voice_fragment_url_index.invalidate(language_id)
+            return urls
+
+        with mock.patch.object(voice_fragment_url_index, '_load', side_effect = load_and_invalidate):
+            self.voice_label.get_voice_fragment_url(self.language)
+        assert self.language.id not in voice_fragment_url_index._urls
+
+
+class TestLanguageNumberSamples(TestCase):
+
+    def setUp(self):
+        voice_fragment_url_index.invalidate()
+        self.language = create_language("English", "en")
+        for field in ['twenty', 'hundred', 'andsep']:
+            setattr(self.language, field, create_voice_label(field, self.language))
+        self.language.save()
+
+    def url(self, field):
+        return self.language.get_voice_label_url(getattr(self.language, field + '_id'))
+
+    def test_generate_number(self):
+        assert self.language.generate_number(7) == [self.url('seven')]
+        assert self.language.generate_number(125) == [self.url('one'), self.url('hundred'),
+                self.url('andsep'), self.url('twenty'), self.url('five')]
+
+    def test_generate_number_without_queries(self):
+        self.language.generate_number(125)
+        with CaptureQueriesContext(connection) as queries:
+            self.language.generate_number(125)
+            self.language.generate_number(3)
+        assert len(queries) == 0
+
+    def test_rebuilt_on_change(self):
+        self.language.generate_number(7)
+        fragment = VoiceFragment.objects.get(parent_id = self.language.seven_id)
+        fragment.audio = 'other_seven.wav'
+        fragment.save()
+        assert self.language.generate_number(7) == [fragment.get_url()]
+
+        self.language.seven = create_voice_label("other seven", self.language)
+        assert self.language.generate_number(7) == \
+                [VoiceFragment.objects.get(parent = self.language.seven).get_url()]
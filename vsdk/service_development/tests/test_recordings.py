@@ -0,0 +1,126 @@
+import os
+import tempfile
+from concurrent.futures import Future
+
+import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..benchmark import EMPTY_WAV
+from ..content_store import DateLayout, deferred_deletions, is_content_addressed
+from ..models import Record, SpokenUserInput, UserInputCategory
+from ..recordings import RecordingProcessingError, process_recording, recording_processing_queue
+
+from .helpers import create_sample_call_flow, create_voice_label
+
+
+def finished_future(result = None, exception = None):
+    future = Future()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+
+class TestRecordings(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT = self.media_root.name)
+        self.settings.enable()
+        create_sample_call_flow(self)
+        self.record_element = Record.objects.create(name = "record",
+                voice_label = create_voice_label("record", self.language),
+                input_category = UserInputCategory.objects.create(name = "messages", service = self.voice_service),
+                _redirect = self.choice_element,
+                service = self.voice_service)
+        self.url = reverse('service-development:record', kwargs = {'element_id': self.record_element.id,
+                'session_id': self.session.id})
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media_root.cleanup()
+
+    def post_recording(self, content):
+        return self.client.post(self.url, {'recording': SimpleUploadedFile('recording.wav', content, 'audio/wav'),
+                'redirect': '/vxml/next'})
+
+    @mock.patch.object(recording_processing_queue, 'add')
+    def test_upload(self, add):
+        response = self.post_recording(EMPTY_WAV)
+        assert response.status_code == 302
+        response = self.post_recording(EMPTY_WAV + b'\0\0')
+        assert response.status_code == 302
+
+        recordings = list(SpokenUserInput.objects.order_by('id'))
+        assert len(recordings) == 2
+        assert recordings[0].audio.name != recordings[1].audio.name
+        for recording in recordings:
+            assert recording.audio.name.startswith('uploads/')
+            assert is_content_addressed(recording.audio.name)
+            assert DateLayout().matches(recording.audio.name[len('uploads/'):])
+            assert os.path.exists(recording.audio.path)
+            assert recording.processing_status == 'pending'
+        assert add.call_count == 2
+
+    def test_storage_without_local_files(self):
+        storage = mock.Mock(**{'path.side_effect': NotImplementedError})
+        with mock.patch.object(recording_processing_queue, 'storage', return_value = storage):
+            assert recording_processing_queue.can_process() is False
+
+        with mock.patch.object(recording_processing_queue, 'local_path', return_value = None):
+            response = self.post_recording(EMPTY_WAV)
+            assert response.status_code == 302
+            recording = SpokenUserInput.objects.get()
+            assert recording.processing_status == ''
+            assert recording_processing_queue.submit(recording.id, recording.audio.name) is None
+
+    def test_process_recording(self):
+        path = os.path.join(self.media_root.name, 'recording.wav')
+        with open(path, 'wb') as recording:
+            recording.write(EMPTY_WAV + b'\0' * 1600)
+        assert process_recording(path, path + '.processed', False) == (False, 0.1)
+
+        with open(path, 'wb') as recording:
+            recording.write(b'not a recording')
+        with self.assertRaises(RecordingProcessingError):
+            process_recording(path, path + '.processed', False)
+
+    def test_finish(self):
+        with mock.patch.object(recording_processing_queue, 'add'):
+            self.post_recording(EMPTY_WAV)
+        recording = SpokenUserInput.objects.get()
+        recording_processing_queue.finish(recording.id, recording.audio.name, '/tmp/processed.wav',
+                finished_future((False, 2.5)))
+        recording = SpokenUserInput.objects.get()
+        assert recording.processing_status == 'correct'
+        assert recording.duration == 2.5
+
+        recording_processing_queue.finish(recording.id, recording.audio.name, '/tmp/processed.wav',
+                finished_future(exception = RecordingProcessingError('Not a Wave file')))
+        recording = SpokenUserInput.objects.get()
+        assert recording.processing_status == 'failed'
+        assert recording.processing_error == 'Not a Wave file'
+
+    def test_finish_converted(self):
+        with mock.patch.object(recording_processing_queue, 'add'):
+            self.post_recording(EMPTY_WAV + b'\0\0')
+        recording = SpokenUserInput.objects.get()
+        original_path = recording.audio.path
+        os.utime(original_path, (0, 0))
+        processed_path = os.path.join(self.media_root.name, 'processed.wav')
+        with open(processed_path, 'wb') as processed:
+            processed.write(EMPTY_WAV)
+        recording_processing_queue.finish(recording.id, recording.audio.name, processed_path,
+                finished_future((True, 0.0)))
+        recording = SpokenUserInput.objects.get()
+        assert recording.processing_status == 'converted'
+        assert recording.audio.path != original_path
+        with recording.audio.open() as audio:
+            assert audio.read() == EMPTY_WAV
+        # The original is deleted after the grace period
+        assert os.path.exists(original_path)
+        deferred_deletions.run_pending()
+        assert not os.path.exists(original_path)
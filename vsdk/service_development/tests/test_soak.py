@@ -0,0 +1,42 @@
+import tempfile
+
+from django.core.servers.basehttp import WSGIServer
+from django.test import LiveServerTestCase, override_settings
+from django.test.testcases import LiveServerThread, QuietWSGIRequestHandler
+
+from ..benchmark import create_benchmark_service
+from ..models import CompiledCallFlow, validation_queue, voice_fragment_url_index
+from ..soak import SoakTestDriver
+
+
+class SingleThreadedLiveServerThread(LiveServerThread):
+    """
+    Handles the requests one at a time, as the in-memory test database is shared
+    with the server thread.
+    """
+
+    def _create_server(self):
+        return WSGIServer((self.host, self.port), QuietWSGIRequestHandler, allow_reuse_address = False)
+
+
+class TestSoakTestDriver(LiveServerTestCase):
+    server_thread_class = SingleThreadedLiveServerThread
+
+    def setUp(self):
+        CompiledCallFlow.invalidate()
+        voice_fragment_url_index.invalidate()
+        self.voice_service = create_benchmark_service(depth = 2, width = 2)
+        # The service is validated in the background, which should not lock the database during the test
+        validation_queue.shutdown()
+
+    def test_concurrent_calls(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT = media_root):
+            statistics = SoakTestDriver(self.live_server_url, self.voice_service.id,
+                    callers = 3, calls = 12, fetch_audio = False, bip_ratio = 1).run()
+        assert statistics.calls == 12
+        assert statistics.failed_calls == 0, statistics.report()
+        # Bips are refused while no poll is active
+        assert set(statistics.errors) <= {'polls:handle-bip'}
+        assert 'service-development:voice-service' in statistics.views
+        assert 'polls:handle-bip' in statistics.views
+        assert 'Requests:' in statistics.report()
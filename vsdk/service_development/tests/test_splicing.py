@@ -0,0 +1,97 @@
+import io
+import os
+import tempfile
+import time
+import wave
+
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+
+from ..content_store import is_content_addressed
+from ..splicing import audio_splicer
+
+
+def wave_file(frames, framerate = 8000):
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as wave_output:
+        wave_output.setnchannels(1)
+        wave_output.setsampwidth(2)
+        wave_output.setframerate(framerate)
+        wave_output.writeframes(frames)
+    return output.getvalue()
+
+
+class TestAudioSplicer(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT = self.media_root.name)
+        self.settings.enable()
+        audio_splicer.invalidate()
+        for name, content in [('one.wav', wave_file(b'\x01\x00' * 10)), ('hundred.wav', wave_file(b'\x02\x00' * 20)),
+                ('fast.wav', wave_file(b'\x03\x00', 16000)), ('text.wav', b'not a wave file')]:
+            with open(os.path.join(self.media_root.name, name), 'wb') as media_file:
+                media_file.write(content)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media_root.cleanup()
+
+    def read_frames(self, url):
+        assert url.startswith('/uploads/spliced/')
+        with wave.open(os.path.join(self.media_root.name, url[len('/uploads/'):]), 'rb') as spliced:
+            assert spliced.getframerate() == 8000
+            return spliced.readframes(spliced.getnframes())
+
+    def test_splice(self):
+        urls = audio_splicer.splice_urls(['/uploads/one.wav', '', '/uploads/hundred.wav', '/uploads/one.wav'])
+        assert len(urls) == 1
+        assert is_content_addressed(urls[0][len('/uploads/'):])
+        assert self.read_frames(urls[0]) == b'\x01\x00' * 10 + b'\x02\x00' * 20 + b'\x01\x00' * 10
+
+        # The same sequence is spliced once
+        assert audio_splicer.splice_urls(['/uploads/one.wav', '/uploads/hundred.wav', '/uploads/one.wav']) == urls
+        audio_splicer.invalidate()
+        assert audio_splicer.splice_urls(['/uploads/one.wav', '/uploads/hundred.wav', '/uploads/one.wav']) == urls
+        assert len(os.listdir(os.path.dirname(os.path.join(self.media_root.name, urls[0][len('/uploads/'):])))) == 1
+
+        # A changed file is spliced again
+        with open(os.path.join(self.media_root.name, 'one.wav'), 'wb') as media_file:
+            media_file.write(wave_file(b'\x04\x00'))
+        changed_urls = audio_splicer.splice_urls(['/uploads/one.wav', '/uploads/hundred.wav', '/uploads/one.wav'])
+        assert changed_urls != urls
+        assert self.read_frames(changed_urls[0]) == b'\x04\x00' + b'\x02\x00' * 20 + b'\x04\x00'
+
+    def test_not_spliced(self):
+        assert audio_splicer.splice_urls(['/uploads/one.wav']) == ['/uploads/one.wav']
+        for urls in [['/uploads/one.wav', '/uploads/fast.wav'], ['/uploads/one.wav', '/uploads/text.wav'],
+                ['/uploads/one.wav', '/uploads/missing.wav'], ['/uploads/one.wav', 'http://example.com/one.wav']]:
+            assert audio_splicer.splice_urls(urls) == urls
+        with override_settings(AUDIO_SPLICING = False):
+            urls = ['/uploads/one.wav', '/uploads/hundred.wav']
+            assert audio_splicer.splice_urls(urls) == urls
+
+    def test_clean_spliced_audio(self):
+        urls = ['/uploads/one.wav', '/uploads/hundred.wav']
+        unused_path = os.path.join(self.media_root.name, audio_splicer.splice_urls(urls)[0][len('/uploads/'):])
+        used_path = os.path.join(self.media_root.name,
+                audio_splicer.splice_urls(urls + ['/uploads/one.wav'])[0][len('/uploads/'):])
+        week_ago = time.time() - 8 * 24 * 3600
+        os.utime(unused_path, (week_ago, week_ago))
+
+        stdout = io.StringIO()
+        call_command('clean_spliced_audio', '--days', '7', stdout = stdout)
+        assert 'Deleted 1 spliced files' in stdout.getvalue()
+        assert not os.path.exists(unused_path)
+        assert os.path.exists(used_path)
+
+        # Spliced again when it is used again
+        assert os.path.join(self.media_root.name, audio_splicer.splice_urls(urls)[0][len('/uploads/'):]) == unused_path
+        assert os.path.exists(unused_path)
+
+    def test_template_filter(self):
+        template = Template('{% load audio %}{% for url in audio_urls|spliced %}<audio src="{{ url }}"/>{% endfor %}')
+        content = template.render(Context({'audio_urls': ['/uploads/one.wav', '/uploads/hundred.wav']}))
+        assert content.count('<audio') == 1
+        assert '/uploads/spliced/' in content
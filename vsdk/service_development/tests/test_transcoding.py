@@ -0,0 +1,122 @@
+import hashlib
+import os
+import tempfile
+from concurrent.futures import Future
+
+import mock
+from django.test import TestCase, override_settings
+
+from ..benchmark import EMPTY_WAV
+from ..content_store import deferred_deletions
+from ..models import VoiceFragment
+from ..transcoding import AudioConversionError, audio_conversion_queue, convert_audio_file
+
+from .helpers import create_language, create_voice_label
+
+EMPTY_WAV_HASH = hashlib.sha256(EMPTY_WAV).hexdigest()
+
+
+def finished_future(result = None, exception = None):
+    future = Future()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+
+class TestConvertAudioFile(TestCase):
+
+    @mock.patch('subprocess.run')
+    @mock.patch('vsdk.service_development.transcoding.audio_file_format_is_correct', return_value = True)
+    def test_correct_format(self, format_is_correct, run):
+        assert convert_audio_file('/media/a.wav', '/media/a_conv.wav') is False
+        assert not run.called
+
+    @mock.patch('subprocess.run')
+    @mock.patch('vsdk.service_development.transcoding.audio_file_format_is_correct', return_value = False)
+    def test_converted(self, format_is_correct, run):
+        run.return_value.returncode = 0
+        assert convert_audio_file('/media/a.wav', '/media/a_conv.wav') is True
+        assert run.call_args[0][0][:3] == ['sox', '-S', '/media/a.wav']
+        assert run.call_args[0][0][-1] == '/media/a_conv.wav'
+
+        run.return_value.returncode = 2
+        run.return_value.stdout = 'sox FAIL formats: can\'t open input file'
+        with self.assertRaises(AudioConversionError):
+            convert_audio_file('/media/a.wav', '/media/a_conv.wav')
+
+
+class TestAudioConversionQueue(TestCase):
+
+    def setUp(self):
+        self.language = create_language("English", "en")
+        self.voice_label = create_voice_label("label", self.language)
+        self.fragment = VoiceFragment.objects.get(parent = self.voice_label)
+
+    @mock.patch.object(audio_conversion_queue, 'add')
+    def test_queued_on_new_audio(self, add):
+        with override_settings(KASADAKA = False):
+            VoiceFragment(parent = self.voice_label, language = self.language, audio = 'new.wav').save()
+        assert not add.called
+
+        with override_settings(KASADAKA = True):
+            fragment = VoiceFragment(parent = self.voice_label, language = self.language, audio = 'new.wav')
+            fragment.save()
+            assert add.call_count == 1
+            assert VoiceFragment.objects.get(pk = fragment.pk).conversion_status == 'pending'
+
+            fragment = VoiceFragment.objects.get(pk = fragment.pk)
+            fragment.save()
+            assert add.call_count == 1
+
+            fragment.audio = 'other.wav'
+            fragment.save()
+            assert add.call_count == 2
+
+    def test_converted(self):
+        name = self.fragment.audio.name
+        self.fragment.get_url()
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT = media_root):
+            with open(os.path.join(media_root, name), 'wb') as original:
+                original.write(b'original')
+            os.utime(os.path.join(media_root, name), (0, 0))
+            converted_path = os.path.join(media_root, 'converted.wav')
+            with open(converted_path, 'wb') as converted:
+                converted.write(EMPTY_WAV)
+            audio_conversion_queue.finish(self.fragment.id, name, converted_path, finished_future(True))
+            fragment = VoiceFragment.objects.get(pk = self.fragment.pk)
+            assert fragment.audio.name == 'fragments/%s/%s/%s.wav' % (EMPTY_WAV_HASH[:2], EMPTY_WAV_HASH[2:4],
+                    EMPTY_WAV_HASH)
+            assert fragment.conversion_status == 'converted'
+            assert self.voice_label.get_voice_fragment_url(self.language) == fragment.get_url()
+            with fragment.audio.open() as audio:
+                assert audio.read() == EMPTY_WAV
+            # The original is no longer used, and deleted after the grace period
+            assert os.path.exists(os.path.join(media_root, name))
+            deferred_deletions.run_pending()
+            assert not os.path.exists(os.path.join(media_root, name))
+
+    def test_correct(self):
+        name = self.fragment.audio.name
+        audio_conversion_queue.finish(self.fragment.id, name, 'converted.wav', finished_future(False))
+        fragment = VoiceFragment.objects.get(pk = self.fragment.pk)
+        assert fragment.audio.name == name
+        assert fragment.conversion_status == 'correct'
+
+    def test_failed(self):
+        name = self.fragment.audio.name
+        audio_conversion_queue.finish(self.fragment.id, name, 'converted.wav',
+                finished_future(exception = AudioConversionError('no sox')))
+        fragment = VoiceFragment.objects.get(pk = self.fragment.pk)
+        assert fragment.audio.name == name
+        assert fragment.conversion_status == 'failed'
+        assert fragment.conversion_error == 'no sox'
+
+    def test_replaced_in_the_meantime(self):
+        VoiceFragment.objects.filter(pk = self.fragment.pk).update(audio = 'newer.wav', conversion_status = 'pending')
+        audio_conversion_queue.finish(self.fragment.id, self.fragment.audio.name, 'converted.wav',
+                finished_future(True))
+        fragment = VoiceFragment.objects.get(pk = self.fragment.pk)
+        assert fragment.audio.name == 'newer.wav'
+        assert fragment.conversion_status == 'pending'
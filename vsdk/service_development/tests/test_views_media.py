@@ -0,0 +1,128 @@
+import hashlib
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.http import http_date
+
+from ..benchmark import EMPTY_WAV
+from ..models import CallSessionStep
+from ..views.media import UnsatisfiableRange, parse_range
+
+from .helpers import create_sample_call_flow
+
+
+class TestServeMedia(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT = self.media_root.name)
+        self.settings.enable()
+        self.digest = hashlib.sha256(EMPTY_WAV).hexdigest()
+        self.content_addressed_name = 'fragments/%s/%s.wav' % (self.digest[:2], self.digest)
+        for name in [self.content_addressed_name, 'uploads/recording.wav']:
+            os.makedirs(os.path.join(self.media_root.name, os.path.dirname(name)), exist_ok = True)
+            with open(os.path.join(self.media_root.name, name), 'wb') as media_file:
+                media_file.write(EMPTY_WAV)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media_root.cleanup()
+
+    def test_content_addressed(self):
+        response = self.client.get('/uploads/' + self.content_addressed_name)
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == EMPTY_WAV
+        assert response['Content-Type'] == 'audio/x-wav'
+        assert response['Content-Length'] == str(len(EMPTY_WAV))
+        assert response['ETag'] == '"%s"' % self.digest
+        assert 'immutable' in response['Cache-Control']
+
+        response = self.client.get('/uploads/' + self.content_addressed_name,
+                HTTP_IF_NONE_MATCH = '"%s"' % self.digest)
+        assert response.status_code == 304
+        assert response['ETag'] == '"%s"' % self.digest
+        assert not response.content
+
+    def test_if_modified_since(self):
+        response = self.client.get('/uploads/uploads/recording.wav')
+        assert response.status_code == 200
+        assert 'immutable' not in response['Cache-Control']
+        assert 'max-age=3600' in response['Cache-Control']
+
+        mtime = os.stat(os.path.join(self.media_root.name, 'uploads/recording.wav')).st_mtime
+        response = self.client.get('/uploads/uploads/recording.wav', HTTP_IF_MODIFIED_SINCE = http_date(mtime))
+        assert response.status_code == 304
+        response = self.client.get('/uploads/uploads/recording.wav', HTTP_IF_MODIFIED_SINCE = http_date(mtime - 60))
+        assert response.status_code == 200
+
+    def test_not_found(self):
+        assert self.client.get('/uploads/missing.wav').status_code == 404
+        assert self.client.get('/uploads/uploads').status_code == 404
+        assert self.client.get('/uploads/../settings.py').status_code == 400
+
+    def test_range(self):
+        url = '/uploads/uploads/recording.wav'
+        response = self.client.get(url, HTTP_RANGE = 'bytes=0-3')
+        assert response.status_code == 206
+        assert b''.join(response.streaming_content) == b'RIFF'
+        assert response['Content-Length'] == '4'
+        assert response['Content-Range'] == 'bytes 0-3/%d' % len(EMPTY_WAV)
+        assert response['Accept-Ranges'] == 'bytes'
+
+        response = self.client.get(url, HTTP_RANGE = 'bytes=-4')
+        assert response.status_code == 206
+        assert b''.join(response.streaming_content) == EMPTY_WAV[-4:]
+
+        response = self.client.get(url, HTTP_RANGE = 'bytes=8-')
+        assert b''.join(response.streaming_content) == EMPTY_WAV[8:]
+
+        response = self.client.get(url, HTTP_RANGE = 'bytes=1000-')
+        assert response.status_code == 416
+        assert response['Content-Range'] == 'bytes */%d' % len(EMPTY_WAV)
+
+        # The file changed since the client got the first part
+        response = self.client.get(url, HTTP_RANGE = 'bytes=8-', HTTP_IF_RANGE = '"0-0"')
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == EMPTY_WAV
+
+    def test_parse_range(self):
+        assert parse_range(None, 100) is None
+        assert parse_range('bytes=0-9,20-29', 100) is None
+        assert parse_range('bytes=10-', 100) == (10, 99)
+        assert parse_range('bytes=10-1000', 100) == (10, 99)
+        assert parse_range('bytes=-1000', 100) == (0, 99)
+        with self.assertRaises(UnsatisfiableRange):
+            parse_range('bytes=20-10', 100)
+
+    def test_sendfile(self):
+        with override_settings(MEDIA_SENDFILE = 'x-accel-redirect'):
+            response = self.client.get('/uploads/' + self.content_addressed_name)
+            assert response['X-Accel-Redirect'] == '/protected-uploads/' + self.content_addressed_name
+            assert response['Content-Type'] == 'audio/x-wav'
+            assert response['ETag'] == '"%s"' % self.digest
+            assert not response.content
+        with override_settings(MEDIA_SENDFILE = 'x-sendfile'):
+            response = self.client.get('/uploads/uploads/recording.wav')
+            assert response['X-Sendfile'] == os.path.join(self.media_root.name, 'uploads/recording.wav')
+
+
+class TestCacheableVxml(TestCase):
+
+    def setUp(self):
+        create_sample_call_flow(self)
+
+    def test_not_modified(self):
+        url = reverse('service-development:choice', kwargs = {'element_id': self.choice_element.id,
+                'session_id': self.session.id})
+        response = self.client.get(url)
+        assert response.status_code == 200
+        assert response['ETag']
+        assert 'max-age=0' in response['Cache-Control']
+        assert 'private' in response['Cache-Control']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH = response['ETag'])
+        assert response.status_code == 304
+        # The step is recorded anyway
+        assert CallSessionStep.objects.filter(session = self.session).count() == 2
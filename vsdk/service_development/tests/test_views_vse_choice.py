@@ -8,9 +8,10 @@ from django.core.files.storage import Storage
 
 from ..models import KasaDakaUser, CallSession, CallSessionStep
 from ..models import VoiceService, Choice, ChoiceOption
-from ..models import Language, VoiceLabel, VoiceFragment
+from ..models import Language, VoiceLabel, VoiceFragment, voice_fragment_url_index
+from ..views import choice_generate_context
 
-from .helpers import create_sample_voice_service
+from .helpers import create_sample_voice_service, create_sample_call_flow
 
 class TestChoiceView(TestCase):
     client = Client()
@@ -24,3 +25,32 @@ class TestChoiceView(TestCase):
         response = self.client.get(self.choice_url)
         assert response.status_code == 200
         assert ET.fromstring(response.content), 'Should produce valid XML'
+
+
+class TestChoicePrompts(TestCase):
+
+    def setUp(self):
+        voice_fragment_url_index.invalidate()
+        create_sample_call_flow(self)
+
+    def test_options_prompts(self):
+        context = choice_generate_context(self.choice_element, self.session)
+        language = self.session.language
+        interface_voice_labels = language.get_interface_voice_label_url_dict
+        assert context['choice_options_prompts'] == [
+                {'pre': interface_voice_labels['pre_choice_option'],
+                    'label': self.choice_option1.get_voice_fragment_url(language),
+                    'post': interface_voice_labels['post_choice_option'],
+                    'digit': language.get_voice_label_url(language.one_id)},
+                {'pre': interface_voice_labels['pre_choice_option'],
+                    'label': self.choice_option2.get_voice_fragment_url(language),
+                    'post': interface_voice_labels['post_choice_option'],
+                    'digit': language.get_voice_label_url(language.two_id)},
+                ]
+
+    def test_prompts_in_vxml(self):
+        response = self.client.get(self.choice_element.get_absolute_url(self.session))
+        audio = [element.get('src') for element in ET.fromstring(response.content).iter()
+                if element.tag.endswith('audio')]
+        prompts = choice_generate_context(self.choice_element, self.session)['choice_options_prompts']
+        assert audio[1:] == [prompt[key] for prompt in prompts for key in ['pre', 'label', 'post', 'digit']]
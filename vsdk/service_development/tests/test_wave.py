@@ -0,0 +1,89 @@
+import struct
+import tempfile
+
+import mock
+from django.test import SimpleTestCase
+
+from ..benchmark import EMPTY_WAV
+from ..models.validators import audio_file_format_is_correct
+from ..wave import WaveFormatError, parse_wave_format, read_wave_duration, read_wave_format, read_wave_format_from_url
+
+
+def wave_file(chunks):
+    body = b'WAVE' + b''.join(chunk_id + struct.pack('<I', len(data)) + data + b'\0' * (len(data) & 1)
+            for chunk_id, data in chunks)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+def fmt_chunk(format_tag = 1, channels = 1, sample_rate = 8000, bits_per_sample = 16):
+    block_align = channels * bits_per_sample // 8
+    return (b'fmt ', struct.pack('<HHIIHH', format_tag, channels, sample_rate,
+            sample_rate * block_align, block_align, bits_per_sample))
+
+
+class TestWaveFormat(SimpleTestCase):
+
+    def parse(self, content):
+        return parse_wave_format(lambda offset, size: content[offset:offset + size])
+
+    def test_pcm(self):
+        wave_format = self.parse(EMPTY_WAV)
+        assert wave_format.is_correct
+        assert str(wave_format) == 'PCM, 8000 Hz, 16 bit, 1 channel(s)'
+
+        wave_format = self.parse(wave_file([fmt_chunk(channels = 2, sample_rate = 44100), (b'data', b'')]))
+        assert wave_format.is_pcm
+        assert (wave_format.channels, wave_format.sample_rate) == (2, 44100)
+        assert not wave_format.is_correct
+
+    def test_not_pcm(self):
+        assert not self.parse(wave_file([fmt_chunk(format_tag = 6, bits_per_sample = 8)])).is_correct
+
+    def test_extensible(self):
+        chunk_id, data = fmt_chunk(format_tag = 0xFFFE)
+        data += struct.pack('<HHI', 22, 16, 4) + struct.pack('<H', 1) + b'\x00\x00\x00\x00\x10\x00' \
+                b'\x80\x00\x00\xaa\x00\x38\x9b\x71'
+        assert self.parse(wave_file([(chunk_id, data)])).is_correct
+
+    def test_chunks_before_fmt(self):
+        content = wave_file([(b'LIST', b'x' * 101), fmt_chunk(), (b'data', b'')])
+        reads = []
+        def read(offset, size):
+            reads.append((offset, size))
+            return content[offset:offset + size]
+        assert parse_wave_format(read).is_correct
+        assert len(reads) == 3
+
+    def test_invalid(self):
+        for content in [b'', b'audio', b'RIFF\x04\x00\x00\x00WAVE', EMPTY_WAV[:30]]:
+            with self.assertRaises(WaveFormatError):
+                self.parse(content)
+
+    def test_local_file(self):
+        with tempfile.NamedTemporaryFile(suffix = '.wav') as audio_file:
+            audio_file.write(EMPTY_WAV)
+            audio_file.flush()
+            assert read_wave_format(audio_file.name).is_correct
+            assert audio_file_format_is_correct(audio_file.name)
+        assert not audio_file_format_is_correct('/does/not/exist.wav')
+
+    def test_duration(self):
+        with tempfile.NamedTemporaryFile(suffix = '.wav') as audio_file:
+            audio_file.write(wave_file([(b'LIST', b'x' * 101), fmt_chunk(), (b'data', b'\0' * 8000)]))
+            audio_file.flush()
+            wave_format, duration = read_wave_duration(audio_file.name)
+            assert wave_format.is_correct
+            assert duration == 0.5
+
+            # A recording with an unknown data size
+            audio_file.seek(0)
+            audio_file.write(wave_file([fmt_chunk(), (b'data', b'')]) + b'\0' * 16000)
+            audio_file.flush()
+            assert read_wave_duration(audio_file.name)[1] == 1.0
+
+    def test_url(self):
+        response = mock.MagicMock()
+        response.__enter__.return_value.status = 206
+        response.__enter__.return_value.read.side_effect = lambda size: EMPTY_WAV[:size]
+        with mock.patch('urllib.request.urlopen', return_value = response) as urlopen:
+            assert read_wave_format_from_url('http://example.com/a.wav').is_correct
+        assert urlopen.call_args[0][0].get_header('Range') == 'bytes=0-63'
@@ -0,0 +1,140 @@
+"""
+Background conversion of uploaded Voice Fragments to the format required by
+Asterisk (Wave, 8 kHz, 16 bit, mono, PCM), with sox.
+
+Saving a Voice Fragment with a new audio file (when settings.KASADAKA is set)
+marks it as pending, and queues it after the transaction is committed. The
+files are checked and converted in a pool of AUDIO_CONVERSION_WORKERS processes,
+and the result is recorded on the fragment when the conversion is done. Converted
+files are stored by the hash of their contents, like uploads, and the original
+is deleted once no fragment uses it anymore.
+Fragments that are still pending after a restart can be queued again with the
+convert_voice_fragments management command.
+"""
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+
+from .content_store import deferred_deletions
+from .models.validators import audio_file_format_is_correct
+
+logger = logging.getLogger(__name__)
+
+
+class AudioConversionError(Exception):
+    pass
+
+
+def convert_audio_file(path, converted_path):
+    """
+    Converts the file at path to converted_path, unless it already has the correct
+    format. Returns True if it was converted. Runs in a worker process.
+    """
+    if audio_file_format_is_correct(path):
+        return False
+    result = subprocess.run(['sox', '-S', path, '-r', '8k', '-b', '16', '-c', '1', '-e', 'signed-integer',
+            converted_path], stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+    if result.returncode != 0:
+        raise AudioConversionError(result.stdout.strip() or 'sox exited with status %d' % result.returncode)
+    return True
+
+
+class AudioConversionQueue(object):
+    """
+    Queues Voice Fragments for conversion in a process pool, which is started
+    the first time a fragment is queued.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers = settings.AUDIO_CONVERSION_WORKERS)
+            return self._executor
+
+    def shutdown(self):
+        """
+        Waits until all queued conversions are done and recorded, and stops the worker processes.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait = True)
+
+    def add(self, fragment):
+        """
+        Queues the conversion of the audio file of fragment, once the current transaction is committed.
+        """
+        transaction.on_commit(partial(self.submit, fragment.id, fragment.audio.name))
+
+    def submit(self, fragment_id, name):
+        """
+        Starts the conversion of the audio file name of a fragment, and returns its Future.
+        """
+        from .models import VoiceFragment
+        storage = VoiceFragment._meta.get_field('audio').storage
+        converted_file, converted_path = tempfile.mkstemp(suffix = '.wav')
+        os.close(converted_file)
+        future = self.executor().submit(convert_audio_file, storage.path(name), converted_path)
+        future.add_done_callback(partial(self._finished, fragment_id, name, converted_path, threading.get_ident()))
+        return future
+
+    def _finished(self, fragment_id, name, converted_path, submitted_from, future):
+        try:
+            self.finish(fragment_id, name, converted_path, future)
+        finally:
+            if os.path.exists(converted_path):
+                os.remove(converted_path)
+            if threading.get_ident() != submitted_from:
+                # Done callbacks run in a thread of the executor, with its own database connection
+                connection.close()
+
+    def finish(self, fragment_id, name, converted_path, future):
+        """
+        Records the result of a conversion on the fragment, unless another audio
+        file was uploaded in the meantime. The converted file at converted_path
+        is stored under the hash of its contents.
+        """
+        from .media import audio_file_cache
+        from .models import VoiceFragment, voice_fragment_url_index, validation_queue
+        try:
+            field = VoiceFragment._meta.get_field('audio')
+            fields = {'conversion_status': 'correct', 'conversion_error': ''}
+            try:
+                if future.result():
+                    with open(converted_path, 'rb') as converted_file:
+                        converted_name = field.store_content(File(converted_file), '.wav')
+                    fields = {'audio': converted_name, 'conversion_status': 'converted', 'conversion_error': ''}
+            except Exception as e:
+                logger.warning('Could not convert %s: %s', name, e)
+                fields = {'conversion_status': 'failed', 'conversion_error': str(e)}
+
+            # Updated without saving, which would queue the fragment again
+            fragments = VoiceFragment.objects.filter(pk = fragment_id, audio = name)
+            fragment = fragments.first()
+            if fragment is None or not fragments.update(**fields):
+                if 'audio' in fields:
+                    deferred_deletions.add(field.storage, [fields['audio']])
+                return
+            if 'audio' in fields:
+                voice_fragment_url_index.invalidate(fragment.language_id)
+                audio_file_cache.invalidate(name)
+                validation_queue.add_voice_label(fragment.parent_id)
+                # Other processes may serve the original from their caches for a while
+                deferred_deletions.add(field.storage, [name])
+        except Exception:
+            logger.exception('Could not record the conversion of %s', name)
+
+
+audio_conversion_queue = AudioConversionQueue()
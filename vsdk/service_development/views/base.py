@@ -1,5 +1,9 @@
+from functools import wraps
+
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, get_list_or_404, redirect
 from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, set_response_etag
 
 
 def index(request):
@@ -31,3 +35,20 @@ def reverse_add_get_parameters(url_name, *args, **kwargs):
     url = reverse(url_name, args = args)
     params = urllib.parse.urlencode(kwargs)
     return url + "?%s" % params
+
+def cacheable_vxml(view):
+    """
+    Adds an ETag and Cache-Control (with settings.VXML_MAX_AGE) to the VoiceXML
+    documents returned by a view, and answers 304 Not Modified when the VoiceXML
+    browser has the same document cached. The view itself still runs, so the
+    step of the session is recorded.
+    """
+    @wraps(view)
+    def cacheable_view(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD') or response.status_code != 200 or response.streaming:
+            return response
+        set_response_etag(response)
+        patch_cache_control(response, private = True, max_age = settings.VXML_MAX_AGE)
+        return get_conditional_response(request, etag = response['ETag'], response = response)
+    return cacheable_view
@@ -2,13 +2,19 @@ from django.shortcuts import render, get_object_or_404, get_list_or_404, redirec
 from django.urls import reverse
 from django.views.generic import TemplateView
 from django.http.response import HttpResponseRedirect
+from django.utils.decorators import method_decorator
 
 from ..models import CallSession, VoiceService, Language
+from .base import cacheable_vxml
+from .vse_choice import choice_option_prompt
 
 class LanguageSelection(TemplateView):
 
     def render_language_selection_form(self, request, session, redirect_url):
         languages = session.service.supported_languages.all()
+        # Every language is read out in the language itself
+        language_prompts = [choice_option_prompt(language, number, language.get_description_voice_label_url)
+                for number, language in enumerate(languages, 1)]
 
         # This is the redirect URL to POST the language selected
         redirect_url_POST = reverse('service-development:language-selection', args = [session.id])
@@ -17,11 +23,13 @@ class LanguageSelection(TemplateView):
         pass_on_variables = {'redirect_url' : redirect_url}
 
         context = {'languages' : languages,
+                   'language_prompts' : language_prompts,
                    'redirect_url' : redirect_url_POST,
                    'pass_on_variables' : pass_on_variables
                    }
         return render(request, 'language_selection.xml', context, content_type='text/xml')
 
+    @method_decorator(cacheable_vxml)
     def get(self, request, session_id):
         """
         Asks the user to select one of the supported languages.
@@ -0,0 +1,171 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from ..content_store import content_digest, is_content_addressed
+
+
+def media_etag(path, stat):
+    """
+    The hash of a content-addressed file, or its modification time and size.
+    """
+    if is_content_addressed(path):
+        return quote_etag(content_digest(path))
+    return quote_etag('%x-%x' % (stat.st_mtime_ns, stat.st_size))
+
+
+RANGE = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+
+
+class UnsatisfiableRange(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Returns the first and last byte of the Range header of a request for a file
+    of size bytes, or None to send the whole file (without a Range header, or with
+    one that can not be parsed or asks for multiple ranges).
+    Raises UnsatisfiableRange if the range is outside of the file.
+    """
+    match = RANGE.match(header.replace(' ', '')) if header else None
+    if match is None or not (match.group('start') or match.group('end')):
+        return None
+    if not match.group('start'):
+        # The last bytes of the file
+        length = int(match.group('end'))
+        if length == 0 or size == 0:
+            raise UnsatisfiableRange()
+        return max(0, size - length), size - 1
+    start = int(match.group('start'))
+    end = min(int(match.group('end')), size - 1) if match.group('end') else size - 1
+    if start >= size or start > end:
+        raise UnsatisfiableRange()
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    """
+    True if the Range of a request applies, because it has no If-Range header or
+    the file did not change since.
+    """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+class FileRange(object):
+    """
+    A file-like object reading length bytes of a file, from offset start.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size = -1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def sendfile_response(path, full_path, content_type):
+    """
+    Returns an empty response that lets the web server in front of Django send the
+    file (settings.MEDIA_SENDFILE), or None if Django sends files itself. The web
+    server fills in the length, and handles byte ranges.
+    """
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        response = HttpResponse(content_type = content_type)
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_SENDFILE_URL + path)
+    elif settings.MEDIA_SENDFILE == 'x-sendfile':
+        response = HttpResponse(content_type = content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        return None
+    return response
+
+
+def file_response(request, full_path, stat, etag, last_modified, content_type):
+    """
+    Streams the file, or the byte range of it that was requested.
+    """
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), stat.st_size) \
+                if if_range_matches(request, etag, last_modified) else None
+    except UnsatisfiableRange:
+        response = HttpResponse(status = 416)
+        response['Content-Range'] = 'bytes */%d' % stat.st_size
+        return response
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type = content_type)
+        response['Content-Length'] = stat.st_size
+    else:
+        start, end = byte_range
+        response = FileResponse(FileRange(open(full_path, 'rb'), start, end - start + 1), status = 206,
+                content_type = content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, stat.st_size)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def serve_media(request, path):
+    """
+    Serves an uploaded file from MEDIA_ROOT, with an ETag, Last-Modified and
+    Cache-Control (immutable for content-addressed files), and answers conditional
+    requests for unchanged files with 304 Not Modified.
+
+    The file is sent by the web server when settings.MEDIA_SENDFILE is set, and
+    otherwise streamed with FileResponse (with sendfile() where the WSGI server
+    supports it), including single byte ranges.
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (ValueError, OSError):
+        raise Http404('"%s" does not exist' % path)
+    if not os.path.isfile(full_path):
+        raise Http404('"%s" does not exist' % path)
+
+    etag = media_etag(path, stat)
+    last_modified = int(stat.st_mtime)
+    if is_content_addressed(path):
+        cache_control = {'public': True, 'max_age': settings.CONTENT_ADDRESSED_MEDIA_MAX_AGE, 'immutable': True}
+    else:
+        cache_control = {'public': True, 'max_age': settings.MEDIA_MAX_AGE}
+
+    response = get_conditional_response(request, etag = etag, last_modified = last_modified)
+    if response is not None and response.status_code != 304:
+        # 412 Precondition Failed
+        return response
+    if response is None:
+        content_type, encoding = mimetypes.guess_type(full_path)
+        content_type = content_type or 'application/octet-stream'
+        response = sendfile_response(path, full_path, content_type) or \
+                file_response(request, full_path, stat, etag, last_modified, content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, **cache_control)
+    return response
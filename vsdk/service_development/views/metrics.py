@@ -0,0 +1,12 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse
+
+from ..metrics import metrics_registry
+
+
+@staff_member_required
+def metrics(request):
+    """
+    The request metrics of the VoiceXML views in this process, as plain text (for staff members).
+    """
+    return HttpResponse(metrics_registry.render(), content_type = 'text/plain; version=0.0.4')
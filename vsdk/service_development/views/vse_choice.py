@@ -1,6 +1,7 @@
 from django.shortcuts import render, get_object_or_404, get_list_or_404, redirect
 
 from ..models import *
+from .base import cacheable_vxml
 
 
 def choice_options_resolve_redirect_urls(choice_options, session):
@@ -19,6 +20,32 @@ def choice_options_resolve_voice_labels(choice_options, language):
         choice_options_voice_labels.append(choice_option.get_voice_fragment_url(language))
     return choice_options_voice_labels
 
+def choice_option_prompt(language, number, voice_label_url):
+    """
+    Returns the audio URLs to read out a single option in the given language:
+    pre = the interface label read before the option
+    label = the provided voice_label_url of the option itself
+    post = the interface label read after the option
+    digit = the number to press to select the option ('' if it is above 9)
+    """
+    if not language:
+        return {'pre': '', 'label': voice_label_url, 'post': '', 'digit': ''}
+    interface_voice_labels = language.get_interface_voice_label_url_dict
+    number_samples = language.number_samples
+    return {'pre': interface_voice_labels['pre_choice_option'],
+            'label': voice_label_url,
+            'post': interface_voice_labels['post_choice_option'],
+            'digit': number_samples.get(number, '') if number < 10 else '',
+            }
+
+def choice_options_resolve_prompts(choice_options_voice_labels, language):
+    """
+    Returns a list of prompts (see choice_option_prompt) for the options
+    with the provided Voice Label URL's, numbered from 1.
+    """
+    return [choice_option_prompt(language, number, voice_label_url)
+            for number, voice_label_url in enumerate(choice_options_voice_labels, 1)]
+
 def choice_generate_context(choice_element, session):
     """
     Returns a dict that can be used to generate the choice VXML template
@@ -27,21 +54,25 @@ def choice_generate_context(choice_element, session):
     choice_options = iterable of ChoiceOption object belonging to this Choice element
     choice_options_voice_labels = list of resolved Voice Label URL's referencing to the choice_options in the same position
     choice_options_redirect_urls = list of resolved redirection URL's referencing to the choice_options in the same position
+    choice_options_prompts = list of prompts to read out the choice_options in the same position (see choice_option_prompt)
         """
     choice_options =  choice_element.choice_options.all()
     language = session.language
+    choice_options_voice_labels = choice_options_resolve_voice_labels(choice_options, language)
     context = {'choice':choice_element,
                 'choice_voice_label':choice_element.get_voice_fragment_url(language),
                 'choice_options': choice_options,
-                'choice_options_voice_labels':choice_options_resolve_voice_labels(choice_options, language),
+                'choice_options_voice_labels':choice_options_voice_labels,
+                'choice_options_prompts':choice_options_resolve_prompts(choice_options_voice_labels, language),
                     'choice_options_redirect_urls': choice_options_resolve_redirect_urls(choice_options,session),
                     'language': language,
                     }
     return context
 
+@cacheable_vxml
 def choice(request, element_id, session_id):
-    choice_element = get_object_or_404(Choice, pk=element_id)
     session = get_object_or_404(CallSession, pk=session_id)
+    choice_element = get_element_or_404(Choice, element_id, session)
     session.record_step(choice_element)
     context = choice_generate_context(choice_element, session)
     
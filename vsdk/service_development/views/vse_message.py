@@ -1,6 +1,7 @@
 from django.shortcuts import render, get_object_or_404, get_list_or_404, redirect
 
 from ..models import *
+from .base import cacheable_vxml
 
 def message_presentation_get_redirect_url(message_presentation_element,session):
     if not message_presentation_element.final_element:
@@ -19,9 +20,10 @@ def message_presentation_generate_context(message_presentation_element,session):
     return context
 
 
+@cacheable_vxml
 def message_presentation(request, element_id, session_id):
-    message_presentation_element = get_object_or_404(MessagePresentation, pk=element_id)
     session = get_object_or_404(CallSession, pk=session_id)
+    message_presentation_element = get_element_or_404(MessagePresentation, element_id, session)
     session.record_step(message_presentation_element)
     context = message_presentation_generate_context(message_presentation_element, session)
     
@@ -1,6 +1,9 @@
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
 from django.shortcuts import render, get_object_or_404, get_list_or_404, redirect
+from django.views.decorators.csrf import csrf_exempt
 
 from ..models import *
+from .base import cacheable_vxml
 
 
 def record_get_redirect_url(record_element, session):
@@ -33,23 +36,26 @@ def record_generate_context(record_element, session):
     return context
 
 
+@csrf_exempt
+@cacheable_vxml
 def record(request, element_id, session_id):
-    record_element = get_object_or_404(Record, pk=element_id)
-    voice_service = record_element.service
-    session = lookup_or_create_session(voice_service, session_id)
+    if request.method == "POST":
+        # Recordings are streamed to a temporary file in chunks, instead of into memory
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
 
+    session = get_object_or_404(CallSession, pk=session_id)
+    record_element = get_element_or_404(Record, element_id, session)
 
-    if request.method == "POST":
-        session = get_object_or_404(CallSession, pk=session_id)
 
+    if request.method == "POST":
         value = 'audio file'
 
         result = SpokenUserInput()
 
         result.session = session
 
+        # Stored under the hash of its contents, and processed in the background
         result.audio = request.FILES['recording']
-        result.audio.name = 'recording_%s_%s.wav' % (session_id, element_id)
         result.category = record_element.input_category 
 
         result.save()
@@ -0,0 +1,140 @@
+"""
+Reads the format of Wave (RIFF/WAVE) audio files from their header, without
+reading the audio itself, from a local file or over HTTP with Range requests.
+"""
+import os
+import struct
+import urllib.request
+from collections import namedtuple
+
+from django.conf import settings
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# The number of bytes read at once, which is enough for the header of most files
+HEADER_SIZE = 64
+
+
+class WaveFormatError(ValueError):
+    pass
+
+
+class WaveFormat(namedtuple('WaveFormat', ['format_tag', 'channels', 'sample_rate', 'byte_rate',
+        'block_align', 'bits_per_sample'])):
+    """
+    The contents of the fmt chunk of a Wave file. For WAVE_FORMAT_EXTENSIBLE files,
+    format_tag is the tag of the sub-format.
+    """
+
+    @property
+    def is_pcm(self):
+        return self.format_tag == WAVE_FORMAT_PCM
+
+    @property
+    def is_correct(self):
+        """
+        True if this is the format required by Asterisk: 8 kHz, 16 bit, mono, PCM.
+        """
+        return self.is_pcm and self.sample_rate == 8000 and self.bits_per_sample == 16 and self.channels == 1
+
+    def __str__(self):
+        return '%s, %d Hz, %d bit, %d channel(s)' % ('PCM' if self.is_pcm else 'format 0x%04x' % self.format_tag,
+                self.sample_rate, self.bits_per_sample, self.channels)
+
+
+def buffered_reader(read):
+    """
+    Returns a read(offset, size) function like read, which reads the header at once.
+    """
+    header = read(0, HEADER_SIZE)
+
+    def read_from(offset, size):
+        if offset + size <= len(header):
+            return header[offset:offset + size]
+        return read(offset, size)
+
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        raise WaveFormatError('Not a RIFF/WAVE file')
+    return read_from
+
+
+def find_chunk(read, wanted_id):
+    """
+    Returns the offset of the contents and the size of the first chunk with id wanted_id.
+    """
+    offset = 12
+    while True:
+        chunk_header = read(offset, 8)
+        if len(chunk_header) < 8:
+            raise WaveFormatError('No %s chunk' % wanted_id.decode('ascii').strip())
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+        if chunk_id == wanted_id:
+            return offset + 8, chunk_size
+        # Chunks are padded to an even size
+        offset += 8 + chunk_size + (chunk_size & 1)
+
+
+def parse_wave_format(read):
+    """
+    Finds and parses the fmt chunk of a Wave file, where read(offset, size) returns
+    (at most) size bytes of the file at offset. Raises WaveFormatError if the file
+    is not a Wave file.
+    """
+    read_from = buffered_reader(read)
+    offset, chunk_size = find_chunk(read_from, b'fmt ')
+    chunk = read_from(offset, min(chunk_size, 40))
+    if len(chunk) < 16:
+        raise WaveFormatError('Truncated fmt chunk')
+    wave_format = WaveFormat(*struct.unpack('<HHIIHH', chunk[:16]))
+    if wave_format.format_tag == WAVE_FORMAT_EXTENSIBLE:
+        if len(chunk) < 26:
+            raise WaveFormatError('Truncated fmt chunk')
+        # The sub-format GUID starts with the format tag
+        wave_format = wave_format._replace(format_tag = struct.unpack('<H', chunk[24:26])[0])
+    return wave_format
+
+
+def read_wave_format(path):
+    """
+    Returns the WaveFormat of the local file at path.
+    """
+    with open(path, 'rb') as wave_file:
+        def read(offset, size):
+            wave_file.seek(offset)
+            return wave_file.read(size)
+        return parse_wave_format(read)
+
+
+def read_wave_duration(path):
+    """
+    Returns the WaveFormat and the duration in seconds of the local file at path.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as wave_file:
+        def read(offset, size):
+            wave_file.seek(offset)
+            return wave_file.read(size)
+        read = buffered_reader(read)
+        wave_format = parse_wave_format(read)
+        offset, data_size = find_chunk(read, b'data')
+    if not wave_format.byte_rate:
+        raise WaveFormatError('No byte rate')
+    # Recordings that were not closed properly have an unknown (0 or maximum) data size
+    data_size = min(data_size or file_size, file_size - offset)
+    return wave_format, data_size / wave_format.byte_rate
+
+
+def read_wave_format_from_url(url):
+    """
+    Returns the WaveFormat of the file at url, with HTTP Range requests for the header only.
+    """
+    def read(offset, size):
+        request = urllib.request.Request(url, headers = {'Range': 'bytes=%d-%d' % (offset, offset + size - 1)})
+        with urllib.request.urlopen(request, timeout = settings.MEDIA_VALIDATION_TIMEOUT) as response:
+            if response.status == 206:
+                return response.read(size)
+            # The server ignored the Range header, and sends the whole file
+            response.read(offset)
+            return response.read(size)
+    return parse_wave_format(read)
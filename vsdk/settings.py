@@ -60,6 +60,7 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'vsdk.service_development.metrics.RequestMetricsMiddleware',
     #TODO: disabled csrf middleware, is this usable with voiceXML?
     #    'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -71,7 +72,7 @@ ROOT_URLCONF = 'vsdk.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'vsdk.service_development.metrics.InstrumentedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -200,6 +201,9 @@ else:
 #Only set this to True when sox and mediainfo are available, and local storage is used for static files.
 KASADAKA = False
 
+#Number of worker processes converting uploaded audio files to the correct format (on a KasaDaka system).
+AUDIO_CONVERSION_WORKERS = 2
+
 LOCALE_PATHS = (
         os.path.join(os.path.abspath(os.path.dirname(__file__)), 'locale'),
             )
@@ -212,6 +216,94 @@ LANGUAGES = (
 ASTERISK_EXTENSIONS_FILE = '/etc/asterisk/extensions.conf'
 VXML_HOST_ADDRESS = 'http://127.0.0.1'
 
+#Buffer the steps of call sessions in memory, and save them in batches of at most
+#CALL_SESSION_STEP_BUFFER_SIZE steps, or every CALL_SESSION_STEP_BUFFER_MAX_AGE seconds.
+CALL_SESSION_STEP_BUFFERING = False
+CALL_SESSION_STEP_BUFFER_SIZE = 100
+CALL_SESSION_STEP_BUFFER_MAX_AGE = 5
+
+#Number of seconds after which the in-memory index of Voice Fragment URLs is reloaded,
+#to pick up Voice Fragments changed by other processes.
+VOICE_FRAGMENT_URL_INDEX_TIMEOUT = 60
+
+#Number of seconds before files that are no longer used are deleted (by the rehash_media and reshard_media
+#management commands, and after conversions), so running processes have reloaded the new names
+#(longer than VOICE_FRAGMENT_URL_INDEX_TIMEOUT).
+MEDIA_DELETION_GRACE_PERIOD = 120
+
+#Validation of Voice Services checks the audio files of their Voice Fragments on at most
+#MEDIA_VALIDATION_WORKERS threads at once (with a timeout of MEDIA_VALIDATION_TIMEOUT seconds
+#for files checked over HTTP), and reuses the results for MEDIA_VALIDATION_CACHE_TIMEOUT seconds.
+MEDIA_VALIDATION_WORKERS = 8
+MEDIA_VALIDATION_TIMEOUT = 10
+MEDIA_VALIDATION_CACHE_TIMEOUT = 60
+
+#Number of seconds after which the in-memory mapping from voice services to the vote
+#options of their polls is reloaded, to pick up polls changed by other processes.
+POLLS_BIP_ROUTES_TIMEOUT = 10
+
+#Buffer incoming bips in memory, and save them as votes in batches of at most
+#POLLS_BIP_BUFFER_SIZE votes, or every POLLS_BIP_BUFFER_MAX_AGE seconds.
+POLLS_BIP_BUFFERING = False
+POLLS_BIP_BUFFER_SIZE = 500
+POLLS_BIP_BUFFER_MAX_AGE = 1
+
+#Votes cast up to POLLS_VOTES_CURSOR_OVERLAP seconds before the cursor of a client are sent
+#again, as votes that are committed late can have a lower id than the cursor.
+POLLS_VOTES_CURSOR_OVERLAP = 10
+
+#Live poll results (server-sent events) are only streamed when POLLS_LIVE_STREAMING is set,
+#which requires an asynchronous worker class (gunicorn -k gevent), since every open stream
+#holds a worker. Otherwise, clients poll for new votes every POLLS_LIVE_POLL_INTERVAL seconds.
+POLLS_LIVE_STREAMING = False
+POLLS_LIVE_POLL_INTERVAL = 5
+
+#Streamed live poll results: the number of seconds between checks for new
+#votes (once per poll per process), between keep-alive comments, and after which
+#a stream is closed (clients reconnect automatically).
+POLLS_LIVE_INTERVAL = 1
+POLLS_LIVE_KEEP_ALIVE_INTERVAL = 15
+POLLS_LIVE_STREAM_TIMEOUT = 300
+
+#Number of seconds after the end of a time bucket of a vote histogram after which
+#it is considered finished, and kept in memory.
+POLLS_HISTOGRAM_SETTLE_TIME = 60
+
+#Requests to the VoiceXML views with more than REQUEST_METRICS_SLOW_QUERY_COUNT queries, or
+#taking more than REQUEST_METRICS_SLOW_REQUEST_TIME seconds, are logged with their SQL.
+REQUEST_METRICS_SLOW_QUERY_COUNT = 20
+REQUEST_METRICS_SLOW_REQUEST_TIME = 1.0
+
+#Cache-Control max-age (in seconds) of media files served by Django. Content-addressed
+#files never change, and are cached for CONTENT_ADDRESSED_MEDIA_MAX_AGE seconds.
+MEDIA_MAX_AGE = 3600
+CONTENT_ADDRESSED_MEDIA_MAX_AGE = 365 * 24 * 3600
+
+#Cache-Control max-age (in seconds) of the VoiceXML documents of elements. With 0, the
+#VoiceXML browser revalidates a cached document on every visit (and gets 304 Not Modified
+#if it did not change), so every step of a call is still recorded.
+VXML_MAX_AGE = 0
+
+#Let the web server in front of Django send media files (with byte ranges): 'x-accel-redirect'
+#(nginx, with an internal location for MEDIA_SENDFILE_URL pointing to MEDIA_ROOT) or 'x-sendfile'
+#(Apache mod_xsendfile, lighttpd). With None, Django streams them itself.
+MEDIA_SENDFILE = None
+MEDIA_SENDFILE_URL = '/protected-uploads/'
+
+#Splice the audio files of announcements (like spoken numbers) into a single file, so
+#the VoiceXML browser fetches one file per announcement. At most AUDIO_SPLICING_CACHE_SIZE
+#sequences of files are remembered in memory, for AUDIO_SPLICING_CACHE_TIMEOUT seconds.
+#Spliced files that are no longer used are deleted with the clean_spliced_audio management command.
+AUDIO_SPLICING = True
+AUDIO_SPLICING_CACHE_SIZE = 10000
+AUDIO_SPLICING_CACHE_TIMEOUT = 3600
+
+#Directory layout of the audio files of Voice Fragments and recordings (Spoken User Inputs)
+#below their upload directory: 'hash' (ab/cd/<hash>.wav) or 'date' (2018/05/31/<hash>.wav), or
+#the dotted path of a layout class. Existing files are moved with the reshard_media command.
+FRAGMENT_UPLOAD_LAYOUT = 'hash'
+RECORDING_UPLOAD_LAYOUT = 'date'
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -238,6 +330,10 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'vsdk.service_development.metrics': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
     }
 }
 
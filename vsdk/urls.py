@@ -13,12 +13,16 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
+import re
+
 from django.conf.urls import url, include
 from django.contrib import admin
 from django.conf.urls.static import static
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
 
+from vsdk.service_development.views import serve_media
+
 admin.site.site_header = _("KasaDaka Voice Services")
 
 urlpatterns = [
@@ -28,4 +32,8 @@ urlpatterns = [
     url(r'^nums/', include('vsdk.nums.urls')),
 ]
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+if settings.MEDIA_URL.startswith('/'):
+    # Uploads on this server, with caching headers (also when DEBUG is off)
+    urlpatterns += [
+        url(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+    ]